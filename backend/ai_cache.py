@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import schemas
+from cache import TTLCache
+
+# Cache of AI assistant answers keyed by the normalized request, so near-identical questions about the same
+# symptom set don't each cost a Gemini round trip.
+# Tier 1 is the per-worker TTL/LRU cache. Tier 2 (optional, AI_CACHE_DB_PATH) is a SQLite file shared by all
+# workers on the host that survives restarts.
+
+AI_CACHE_TTL_SECONDS = float(os.getenv("AI_CACHE_TTL_SECONDS", "86400"))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "1000"))
+AI_CACHE_DB_PATH = os.getenv("AI_CACHE_DB_PATH") # e.g. ./ai_cache.sqlite3; unset disables the disk tier
+# Expired disk entries are deleted at startup and then at most this often (on a write), not on every write
+AI_CACHE_PURGE_INTERVAL_SECONDS = float(os.getenv("AI_CACHE_PURGE_INTERVAL_SECONDS", "3600"))
+
+
+def ai_request_cache_key(request: schemas.AIAssistantRequest, model_name: str, context: Optional[str] = None) -> str:
+    """
+    Hash of the request fields that determine the answer, normalized for case, order and whitespace.
+    context is the server-assembled case context for requests with a case_id, so the key changes with the case.
+    """
+    normalized = {
+        "symptoms": sorted({" ".join(symptom.split()).lower() for symptom in request.patient_symptoms}),
+        "history": hashlib.sha256((request.patient_history or "").strip().encode("utf-8")).hexdigest(),
+        "prompt": " ".join((request.prompt or "").split()).lower(),
+        "model": model_name,
+    }
+    if request.case_id:
+        normalized["case_id"] = request.case_id
+        normalized["context"] = hashlib.sha256((context or "").encode("utf-8")).hexdigest()
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    def __init__(self, path: str, purge_interval: float = AI_CACHE_PURGE_INTERVAL_SECONDS):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._purge_interval = purge_interval
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_responses (key TEXT PRIMARY KEY, response TEXT, latency REAL, expires_at REAL)"
+            )
+            # Purges delete a range of expires_at instead of scanning the table
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ai_responses_expires_at ON ai_responses (expires_at)")
+            self._purge_expired()
+
+    def get(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, latency, expires_at FROM ai_responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[2] <= time.time():
+            return None
+        return row
+
+    def set(self, key: str, response: str, latency: float, expires_at: float) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ai_responses (key, response, latency, expires_at) VALUES (?, ?, ?, ?)",
+                (key, response, latency, expires_at),
+            )
+            if time.time() >= self._next_purge_at:
+                self._purge_expired()
+
+    def _purge_expired(self) -> None:
+        """Deletes expired entries; the caller holds the lock and the transaction."""
+        now = time.time()
+        self._conn.execute("DELETE FROM ai_responses WHERE expires_at <= ?", (now,))
+        self._next_purge_at = now + self._purge_interval
+
+
+class AIResponseCache:
+    def __init__(self, maxsize: int, ttl: float, db_path: Optional[str] = None):
+        self.ttl = ttl
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl, name="ai_responses")
+        self._disk = _DiskTier(db_path) if db_path else None
+        self.disk_hits = 0
+        self.saved_seconds = 0.0 # Sum of the original generation latency of every answer served from cache
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is None and self._disk is not None:
+            try:
+                row = await asyncio.get_running_loop().run_in_executor(None, self._disk.get, key)
+            except sqlite3.Error as e: # The disk tier is best effort; fall back to generating
+                print(f"Error reading AI response cache: {e}")
+                row = None
+            if row is not None:
+                self.disk_hits += 1
+                entry = (row[0], row[1])
+                self._memory.set(key, entry, expires_at=row[2])
+        if entry is None:
+            return None
+        response_text, latency = entry
+        self.saved_seconds += latency
+        return response_text
+
+    async def set(self, key: str, response_text: str, latency: float) -> None:
+        expires_at = time.time() + self.ttl
+        self._memory.set(key, (response_text, latency), expires_at=expires_at)
+        if self._disk is not None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._disk.set, key, response_text, latency, expires_at)
+            except sqlite3.Error as e:
+                print(f"Error writing AI response cache: {e}")
+
+    def stats(self) -> dict:
+        # A disk hit first counts as a memory miss
+        hits = self._memory.hits + self.disk_hits
+        misses = self._memory.misses - self.disk_hits
+        lookups = hits + misses
+        return {
+            "name": self._memory.name,
+            "size": len(self._memory),
+            "maxsize": self._memory.maxsize,
+            "hits": hits,
+            "memory_hits": self._memory.hits,
+            "disk_hits": self.disk_hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "disk_enabled": self._disk is not None,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
+
+
+ai_response_cache = AIResponseCache(AI_CACHE_MAX_ENTRIES, AI_CACHE_TTL_SECONDS, AI_CACHE_DB_PATH)
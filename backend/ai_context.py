@@ -0,0 +1,112 @@
+import os
+from string import Template
+from typing import List, Optional
+
+from firebase_admin import firestore
+
+from models import symptoms_from_firestore
+
+# Server-side prompt assembly for the AI assistant.
+# With a case_id the server loads the case and its recent chat messages itself, and trims them to
+# AI_PROMPT_TOKEN_BUDGET, so long histories neither travel over the wire nor blow up prompt size and cost.
+
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv("AI_PROMPT_TOKEN_BUDGET", "2000"))
+AI_CONTEXT_MAX_CHAT_MESSAGES = int(os.getenv("AI_CONTEXT_MAX_CHAT_MESSAGES", "30"))
+CHARS_PER_TOKEN = 4 # Rough average for English text; avoids a count_tokens round trip per request
+
+# Compiled once at import; sections are substituted per request
+ASSISTANT_PROMPT_TEMPLATE = Template("""
+You are a medical AI assistant helping a doctor review a patient case. Please provide concise,
+professional medical information based on your medical knowledge.
+
+PATIENT INFORMATION:
+${patient_lines}${history_section}${conversation_section}
+DOCTOR'S QUESTION: ${question}
+
+Please provide a medically accurate response. If you're uncertain, indicate the limitations of your knowledge.
+""")
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max(max_chars - 3, 0)] + "..."
+
+
+def build_assistant_prompt(
+    question: Optional[str],
+    symptoms: List[str],
+    patient_details: Optional[List[str]] = None,
+    history: Optional[str] = None,
+    chat_lines: Optional[List[str]] = None,
+    token_budget: int = AI_PROMPT_TOKEN_BUDGET,
+) -> str:
+    """
+    Fills ASSISTANT_PROMPT_TEMPLATE within token_budget.
+    The question, symptoms and patient details are always kept. The medical history may use up to half of the
+    remaining budget and is truncated beyond that. The rest goes to chat messages, newest first.
+    chat_lines are expected in chronological order.
+    """
+    patient_lines = "".join(f"- {detail}\n" for detail in (patient_details or []))
+    patient_lines += f"- Symptoms: {', '.join(symptoms)}\n"
+    sections = {"patient_lines": patient_lines, "history_section": "", "conversation_section": "", "question": question or ""}
+    remaining = token_budget - estimate_tokens(ASSISTANT_PROMPT_TEMPLATE.substitute(sections))
+
+    if history and remaining > 0:
+        history_prefix = "- Medical History: "
+        history_tokens = remaining // 2 if chat_lines else remaining
+        sections["history_section"] = history_prefix + _truncate_to_tokens(history, history_tokens - estimate_tokens(history_prefix)) + "\n"
+        remaining -= estimate_tokens(sections["history_section"])
+
+    if chat_lines and remaining > 0:
+        header = "\nRECENT CONVERSATION (oldest first):\n"
+        remaining -= estimate_tokens(header)
+        kept: List[str] = []
+        for line in reversed(chat_lines): # Newest messages are the most relevant
+            line_tokens = estimate_tokens(line) + 1
+            if line_tokens > remaining:
+                break
+            kept.append(line)
+            remaining -= line_tokens
+        if kept:
+            sections["conversation_section"] = header + "".join(f"{line}\n" for line in reversed(kept))
+
+    return ASSISTANT_PROMPT_TEMPLATE.substitute(sections)
+
+
+async def load_case_context(db, case_id: str) -> Optional[dict]:
+    """
+    Reads a case and its most recent chat messages for prompt assembly; returns None if the case doesn't exist.
+    Uses one document read and one query of at most AI_CONTEXT_MAX_CHAT_MESSAGES messages.
+    """
+    case_snapshot = await db.collection(u'patientCases').document(case_id).get()
+    if not case_snapshot.exists:
+        return None
+    case_data = case_snapshot.to_dict()
+
+    chats_snapshot = await db.collection(u'chats') \
+        .where(filter=firestore.FieldFilter("patient_case_id", "==", case_id)) \
+        .order_by("timestamp", direction=firestore.Query.DESCENDING) \
+        .limit(AI_CONTEXT_MAX_CHAT_MESSAGES) \
+        .get()
+    chat_lines = [
+        f"{message.get('sender_type', 'unknown')}: {message.get('content', '')}"
+        for message in (doc.to_dict() for doc in reversed(chats_snapshot))
+    ]
+
+    patient_details = [
+        f"{label}: {case_data[field]}"
+        for field, label in (("age", "Age"), ("gender", "Gender"), ("severity", "Reported severity"))
+        if case_data.get(field) is not None
+    ]
+    return {
+        "symptoms": symptoms_from_firestore(case_data.get("symptoms")),
+        "patient_details": patient_details,
+        "history": case_data.get("medical_history"),
+        "chat_lines": chat_lines,
+    }
@@ -1,30 +1,85 @@
+import hashlib
+import math
+import os
+import time
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from firebase_admin import auth as firebase_auth, credentials
 from google.cloud import firestore # To type hint the db client
 from typing import Optional
 
 import schemas # Your Pydantic models
+from cache import TTLCache
 from database import get_firestore_db # Your new dependency to get Firestore client
+from request_timing import timed_phase
 
 # This scheme can be used to extract the token from the Authorization header
 # The tokenUrl doesn't strictly mean we have a /token endpoint generating these tokens anymore,
 # as Firebase ID tokens are issued by Firebase itself.
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token") # Or consider tokenUrl=""
 
-def get_user_profile(db: firestore.Client, user_id: str) -> Optional[schemas.UserInDB]:
-    """Fetches user profile data from Firestore using their Firebase UID."""
+# Verified ID token claims, keyed by a SHA-256 of the raw token so tokens themselves are never kept in memory.
+# Entries expire at the token's own 'exp'. When revocation checks are enabled, entries are additionally capped
+# at TOKEN_CACHE_REVOCATION_TTL_SECONDS so a revoked token is rejected within that window.
+FIREBASE_CHECK_REVOKED = os.getenv("FIREBASE_CHECK_REVOKED", "false").lower() == "true"
+TOKEN_CACHE_REVOCATION_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_REVOCATION_TTL_SECONDS", "60"))
+token_cache = TTLCache(
+    maxsize=int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000")),
+    ttl=3600.0, # ID tokens live for at most one hour
+    name="firebase_tokens",
+)
+
+async def verify_firebase_token(token: str) -> dict:
+    """
+    Verifies a Firebase ID token and returns its decoded claims, serving repeat tokens from token_cache.
+    Raises the same firebase_auth errors as firebase_auth.verify_id_token on a cache miss.
+    """
+    cache_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    decoded_token = token_cache.get(cache_key)
+    if decoded_token is not None:
+        return decoded_token
+
+    # verify_id_token may fetch Google's public keys (or call the revocation API), so keep it off the event loop
+    decoded_token = await run_in_threadpool(firebase_auth.verify_id_token, token, check_revoked=FIREBASE_CHECK_REVOKED)
+    expires_at = decoded_token.get("exp")
+    if FIREBASE_CHECK_REVOKED:
+        expires_at = min(expires_at or math.inf, time.time() + TOKEN_CACHE_REVOCATION_TTL_SECONDS)
+    token_cache.set(cache_key, decoded_token, expires_at=expires_at)
+    return decoded_token
+
+# Validated user profiles keyed by Firebase UID, so an authenticated request normally costs no Firestore read.
+# Writers of 'users/{uid}' must call invalidate_user_profile(uid).
+user_profile_cache = TTLCache(
+    maxsize=int(os.getenv("USER_PROFILE_CACHE_MAX_ENTRIES", "10000")),
+    ttl=float(os.getenv("USER_PROFILE_CACHE_TTL_SECONDS", "300")),
+    name="user_profiles",
+)
+
+def invalidate_user_profile(user_id: str) -> None:
+    """Drops a cached profile after 'users/{user_id}' has been written."""
+    user_profile_cache.invalidate(user_id)
+
+async def get_user_profile(db: firestore.AsyncClient, user_id: str) -> Optional[schemas.UserResponse]:
+    """Fetches user profile data using their Firebase UID, from user_profile_cache or Firestore."""
+    cached_profile = user_profile_cache.get(user_id)
+    if cached_profile is not None:
+        return cached_profile
+
     user_ref = db.collection(u'users').document(user_id)
-    user_doc = user_ref.get()
+    user_doc = await user_ref.get()
     if user_doc.exists:
         user_data = user_doc.to_dict()
         user_data['id'] = user_doc.id
-        return schemas.UserInDB(**user_data)
-    return None
+        # Validate once into the response model; extra stored fields such as hashed_password are dropped here
+        user_profile = schemas.UserResponse(**user_data)
+        user_profile_cache.set(user_id, user_profile)
+        return user_profile
+    return None # Missing profiles are not cached, so a profile created right after signup is seen immediately
 
 async def get_current_firebase_user(
     token: str = Depends(oauth2_scheme),
-    db: firestore.Client = Depends(get_firestore_db)
+    db: firestore.AsyncClient = Depends(get_firestore_db)
 ) -> schemas.UserResponse: # Return our application-specific user model
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -32,14 +87,16 @@ async def get_current_firebase_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        decoded_token = firebase_auth.verify_id_token(token)
+        with timed_phase("auth"):
+            decoded_token = await verify_firebase_token(token)
         firebase_uid = decoded_token.get("uid")
         if not firebase_uid:
             raise credentials_exception
         
         # At this point, the Firebase user is authenticated.
         # Now, fetch their profile from your Firestore 'users' collection.
-        user_profile = get_user_profile(db, firebase_uid)
+        with timed_phase("auth"):
+            user_profile = await get_user_profile(db, firebase_uid)
         
         if user_profile is None:
             # This case means a Firebase user exists, but they don't have a profile in your app's DB.
@@ -53,19 +110,25 @@ async def get_current_firebase_user(
                 detail="User profile not found in application database."
             )
         
-        # Convert UserInDB to UserResponse if needed, or ensure UserResponse has all necessary fields
-        # For simplicity, assuming UserInDB can be used where UserResponse is expected if fields match
-        # or convert explicitly: return schemas.UserResponse(**user_profile.model_dump())
-        return schemas.UserResponse(**user_profile.model_dump())
+        # get_user_profile already returns a validated UserResponse (shared with the cache, so treat it as read-only)
+        return user_profile
 
-    except firebase_auth.InvalidIdTokenError:
-        raise credentials_exception
+    except HTTPException: # Re-raise the 401/403 raised above instead of turning them into a 500
+        raise
     except firebase_auth.ExpiredIdTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Firebase ID token has expired",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    except firebase_auth.RevokedIdTokenError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Firebase ID token has been revoked",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    except firebase_auth.InvalidIdTokenError:
+        raise credentials_exception
     except Exception as e: # Catch other potential errors during token verification or DB fetch
         print(f"An unexpected error occurred during authentication: {e}")
         raise HTTPException(
@@ -88,7 +151,7 @@ async def get_current_active_user(
 # async def create_user_profile_endpoint(
 #     user_create_data: schemas.UserCreate, # Or a specific profile creation schema
 #     id_token: str = Header(None, alias="Authorization"), # Expect Firebase ID token
-#     db: firestore.Client = Depends(get_firestore_db)
+#     db: firestore.AsyncClient = Depends(get_firestore_db)
 # ):
 #     if not id_token or not id_token.startswith("Bearer "):
 #         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -98,7 +161,7 @@ async def get_current_active_user(
 #         firebase_uid = decoded_token.get("uid")
 #         email = decoded_token.get("email")
 #         # Check if profile already exists
-#         existing_profile = get_user_profile(db, firebase_uid)
+#         existing_profile = await get_user_profile(db, firebase_uid)
 #         if existing_profile:
 #             raise HTTPException(status_code=400, detail="User profile already exists")
 #
@@ -0,0 +1,523 @@
+"""
+Endpoint benchmark: seeds users, doctor profiles, patient cases and chat messages into the Firestore emulator,
+then drives the API routes with concurrent clients and reports throughput, latency percentiles (p50/p95/p99)
+and Firestore RPCs, document reads/writes and queries per request (taken from the Server-Timing header, see
+request_timing.py). Results can be saved as a named baseline and later runs compared against it,
+so a change to main.py can be checked for regressions before it ships.
+
+The app runs in-process (httpx ASGITransport), so numbers include routing, validation and serialization but no
+network hop to the API. Firebase ID tokens are not verified: firebase_auth.verify_id_token is replaced by a stub
+that accepts "bench:<uid>" tokens. The AI assistant uses the fake LLM provider (see llm.py) unless LLM_PROVIDER
+is set explicitly, and the background triage worker is off. The chat WebSocket and the /debug/profiles routes
+(which need PROFILING_ADMIN_UIDS, whose middleware would skew the numbers) are not covered.
+A scenario whose error rate (4xx/5xx responses, bulk responses with failed items and client errors) exceeds
+--max-error-rate fails the run and the results are not saved as a baseline, so a broken route can't pass as a fast one.
+
+Usage (from the backend directory, with the emulator running, e.g. `gcloud emulators firestore start --host-port=localhost:8080`):
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python benchmark.py [--requests 200] [--concurrency 10]
+        [--only list_cases_full,post_chat] [--save-baseline local-mine] [--compare reference] [--threshold 0.10] [--max-error-rate 0.01]
+
+The emulator database is wiped and re-seeded at the start of every run. The script refuses to run without
+FIRESTORE_EMULATOR_HOST, so it can never write to a real project.
+"""
+import argparse
+import asyncio
+import json
+import math
+import re
+import os
+import platform
+import random
+import sys
+import time
+import urllib.request
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+# Must be set before main.py (and through it llm.py / triage_worker.py) is imported
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("AI_TRIAGE_ENABLED", "false")
+os.environ["SERVER_TIMING_ENABLED"] = "true" # Firestore counts are read from the Server-Timing header
+
+import firebase_admin
+from firebase_admin import auth as firebase_auth, credentials
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baselines")
+DEFAULT_PROJECT_ID = "demo-medical-ai" # "demo-" projects are emulator-only by convention
+BENCH_TOKEN_PREFIX = "bench:"
+MAX_BATCH_WRITES = 500 # Firestore limit on writes per batch
+BULK_UPDATE_ITEMS = 20
+
+SYMPTOM_POOL = [
+    "Fever", "Cough", "Headache", "Fatigue", "Nausea", "Chest pain",
+    "Shortness of breath", "Dizziness", "Rash", "Back pain",
+]
+AI_QUESTIONS = [
+    "What are the most likely differential diagnoses?",
+    "Which tests should be ordered first?",
+    "Are there any red flags that need urgent attention?",
+    "What follow-up interval would you recommend?",
+]
+
+# Firestore counts in the Server-Timing header, e.g. firestore;dur=4.1;desc="rpcs=2 reads=1 writes=0 queries=1"
+FIRESTORE_TIMING_PATTERN = re.compile(r'firestore;dur=[\d.]+;desc="([^"]*)"')
+FIRESTORE_COUNTS = ("rpcs", "reads", "writes", "queries")
+
+
+class _EmulatorCredential(credentials.Base):
+    """The emulator accepts any credentials; avoids needing a service account key."""
+
+    def get_credential(self):
+        from google.auth.credentials import AnonymousCredentials
+        return AnonymousCredentials()
+
+
+def init_firebase_for_emulator(project_id: str) -> None:
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        sys.exit("FIRESTORE_EMULATOR_HOST is not set; the benchmark only runs against the Firestore emulator.")
+    if not firebase_admin._apps: # database.py skips its own initialization when an app exists
+        firebase_admin.initialize_app(_EmulatorCredential(), {"projectId": project_id})
+
+
+def reset_emulator(project_id: str) -> None:
+    host = os.environ["FIRESTORE_EMULATOR_HOST"]
+    url = f"http://{host}/emulator/v1/projects/{project_id}/databases/(default)/documents"
+    urllib.request.urlopen(urllib.request.Request(url, method="DELETE")).close()
+
+
+def stub_verify_id_token(id_token: str, check_revoked: bool = False, app=None) -> dict:
+    """Accepts "bench:<uid>" tokens in place of real Firebase ID tokens."""
+    if not id_token.startswith(BENCH_TOKEN_PREFIX):
+        raise firebase_auth.InvalidIdTokenError("Not a benchmark token", cause=None)
+    uid = id_token[len(BENCH_TOKEN_PREFIX):]
+    return {"uid": uid, "email": f"{uid}@bench.example.com", "exp": time.time() + 3600}
+
+
+def firestore_counts(response) -> Counter:
+    match = FIRESTORE_TIMING_PATTERN.search(response.headers.get("server-timing", ""))
+    if match is None: # No Firestore RPCs for this request
+        return Counter()
+    return Counter({key: int(value) for key, value in (item.split("=") for item in match.group(1).split())})
+
+
+class SeedData:
+    """Ids of the seeded documents, used by the scenarios to build requests."""
+
+    def __init__(self):
+        self.doctor_ids: List[str] = []
+        self.patient_ids: List[str] = []
+        self.case_ids: List[str] = []
+        self.case_patient: dict = {} # case id -> patient id
+        self.case_doctor: dict = {} # case id -> assigned doctor id
+        self.case_last_message_at: dict = {} # case id -> ISO timestamp of its newest seeded message
+        self.new_user_counter = 0
+        self.bulk_update_counter = 0
+        self.unprofiled_doctor_ids: List[str] = [] # Doctor users without a doctor profile, one per profile creation
+        self.unprofiled_doctor_counter = 0
+
+
+async def _commit_in_batches(db, writes: list) -> None:
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for doc_ref, data in writes[start:start + MAX_BATCH_WRITES]:
+            batch.set(doc_ref, data)
+        await batch.commit()
+
+
+async def seed(db, doctors: int, patients: int, cases: int, messages_per_case: int, unprofiled_doctors: int, rng: random.Random) -> SeedData:
+    import schemas
+
+    data = SeedData()
+    writes = []
+    for i in range(doctors):
+        uid = f"bench-doctor-{i}"
+        data.doctor_ids.append(uid)
+        writes.append((db.collection(u'users').document(uid), schemas.UserInDB(
+            id=uid, username=f"doctor{i}", email=f"{uid}@bench.example.com", full_name=f"Dr. Bench {i}", role="doctor",
+        ).model_dump(exclude={'id'})))
+        # Same stored shape as the profiles written by main.py (notification preferences as a JSON string)
+        writes.append((db.collection(u'doctor_profiles').document(uid), {
+            "user_id": uid, "full_name": f"Dr. Bench {i}", "specialization": "General Medicine", "bio": "",
+            "contact_email": f"{uid}@bench.example.com", "phone_number": "",
+            "notification_preferences": json.dumps(schemas.NotificationPreferences().model_dump()),
+            "created_at": datetime.utcnow(), "updated_at": datetime.utcnow(),
+        }))
+    for i in range(unprofiled_doctors):
+        uid = f"bench-unprofiled-doctor-{i}"
+        data.unprofiled_doctor_ids.append(uid)
+        writes.append((db.collection(u'users').document(uid), schemas.UserInDB(
+            id=uid, username=f"unprofiled{i}", email=f"{uid}@bench.example.com", full_name=f"Dr. New {i}", role="doctor",
+        ).model_dump(exclude={'id'})))
+    for i in range(patients):
+        uid = f"bench-patient-{i}"
+        data.patient_ids.append(uid)
+        writes.append((db.collection(u'users').document(uid), schemas.UserInDB(
+            id=uid, username=f"patient{i}", email=f"{uid}@bench.example.com", full_name=f"Patient Bench {i}", role="patient",
+        ).model_dump(exclude={'id'})))
+
+    started_at = datetime.utcnow() - timedelta(days=30)
+    for i in range(cases):
+        case_id = f"bench-case-{i}"
+        patient_id = data.patient_ids[i % patients]
+        doctor_id = data.doctor_ids[i % doctors]
+        case_timestamp = started_at + timedelta(minutes=i)
+        last_message_at = case_timestamp + timedelta(seconds=messages_per_case)
+        data.case_ids.append(case_id)
+        data.case_patient[case_id] = patient_id
+        data.case_doctor[case_id] = doctor_id
+        data.case_last_message_at[case_id] = last_message_at.isoformat()
+        writes.append((db.collection(u'patientCases').document(case_id), {
+            "patient_id": patient_id,
+            "name": f"Bench case {i}",
+            "age": rng.randint(18, 90),
+            "gender": rng.choice(["Male", "Female"]),
+            "severity": rng.choice(["low", "medium", "high"]),
+            "symptoms": rng.sample(SYMPTOM_POOL, rng.randint(1, 3)),
+            "ai_recommendation": "Seeded recommendation.",
+            "status": rng.choice(["pending", "in_review", "closed"]),
+            "doctor_id": doctor_id,
+            "medical_history": "No known allergies. " * rng.randint(1, 10),
+            "timestamp": case_timestamp,
+            "updated_at": case_timestamp,
+            "last_message_at": last_message_at if messages_per_case else None,
+            "last_message_preview": f"Message {messages_per_case - 1}" if messages_per_case else None,
+            "message_count": messages_per_case,
+            "unread_by_doctor": 0,
+            "unread_by_patient": 0,
+        }))
+        for j in range(messages_per_case):
+            sender_type = "patient" if j % 2 == 0 else "doctor"
+            writes.append((db.collection(u'chats').document(f"bench-msg-{i}-{j}"), {
+                "patient_case_id": case_id,
+                "sender_id": patient_id if sender_type == "patient" else doctor_id,
+                "sender_type": sender_type,
+                "content": f"Message {j}",
+                "timestamp": case_timestamp + timedelta(seconds=j + 1),
+            }))
+
+    await _commit_in_batches(db, writes)
+    print(f"Seeded {doctors} doctors, {patients} patients, {cases} cases and {cases * messages_per_case} chat messages.")
+    return data
+
+
+def _bearer(uid: str) -> str:
+    return BENCH_TOKEN_PREFIX + uid
+
+
+class Scenario:
+    """
+    One route under test. build(seed_data, rng) returns (path, uid or None, JSON body or None).
+    Bulk routes answer 200 with a status per item; item_success_status makes items with any other status count
+    as errors.
+    """
+
+    def __init__(self, name: str, method: str, build: Callable, item_success_status: Optional[int] = None):
+        self.name = name
+        self.method = method
+        self.build = build
+        self.item_success_status = item_success_status
+
+    def item_errors(self, response) -> int:
+        if self.item_success_status is None or response.status_code >= 400:
+            return 0
+        return sum(1 for item in response.json() if item["status_code"] != self.item_success_status)
+
+
+def _random_case(data: SeedData, rng: random.Random) -> str:
+    return rng.choice(data.case_ids)
+
+
+def _new_case_body(rng: random.Random) -> dict:
+    return {
+        "name": "Benchmark case", "age": rng.randint(18, 90), "gender": rng.choice(["Male", "Female"]),
+        "severity": rng.choice(["low", "medium", "high"]), "symptoms": rng.sample(SYMPTOM_POOL, 2),
+        "ai_recommendation": "Created by benchmark.", # Keeps the triage worker out of the picture
+    }
+
+
+def _create_profile(data: SeedData, rng: random.Random):
+    data.new_user_counter += 1
+    uid = f"bench-new-{data.new_user_counter}"
+    return "/users/create_profile", uid, {"username": uid, "role": "patient", "password": "unused"}
+
+
+def _create_doctor_profile(data: SeedData, rng: random.Random):
+    # Each request needs a doctor without a profile; a second create for the same doctor is a 400
+    uid = data.unprofiled_doctor_ids[data.unprofiled_doctor_counter % len(data.unprofiled_doctor_ids)]
+    data.unprofiled_doctor_counter += 1
+    return "/doctor-profiles", uid, {"specialization": "Cardiology", "bio": "Created by benchmark.", "notification_preferences": {"sms": True}}
+
+
+def _update_doctor_profile(data: SeedData, rng: random.Random):
+    uid = rng.choice(data.doctor_ids)
+    return f"/doctor-profiles/{uid}", uid, {"bio": f"Updated {rng.random():.6f}", "notification_preferences": {"email": False}}
+
+
+def _update_case(data: SeedData, rng: random.Random):
+    case_id = _random_case(data, rng)
+    return f"/patient-cases/{case_id}", data.case_doctor[case_id], {"doctor_notes": f"Reviewed {rng.random():.6f}"}
+
+
+def _bulk_update_cases(data: SeedData, rng: random.Random):
+    # Consecutive requests update disjoint chunks of cases (cycling through doctors, then through each doctor's
+    # cases), so concurrent bulk requests don't contend for the same documents in their transactions and force
+    # each other into retries
+    chunk = data.bulk_update_counter
+    data.bulk_update_counter += 1
+    doctor_id = data.doctor_ids[chunk % len(data.doctor_ids)]
+    doctor_case_ids = [case_id for case_id in data.case_ids if data.case_doctor[case_id] == doctor_id]
+    start = (chunk // len(data.doctor_ids)) * BULK_UPDATE_ITEMS % max(len(doctor_case_ids), 1)
+    case_ids = doctor_case_ids[start:start + BULK_UPDATE_ITEMS]
+    return "/patient-cases/bulk", doctor_id, {"items": [{"case_id": case_id, "doctor_notes": "Bulk reviewed"} for case_id in case_ids]}
+
+
+def _get_case(data: SeedData, rng: random.Random):
+    case_id = _random_case(data, rng)
+    return f"/patient-cases/{case_id}", data.case_patient[case_id], None
+
+
+def _list_chats(data: SeedData, rng: random.Random):
+    case_id = _random_case(data, rng)
+    return f"/chats/{case_id}", data.case_patient[case_id], None
+
+
+def _poll_chats(data: SeedData, rng: random.Random):
+    case_id = _random_case(data, rng)
+    return f"/chats/{case_id}?since={data.case_last_message_at[case_id]}", data.case_patient[case_id], None
+
+
+def _post_chat(data: SeedData, rng: random.Random):
+    case_id = _random_case(data, rng)
+    return "/chats", data.case_patient[case_id], {"patient_case_id": case_id, "sender_type": "patient", "content": "Benchmark message"}
+
+
+def _ai_request(path: str):
+    def build(data: SeedData, rng: random.Random):
+        case_id = _random_case(data, rng)
+        return path, data.case_doctor[case_id], {"case_id": case_id, "prompt": rng.choice(AI_QUESTIONS)}
+    return build
+
+
+SCENARIOS = [
+    Scenario("health", "GET", lambda data, rng: ("/health", None, None)),
+    Scenario("users_me", "GET", lambda data, rng: ("/users/me", rng.choice(data.patient_ids), None)),
+    Scenario("create_profile", "POST", _create_profile),
+    Scenario("create_case", "POST", lambda data, rng: ("/patient-cases", rng.choice(data.patient_ids), _new_case_body(rng))),
+    Scenario("list_cases_full", "GET", lambda data, rng: ("/patient-cases?limit=50", rng.choice(data.doctor_ids), None)),
+    Scenario("list_cases_summary", "GET", lambda data, rng: ("/patient-cases?view=summary&limit=50", rng.choice(data.doctor_ids), None)),
+    Scenario("list_cases_patient", "GET", lambda data, rng: ("/patient-cases", rng.choice(data.patient_ids), None)),
+    Scenario("list_cases_filtered", "GET", lambda data, rng: (f"/patient-cases?severity=high&symptom={rng.choice(SYMPTOM_POOL)}", rng.choice(data.doctor_ids), None)),
+    Scenario("get_case", "GET", _get_case),
+    Scenario("update_case", "PUT", _update_case),
+    Scenario("bulk_create_cases", "POST", lambda data, rng: ("/patient-cases/bulk", rng.choice(data.patient_ids), {"items": [_new_case_body(rng) for _ in range(20)]}), item_success_status=201),
+    Scenario("bulk_update_cases", "PATCH", _bulk_update_cases, item_success_status=200),
+    Scenario("list_chats", "GET", _list_chats),
+    Scenario("poll_chats", "GET", _poll_chats),
+    Scenario("post_chat", "POST", _post_chat),
+    Scenario("mark_chat_read", "POST", lambda data, rng: (f"/chats/{_random_case(data, rng)}/read", rng.choice(data.doctor_ids), None)),
+    Scenario("ai_assistant", "POST", _ai_request("/ai-assistant")),
+    Scenario("ai_assistant_stream", "POST", _ai_request("/ai-assistant/stream")),
+    Scenario("ai_cache_stats", "GET", lambda data, rng: ("/ai-assistant/cache-stats", rng.choice(data.doctor_ids), None)),
+    Scenario("ai_triage_status", "GET", lambda data, rng: ("/ai-triage/status", rng.choice(data.doctor_ids), None)),
+    Scenario("doctor_profile", "GET", lambda data, rng: (f"/doctor-profiles/{rng.choice(data.doctor_ids)}", None, None)),
+    Scenario("create_doctor_profile", "POST", _create_doctor_profile),
+    Scenario("update_doctor_profile", "PUT", _update_doctor_profile),
+    Scenario("metrics", "GET", lambda data, rng: ("/metrics", None, None)),
+]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+
+async def run_scenario(client, scenario: Scenario, data: SeedData, requests: int, concurrency: int, seed: int) -> dict:
+    latencies: List[float] = []
+    firestore_totals: Counter = Counter()
+    statuses: Counter = Counter()
+    item_totals: Counter = Counter()
+    issued = iter(range(requests))
+
+    async def worker(worker_index: int) -> None:
+        rng = random.Random(f"{seed}-{scenario.name}-{worker_index}")
+        for _ in issued: # Shared iterator: workers take requests until `requests` have been issued
+            path, uid, body = scenario.build(data, rng)
+            headers = {"Authorization": f"Bearer {_bearer(uid)}"} if uid else {}
+            started_at = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, path, headers=headers, json=body)
+                item_errors = scenario.item_errors(response)
+                # A 200 with failed items is a failed request; the failed items are counted separately
+                statuses["item_errors" if item_errors else response.status_code] += 1
+                item_totals["failed"] += item_errors
+                firestore_totals.update(firestore_counts(response))
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+            finally:
+                latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    errors = sum(count for code, count in statuses.items() if not (isinstance(code, int) and code < 400))
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "failed_items": item_totals["failed"],
+        "statuses": {str(code): count for code, count in sorted(statuses.items(), key=lambda item: str(item[0]))},
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "firestore_ops_per_request": round(firestore_totals["rpcs"] / len(latencies), 2) if latencies else 0.0,
+        **{
+            f"firestore_{key}_per_request": round(firestore_totals[key] / len(latencies), 2) if latencies else 0.0
+            for key in FIRESTORE_COUNTS[1:]
+        },
+    }
+
+
+def print_results(results: dict) -> None:
+    print(f"\n{'scenario':<22} {'reqs':>6} {'errors':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'fs ops':>7} {'reads':>7} {'writes':>7} {'queries':>7}")
+    for name, result in results.items():
+        print(f"{name:<22} {result['requests']:>6} {result['errors']:>6} {result['throughput_rps']:>9.1f} "
+              f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['firestore_ops_per_request']:>7.2f} "
+              f"{result['firestore_reads_per_request']:>7.2f} {result['firestore_writes_per_request']:>7.2f} {result['firestore_queries_per_request']:>7.2f}")
+
+
+def baseline_path(name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name: str, settings: dict, results: dict) -> None:
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    with open(baseline_path(name), "w") as f:
+        json.dump({
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "settings": settings,
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+    print(f"\nSaved baseline '{name}' to {baseline_path(name)}")
+
+
+def failed_scenarios(results: dict, max_error_rate: float) -> List[str]:
+    """Scenarios whose share of failed requests is above max_error_rate; their timings aren't meaningful."""
+    failed = [name for name, result in results.items() if result["requests"] and result["errors"] / result["requests"] > max_error_rate]
+    for name in failed:
+        print(f"\nScenario '{name}' failed {results[name]['errors']} of {results[name]['requests']} requests "
+              f"(above --max-error-rate {max_error_rate:.0%}); statuses: {results[name]['statuses']}, "
+              f"failed bulk items: {results[name].get('failed_items', 0)}")
+    return failed
+
+
+def compare_with_baseline(name: str, settings: dict, results: dict, threshold: float) -> bool:
+    """Prints the change against a saved baseline; returns False if any scenario regressed beyond threshold."""
+    with open(baseline_path(name)) as f:
+        baseline = json.load(f)
+    if baseline["settings"] != settings:
+        print(f"\nWarning: baseline '{name}' was recorded with different settings: {baseline['settings']}")
+
+    def change(new: float, old: float) -> float:
+        return (new - old) / old if old else 0.0
+
+    regressions = []
+    print(f"\nCompared with baseline '{name}' ({baseline['created_at']}); regression threshold {threshold:.0%}")
+    print(f"{'scenario':<22} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'fs ops':>8}")
+    for scenario_name, result in results.items():
+        old = baseline["results"].get(scenario_name)
+        if old is None:
+            print(f"{scenario_name:<22} (not in baseline)")
+            continue
+        deltas = {
+            "throughput_rps": change(result["throughput_rps"], old["throughput_rps"]),
+            "p50_ms": change(result["p50_ms"], old["p50_ms"]),
+            "p95_ms": change(result["p95_ms"], old["p95_ms"]),
+            "p99_ms": change(result["p99_ms"], old["p99_ms"]),
+            "firestore_ops_per_request": change(result["firestore_ops_per_request"], old["firestore_ops_per_request"]),
+        }
+        print(f"{scenario_name:<22} " + " ".join(f"{delta:>+8.1%}" for delta in deltas.values()))
+        # Lower throughput, higher tail latency or more Firestore ops per request count as regressions
+        if deltas["throughput_rps"] < -threshold or deltas["p95_ms"] > threshold or deltas["firestore_ops_per_request"] > threshold:
+            regressions.append(scenario_name)
+    if regressions:
+        print(f"\nRegressions beyond {threshold:.0%}: {', '.join(regressions)}")
+    return not regressions
+
+
+async def run(args) -> bool:
+    import httpx
+
+    init_firebase_for_emulator(args.project)
+    firebase_auth.verify_id_token = stub_verify_id_token # auth.py looks the function up on every cache miss
+
+    import main as api # Imported only now, so the environment and Firebase app above are in place
+    from database import get_firestore_db
+
+    scenarios = SCENARIOS
+    if args.only:
+        wanted = set(args.only.split(","))
+        unknown = wanted - {scenario.name for scenario in SCENARIOS}
+        if unknown:
+            sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        scenarios = [scenario for scenario in SCENARIOS if scenario.name in wanted]
+
+    reset_emulator(args.project)
+    db = get_firestore_db()
+    # Enough unprofiled doctors for every warmup and measured request of create_doctor_profile
+    data = await seed(db, args.doctors, args.patients, args.cases, args.messages_per_case, args.requests + args.warmup, random.Random(args.seed))
+
+    settings = {key: getattr(args, key) for key in ("requests", "concurrency", "warmup", "doctors", "patients", "cases", "messages_per_case", "seed")}
+    settings["llm_provider"] = os.environ["LLM_PROVIDER"]
+    results = {}
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+        for scenario in scenarios:
+            if args.warmup:
+                await run_scenario(client, scenario, data, args.warmup, args.concurrency, args.seed + 1)
+            results[scenario.name] = await run_scenario(client, scenario, data, args.requests, args.concurrency, args.seed)
+            print(f"  {scenario.name}: {results[scenario.name]['throughput_rps']} req/s")
+
+    print_results(results)
+    failed = failed_scenarios(results, args.max_error_rate)
+    passed = not failed
+    if args.compare:
+        passed = compare_with_baseline(args.compare, settings, results, args.threshold) and passed
+    if args.save_baseline:
+        if failed:
+            print(f"\nNot saving baseline '{args.save_baseline}': {', '.join(failed)} failed too many requests.")
+        else:
+            save_baseline(args.save_baseline, settings, results)
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the API routes against the Firestore emulator.")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent clients per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per scenario before measuring (fills caches)")
+    parser.add_argument("--doctors", type=int, default=5)
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--cases", type=int, default=500)
+    parser.add_argument("--messages-per-case", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42, help="Seed for generated data and request mix")
+    parser.add_argument("--only", help="Comma-separated scenario names (default: all)")
+    parser.add_argument("--list", action="store_true", help="List the scenarios and exit")
+    parser.add_argument("--project", default=os.getenv("GOOGLE_CLOUD_PROJECT", DEFAULT_PROJECT_ID), help="Emulator project id")
+    parser.add_argument("--save-baseline", metavar="NAME", help=f"Save the results as {BASELINE_DIR}/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Compare with a saved baseline; exits with status 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression (default 0.10)")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Share of failed requests above which a scenario fails the run (default 0.01)")
+    args = parser.parse_args()
+    if args.list:
+        for scenario in SCENARIOS:
+            print(f"{scenario.name:<22} {scenario.method}")
+        sys.exit(0)
+    if args.patients < 1 or args.doctors < 1 or args.cases < 1:
+        sys.exit("--doctors, --patients and --cases must be at least 1.")
+    sys.exit(0 if asyncio.run(run(args)) else 1)
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# Small in-process cache used for auth tokens, user profiles and other hot lookups.
+# Each uvicorn worker keeps its own copy, so entries are never shared across processes.
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after a TTL (or at an explicit expiry time).
+    Safe to use from the event loop and from threadpool workers.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0, name: str = "cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, expires_at: Optional[float] = None) -> None:
+        """Stores value until expires_at (epoch seconds), capped by the cache TTL."""
+        max_expires_at = time.time() + self.ttl
+        if expires_at is None or expires_at > max_expires_at:
+            expires_at = max_expires_at
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)  # Evict least recently used
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the coroutine, later callers await
+    the same result. The shared call is shielded, so one caller going away doesn't cancel it for the others.
+    """
+
+    def __init__(self, name: str = "single_flight"):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight: dict = {}
+
+    async def do(self, key: Hashable, coroutine_fn):
+        task = self._in_flight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(coroutine_fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda finished: self._forget(key, finished))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception() # Mark as retrieved even if every caller went away
+
+    def stats(self) -> dict:
+        return {"name": self.name, "calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
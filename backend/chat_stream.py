@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, Optional, Set
+
+from firebase_admin import firestore
+
+import schemas
+from database import get_firestore_listener_db
+
+# Realtime chat fan-out for the /ws/chats/{patient_case_id} WebSocket.
+# One Firestore snapshot listener per case is shared by every connected subscriber of that case.
+# Listener callbacks run on a Firestore background thread and are handed to the event loop with call_soon_threadsafe.
+
+# Sentinel pushed to a subscriber that fell too far behind (or whose shared listener failed to start); the endpoint
+# then closes the socket and the client resyncs with GET /chats/{patient_case_id}?since=<last message id>.
+SUBSCRIBER_OVERFLOW = None
+
+
+class _CaseListener:
+    def __init__(self, case_id: str):
+        self.case_id = case_id
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.watch = None
+        self.initial_snapshot_seen = False
+        self.started_at = datetime.now(timezone.utc)
+
+
+class ChatStreamHub:
+    def __init__(self, subscriber_queue_size: int = 100):
+        self.subscriber_queue_size = subscriber_queue_size
+        self._listeners: Dict[str, _CaseListener] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def subscribe(self, case_id: str) -> asyncio.Queue:
+        """
+        Returns a queue receiving new ChatMessageResponse payloads (JSON-ready dicts) for the case.
+        Messages posted before the call may or may not be delivered; callers that need them without gaps
+        query them after subscribing (see the since parameter of the WebSocket endpoint).
+        """
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.subscriber_queue_size)
+        listener = self._listeners.get(case_id)
+        start_listener = listener is None
+        if start_listener:
+            listener = _CaseListener(case_id)
+            self._listeners[case_id] = listener # Registered before starting so concurrent subscribers share it
+        listener.subscribers.add(queue)
+
+        if start_listener:
+            query = get_firestore_listener_db().collection(u'chats') \
+                .where(filter=firestore.FieldFilter("patient_case_id", "==", case_id))
+            callback = lambda snapshot, changes, read_time: self._on_snapshot(listener, changes)
+            try:
+                listener.watch = await self._loop.run_in_executor(None, query.on_snapshot, callback)
+            except Exception:
+                if self._listeners.get(case_id) is listener:
+                    del self._listeners[case_id]
+                # Subscribers that joined while it was starting would otherwise wait forever; tell them to resync
+                for subscriber_queue in list(listener.subscribers - {queue}):
+                    self._drop_subscriber(listener, subscriber_queue)
+                raise
+            if self._listeners.get(case_id) is not listener: # Every subscriber left while the listener was starting
+                await self._loop.run_in_executor(None, listener.watch.unsubscribe)
+        return queue
+
+    async def unsubscribe(self, case_id: str, queue: asyncio.Queue) -> None:
+        """Removes a subscriber and stops the case's Firestore listener once nobody is left."""
+        listener = self._listeners.get(case_id)
+        if listener is None:
+            return
+        listener.subscribers.discard(queue)
+        if not listener.subscribers:
+            del self._listeners[case_id]
+            if listener.watch is not None: # Still starting otherwise; subscribe() stops it once started
+                await asyncio.get_running_loop().run_in_executor(None, listener.watch.unsubscribe)
+
+    def _on_snapshot(self, listener: _CaseListener, changes) -> None:
+        # Runs on the listener thread. The first snapshot replays the whole thread, which clients already load
+        # over HTTP, so from it only messages posted since the listener started are pushed; they were added
+        # while the listener was starting and would otherwise be lost.
+        initial_snapshot = not listener.initial_snapshot_seen
+        listener.initial_snapshot_seen = True
+        for change in changes:
+            if change.type.name != "ADDED":
+                continue
+            chat_data = change.document.to_dict()
+            if initial_snapshot and not (chat_data.get("timestamp") and chat_data["timestamp"] >= listener.started_at):
+                continue
+            chat_data['id'] = change.document.id
+            try:
+                message = schemas.ChatMessageResponse(**chat_data).model_dump(mode="json", by_alias=True)
+            except Exception as e: # An exception here would stop the listener for every subscriber of the case
+                print(f"Skipping malformed chat message {change.document.id}: {type(e).__name__} - {e}")
+                continue
+            self._loop.call_soon_threadsafe(self._fan_out, listener, message)
+
+    def _fan_out(self, listener: _CaseListener, message: dict) -> None:
+        for queue in list(listener.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Backpressure: drop the backlog of a slow subscriber and tell it to resync
+                self._drop_subscriber(listener, queue)
+
+    def _drop_subscriber(self, listener: _CaseListener, queue: asyncio.Queue) -> None:
+        """Discards the subscriber's backlog and queues SUBSCRIBER_OVERFLOW, after which nothing else is delivered."""
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(SUBSCRIBER_OVERFLOW)
+        listener.subscribers.discard(queue)
+
+    def stats(self) -> dict:
+        return {
+            "active_cases": len(self._listeners),
+            "subscribers": sum(len(listener.subscribers) for listener in self._listeners.values()),
+        }
+
+
+chat_hub = ChatStreamHub()
@@ -1,8 +1,10 @@
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
 import os
 from dotenv import load_dotenv
 
+from request_timing import instrument_firestore_client
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -29,23 +31,40 @@ except Exception as e:
 # Dependency to get the Firestore client
 def get_firestore_db():
     """
-    Returns a Firestore client instance.
+    Returns an async Firestore client instance.
+    All document/query RPCs on it (get, set, update, add) must be awaited, so a slow
+    Firestore call no longer blocks the event loop for every other request.
     Ensure Firebase Admin SDK is initialized before calling this.
+    Its RPCs are counted and timed per request for the Server-Timing header (see request_timing.py).
     """
     try:
-        return firestore.client()
+        client = firestore_async.client()
+        instrument_firestore_client(client)
+        return client
     except Exception as e:
         print(f"Error getting Firestore client: {e}")
         # Handle appropriately, maybe raise an HTTPException if in a request context
         raise
 
+def get_firestore_listener_db():
+    """
+    Returns the synchronous Firestore client.
+    Only used for realtime snapshot listeners (on_snapshot), which the async client does not provide;
+    request handlers should keep using get_firestore_db.
+    """
+    try:
+        return firestore.client()
+    except Exception as e:
+        print(f"Error getting Firestore client: {e}")
+        raise
+
 # Example of how you might use it in FastAPI (you'll integrate this into your routes)
 # from fastapi import Depends
 #
 # @app.get("/items/")
-# async def read_items(db: firestore.Client = Depends(get_firestore_db)):
+# async def read_items(db: AsyncClient = Depends(get_firestore_db)):
 #     # Your Firestore operations here
 #     items_ref = db.collection(u'your_collection_name')
 #     docs = items_ref.stream()
-#     items = [doc.to_dict() for doc in docs]
+#     items = [doc.to_dict() async for doc in docs]
 #     return items
@@ -0,0 +1,489 @@
+import asyncio
+import hashlib
+import math
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Optional
+
+import google.generativeai as genai
+
+from ai_context import CHARS_PER_TOKEN, estimate_tokens
+from metrics import llm_busy_rejections, llm_request_seconds, llm_slots_in_use, llm_tokens
+from request_timing import timed_phase
+
+# LLM access for the AI assistant.
+# The model behind it is pluggable (LLM_PROVIDER): "gemini" for production, or "fake", a deterministic local
+# stand-in with configurable latency, token rate and error injection for load tests in CI or offline.
+# Whatever the provider, at most LLM_MAX_CONCURRENT_CALLS generations run at once per worker so a burst of AI
+# questions can't starve the other endpoints, and every call is bounded by LLM_REQUEST_TIMEOUT_SECONDS.
+# Background generations (AI triage) bound their own concurrency instead, so they never take an interactive slot.
+
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+LLM_MAX_CONCURRENT_CALLS = int(os.getenv("LLM_MAX_CONCURRENT_CALLS", "4"))
+LLM_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("LLM_ACQUIRE_TIMEOUT_SECONDS", "2")) # Wait for a free slot before giving up
+LLM_REQUEST_TIMEOUT_SECONDS = float(os.getenv("LLM_REQUEST_TIMEOUT_SECONDS", "30"))
+
+_llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENT_CALLS)
+
+
+class LLMBusyError(Exception):
+    """All LLM call slots stayed busy for LLM_ACQUIRE_TIMEOUT_SECONDS."""
+
+
+class LLMTimeoutError(Exception):
+    """The model did not answer within LLM_REQUEST_TIMEOUT_SECONDS."""
+
+
+class LLMProvider(ABC):
+    """Interface of a text generation backend."""
+
+    name = "base"
+
+    @property
+    @abstractmethod
+    def model_id(self) -> str:
+        """Identifies the model for cache keys and logs."""
+
+    def is_configured(self) -> bool:
+        return True
+
+    @abstractmethod
+    async def generate(self, prompt: str) -> str:
+        """Generates the whole response text."""
+
+    @abstractmethod
+    async def start_stream(self, prompt: str) -> AsyncIterator[str]:
+        """Starts a streamed generation and returns an async iterator over its text chunks."""
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, model_name: str = GEMINI_MODEL_NAME):
+        self.model_name = model_name
+
+    @property
+    def model_id(self) -> str:
+        return self.model_name
+
+    def is_configured(self) -> bool:
+        return bool(os.getenv("GEMINI_API_KEY")) # genai.configure() is called with it in main.py
+
+    async def generate(self, prompt: str) -> str:
+        model = genai.GenerativeModel(model_name=self.model_name)
+        response = await model.generate_content_async(prompt)
+        return response.text
+
+    async def start_stream(self, prompt: str) -> AsyncIterator[str]:
+        model = genai.GenerativeModel(model_name=self.model_name)
+        response = await model.generate_content_async(prompt, stream=True)
+
+        async def chunks():
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+        return chunks()
+
+
+class FakeLLMError(Exception):
+    """Error injected by FakeLLMProvider."""
+
+
+class FakeLLMProvider(LLMProvider):
+    """
+    Deterministic offline stand-in for load testing the AI endpoints.
+    Each call waits a time-to-first-token drawn from the configured distribution ("fixed", "uniform" or
+    "lognormal" with the given mean/stddev), then produces response_tokens tokens at tokens_per_second.
+    error_rate fails a call with FakeLLMError; hang_rate makes it never answer, to exercise timeouts.
+    With a seed, the sequence of latencies and injected faults is reproducible; the text only depends on the prompt.
+    Invalid settings raise ValueError here, so a misconfigured load test fails at startup rather than on every call.
+    """
+
+    name = "fake"
+    latency_distributions = ("fixed", "uniform", "lognormal")
+
+    def __init__(
+        self,
+        latency_distribution: str = "lognormal",
+        latency_mean_ms: float = 800.0,
+        latency_stddev_ms: float = 300.0,
+        tokens_per_second: float = 50.0,
+        response_tokens: int = 120,
+        error_rate: float = 0.0,
+        hang_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        if latency_distribution not in self.latency_distributions:
+            raise ValueError(
+                f"Unknown fake LLM latency distribution '{latency_distribution}'; "
+                f"valid distributions are: {', '.join(self.latency_distributions)}"
+            )
+        if latency_mean_ms < 0 or latency_stddev_ms < 0:
+            raise ValueError("Fake LLM latency mean and stddev must not be negative")
+        if latency_distribution == "lognormal" and latency_stddev_ms > 0 and latency_mean_ms <= 0:
+            raise ValueError("Fake LLM lognormal latency needs a positive mean")
+        if tokens_per_second <= 0:
+            raise ValueError("Fake LLM tokens_per_second must be positive")
+        if response_tokens < 0:
+            raise ValueError("Fake LLM response_tokens must not be negative")
+        if not (0 <= error_rate <= 1 and 0 <= hang_rate <= 1 and error_rate + hang_rate <= 1):
+            raise ValueError("Fake LLM error_rate and hang_rate must be between 0 and 1, and add up to at most 1")
+        self.latency_distribution = latency_distribution
+        self.latency_mean_ms = latency_mean_ms
+        self.latency_stddev_ms = latency_stddev_ms
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls) -> "FakeLLMProvider":
+        seed = os.getenv("LLM_FAKE_SEED")
+        return cls(
+            latency_distribution=os.getenv("LLM_FAKE_LATENCY_DISTRIBUTION", "lognormal"),
+            latency_mean_ms=float(os.getenv("LLM_FAKE_LATENCY_MEAN_MS", "800")),
+            latency_stddev_ms=float(os.getenv("LLM_FAKE_LATENCY_STDDEV_MS", "300")),
+            tokens_per_second=float(os.getenv("LLM_FAKE_TOKENS_PER_SECOND", "50")),
+            response_tokens=int(os.getenv("LLM_FAKE_RESPONSE_TOKENS", "120")),
+            error_rate=float(os.getenv("LLM_FAKE_ERROR_RATE", "0")),
+            hang_rate=float(os.getenv("LLM_FAKE_HANG_RATE", "0")),
+            seed=int(seed) if seed is not None else None,
+        )
+
+    @property
+    def model_id(self) -> str:
+        return f"fake-{self.latency_distribution}-{self.latency_mean_ms:g}ms-{self.tokens_per_second:g}tps"
+
+    def _first_token_seconds(self) -> float:
+        mean, stddev = self.latency_mean_ms, self.latency_stddev_ms
+        if self.latency_distribution == "fixed" or stddev <= 0:
+            latency_ms = mean
+        elif self.latency_distribution == "uniform":
+            half_width = stddev * math.sqrt(3) # Same stddev as the other distributions
+            latency_ms = self._random.uniform(mean - half_width, mean + half_width)
+        else: # lognormal
+            sigma = math.sqrt(math.log(1 + (stddev / mean) ** 2))
+            latency_ms = self._random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+        return max(latency_ms, 0.0) / 1000
+
+    async def _start_call(self) -> None:
+        """Waits for the first token and applies fault injection."""
+        self.calls += 1
+        first_token_seconds = self._first_token_seconds()
+        fault = self._random.random()
+        if fault < self.hang_rate:
+            await asyncio.Event().wait() # Never answers; only the caller's timeout ends it
+        await asyncio.sleep(first_token_seconds)
+        if fault < self.hang_rate + self.error_rate:
+            raise FakeLLMError("Injected fake LLM failure")
+
+    def _tokens(self, prompt: str):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return [f"tok{digest[i % len(digest)]}{i}" for i in range(self.response_tokens)]
+
+    async def generate(self, prompt: str) -> str:
+        await self._start_call()
+        await asyncio.sleep(self.response_tokens / self.tokens_per_second)
+        return " ".join(self._tokens(prompt))
+
+    async def start_stream(self, prompt: str) -> AsyncIterator[str]:
+        await self._start_call()
+
+        async def chunks():
+            for index, token in enumerate(self._tokens(prompt)):
+                if index:
+                    await asyncio.sleep(1 / self.tokens_per_second)
+                yield token + " "
+        return chunks()
+
+
+_PROVIDERS = {"gemini": GeminiProvider, "fake": FakeLLMProvider.from_env}
+
+
+def create_llm_provider(name: str) -> LLMProvider:
+    """Builds the provider selected by LLM_PROVIDER; raises ValueError for an unknown name."""
+    factory = _PROVIDERS.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown LLM_PROVIDER '{name}'; valid providers are: {', '.join(sorted(_PROVIDERS))}")
+    return factory()
+
+
+_llm_provider: LLMProvider = create_llm_provider(LLM_PROVIDER)
+
+
+def get_llm_provider() -> LLMProvider:
+    return _llm_provider
+
+
+def set_llm_provider(provider: LLMProvider) -> None:
+    """Swaps the backend, e.g. for a load test with a specifically configured FakeLLMProvider."""
+    global _llm_provider
+    _llm_provider = provider
+
+
+async def _acquire_slot() -> None:
+    try:
+        await asyncio.wait_for(_llm_slots.acquire(), timeout=LLM_ACQUIRE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        llm_busy_rejections.inc()
+        raise LLMBusyError(f"All {LLM_MAX_CONCURRENT_CALLS} AI assistant slots are busy")
+    llm_slots_in_use.inc()
+
+
+def _release_slot() -> None:
+    _llm_slots.release()
+    llm_slots_in_use.dec()
+
+
+def _record_call(provider: LLMProvider, mode: str, outcome: str, seconds: float, prompt: str, response_chars: int) -> None:
+    llm_request_seconds.observe(seconds, provider=provider.name, mode=mode, outcome=outcome)
+    llm_tokens.inc(estimate_tokens(prompt), provider=provider.name, direction="prompt")
+    if response_chars:
+        llm_tokens.inc(-(-response_chars // CHARS_PER_TOKEN), provider=provider.name, direction="completion")
+
+
+def _outcome(error: Optional[BaseException]) -> str:
+    if error is None:
+        return "ok"
+    if isinstance(error, (asyncio.TimeoutError, LLMTimeoutError)):
+        return "timeout"
+    if isinstance(error, asyncio.CancelledError):
+        return "cancelled"
+    return "error"
+
+
+async def generate_text(prompt: str, interactive: bool = True) -> str:
+    """
+    Generates a completion for prompt, bounded by the per-request timeout and, for interactive callers, by the
+    shared concurrency limit. Background callers pass interactive=False and limit their own concurrency.
+    """
+    if interactive:
+        await _acquire_slot()
+    provider = _llm_provider
+    started_at = time.perf_counter()
+    error: Optional[BaseException] = None
+    text = ""
+    try:
+        with timed_phase("gemini"):
+            text = await asyncio.wait_for(provider.generate(prompt), timeout=LLM_REQUEST_TIMEOUT_SECONDS)
+            return text
+    except asyncio.TimeoutError as e:
+        error = e
+        raise LLMTimeoutError(f"No response from {provider.model_id} within {LLM_REQUEST_TIMEOUT_SECONDS:g}s")
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        if interactive:
+            _release_slot()
+        _record_call(provider, "generate", _outcome(error), time.perf_counter() - started_at, prompt, len(text))
+
+
+class TextStream:
+    """
+    Incremental text of one streamed generation, holding an LLM call slot until aclose().
+    The whole stream shares one LLM_REQUEST_TIMEOUT_SECONDS deadline. Cancelling the consumer (e.g. when the
+    HTTP client disconnects) cancels the pending read, which cancels the upstream generation.
+    """
+
+    def __init__(self, chunks: AsyncIterator[str], provider: LLMProvider, deadline: float, prompt: str, started_at: float):
+        self._chunks = chunks
+        self._provider = provider
+        self._model_id = provider.model_id
+        self._deadline = deadline
+        self._prompt = prompt
+        self._started_at = started_at
+        self._response_chars = 0
+        self._outcome = "cancelled" # Until the stream ends on its own
+        self._closed = False
+
+    async def __aiter__(self):
+        chunks = self._chunks.__aiter__()
+        loop = asyncio.get_running_loop()
+        while True:
+            remaining = self._deadline - loop.time()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                text = await asyncio.wait_for(chunks.__anext__(), timeout=remaining)
+            except StopAsyncIteration:
+                self._outcome = "ok"
+                return
+            except asyncio.TimeoutError:
+                self._outcome = "timeout"
+                raise LLMTimeoutError(f"No complete response from {self._model_id} within {LLM_REQUEST_TIMEOUT_SECONDS:g}s")
+            except Exception:
+                self._outcome = "error"
+                raise
+            self._response_chars += len(text)
+            yield text
+
+    async def aclose(self) -> None:
+        if not self._closed:
+            self._closed = True
+            _release_slot()
+            _record_call(self._provider, "stream", self._outcome, time.perf_counter() - self._started_at, self._prompt, self._response_chars)
+
+
+async def open_text_stream(prompt: str) -> TextStream:
+    """
+    Starts a streamed generation. Raises LLMBusyError before anything is sent upstream if no slot frees up,
+    so callers can still answer with a plain error status. The caller must aclose() the returned stream.
+    """
+    await _acquire_slot()
+    provider = _llm_provider
+    started_at = time.perf_counter()
+    try:
+        deadline = asyncio.get_running_loop().time() + LLM_REQUEST_TIMEOUT_SECONDS
+        with timed_phase("gemini"): # Time to the start of the stream; the rest is sent after the headers
+            chunks = await asyncio.wait_for(provider.start_stream(prompt), timeout=LLM_REQUEST_TIMEOUT_SECONDS)
+        return TextStream(chunks, provider, deadline, prompt, started_at)
+    except asyncio.TimeoutError as e:
+        _release_slot()
+        _record_call(provider, "stream", _outcome(e), time.perf_counter() - started_at, prompt, 0)
+        raise LLMTimeoutError(f"No response from {provider.model_id} within {LLM_REQUEST_TIMEOUT_SECONDS:g}s")
+    except BaseException as e:
+        _release_slot()
+        _record_call(provider, "stream", _outcome(e), time.perf_counter() - started_at, prompt, 0)
+        raise
+
+
+class LLMCancelledError(Exception):
+    """A shared stream was cancelled because every reader disconnected."""
+
+
+class StreamBroadcast:
+    """
+    Fans one TextStream out to any number of readers. Readers that join late first receive the chunks
+    generated so far. When the last reader leaves before the end, the upstream generation is cancelled.
+    """
+
+    def __init__(self, text_stream: TextStream, on_complete=None, on_finish=None):
+        self.chunks = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.cancelled = False # Set as soon as the last reader leaves early, before the pump has stopped
+        self._readers = 0
+        self._changed = asyncio.Event()
+        self._on_complete = on_complete # Awaited with the full text after a successful generation
+        self._on_finish = on_finish # Called once the broadcast ends, successfully or not
+        self._task = asyncio.create_task(self._pump(text_stream))
+
+    async def _pump(self, text_stream: TextStream) -> None:
+        try:
+            async for text in text_stream:
+                self.chunks.append(text)
+                self._notify()
+            if self._on_complete is not None:
+                await self._on_complete("".join(self.chunks))
+        except asyncio.CancelledError:
+            self.error = LLMCancelledError("AI assistant stream was cancelled")
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            await text_stream.aclose()
+            self._finish()
+            self._notify()
+
+    def _finish(self) -> None:
+        on_finish, self._on_finish = self._on_finish, None
+        if on_finish is not None:
+            on_finish()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def read(self) -> "BroadcastReader":
+        """
+        Registers a reader right away and returns it. Iterate it for all chunks of the generation and aclose() it
+        when done; aclose() also releases a reader that was never iterated.
+        """
+        self._readers += 1
+        return BroadcastReader(self)
+
+    def _release_reader(self) -> None:
+        self._readers -= 1
+        if self._readers == 0 and not self.done:
+            self.cancelled = True
+            self._task.cancel() # Nobody is reading any more; stop paying for tokens
+            self._finish() # Now, so that new requests start a fresh generation instead of joining this one
+
+
+class BroadcastReader:
+    """One reader of a StreamBroadcast (see StreamBroadcast.read)."""
+
+    def __init__(self, broadcast: StreamBroadcast):
+        self._broadcast = broadcast
+        self._index = 0
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        broadcast = self._broadcast
+        while not self._released:
+            if self._index < len(broadcast.chunks):
+                self._index += 1
+                return broadcast.chunks[self._index - 1]
+            if broadcast.done:
+                await self.aclose()
+                if broadcast.error is not None:
+                    raise broadcast.error
+                break
+            await broadcast._changed.wait()
+        raise StopAsyncIteration
+
+    async def aclose(self) -> None:
+        if not self._released:
+            self._released = True
+            self._broadcast._release_reader()
+
+
+class StreamFlights:
+    """Coalesces identical streamed generations: requests with the same key share one StreamBroadcast."""
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights: dict = {}
+
+    async def join(self, key: str, open_stream, on_complete=None) -> StreamBroadcast:
+        """
+        Returns the broadcast for key, starting it with `await open_stream()` if none is running.
+        Errors from open_stream (e.g. LLMBusyError) are raised to every caller waiting on that start.
+        """
+        while True:
+            flight = self._flights.get(key)
+            if flight is None:
+                self.calls += 1
+                flight = asyncio.ensure_future(self._start(key, open_stream, on_complete))
+                self._flights[key] = flight
+            else:
+                self.coalesced += 1
+            broadcast = await asyncio.shield(flight)
+            if not broadcast.cancelled: # Otherwise its readers all left while this caller waited; start over
+                return broadcast
+
+    async def _start(self, key: str, open_stream, on_complete) -> StreamBroadcast:
+        try:
+            text_stream = await open_stream()
+        except BaseException:
+            self._flights.pop(key, None)
+            raise
+        flight = asyncio.current_task()
+        return StreamBroadcast(text_stream, on_complete=on_complete, on_finish=lambda: self._end_flight(key, flight))
+
+    def _end_flight(self, key: str, flight) -> None:
+        if self._flights.get(key) is flight: # Not a newer flight started after this one was cancelled
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights)}
@@ -1,17 +1,25 @@
 # import json # Keep if used elsewhere, but not for symptoms if they become lists
 import os
+import asyncio
+import time
 import json # Make sure json is imported
 import uuid # Added for generating IDs where needed
+import base64
 from datetime import datetime, timedelta # Keep timedelta if used for other things, else can be removed
-from typing import List, Optional
+from typing import List, Literal, Optional, Union
 
 # Firebase/Firestore specific imports
-from google.cloud.firestore_v1.client import Client as FirestoreClient # For type hinting
+from google.cloud.firestore_v1.async_client import AsyncClient as AsyncFirestoreClient # For type hinting
+from google.cloud.firestore_v1.async_transaction import async_transactional
+from google.api_core.exceptions import AlreadyExists, NotFound
 from firebase_admin import auth as firebase_auth # For verifying ID tokens
 from firebase_admin import firestore # Added for firestore.Query.DESCENDING
 
-from fastapi import FastAPI, Depends, HTTPException, status, Header
+from fastapi import FastAPI, Depends, HTTPException, status, Header, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import TypeAdapter
 # from fastapi.security import OAuth2PasswordRequestForm # Removed
 
 import google.generativeai as genai
@@ -21,9 +29,19 @@ from dotenv import load_dotenv
 from database import get_firestore_db # Changed from get_db, engine removed
 # import models # models.py is no longer for SQLAlchemy Base
 import schemas # Our Pydantic schemas
+from cache import SingleFlight, TTLCache
+from models import symptoms_from_firestore
+from chat_stream import chat_hub, SUBSCRIBER_OVERFLOW
+from llm import generate_text, open_text_stream, get_llm_provider, LLMBusyError, LLMTimeoutError, StreamFlights
+from ai_cache import ai_request_cache_key, ai_response_cache
+from triage_worker import triage_worker, AI_TRIAGE_ENABLED
+from ai_context import build_assistant_prompt, load_case_context
+from request_timing import ServerTimingMiddleware, TimedAPIRoute, mark_endpoint_done
+from profiling import PROFILING_ENABLED, ProfilingMiddleware, describe_profile, is_profiling_admin, list_profiles, profile_path
+from metrics import METRICS_ENABLED, PROMETHEUS_CONTENT_TYPE, MetricsMiddleware, cache_samples, register_collector, render_metrics, stats_samples
 
 # Updated auth imports
-from auth import get_current_active_user #, get_current_firebase_user # get_current_firebase_user is used by get_current_active_user
+from auth import get_current_active_user, get_current_firebase_user, invalidate_user_profile, verify_firebase_token, token_cache, user_profile_cache
 
 # Load environment variables
 load_dotenv()
@@ -35,8 +53,10 @@ load_dotenv()
 app = FastAPI(
     title="Medical Assistant API with Firebase",
     description="Backend API for Doctor-Patient Medical Application using Firebase/Firestore",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse, # orjson encodes the jsonable response content several times faster than json
 )
+app.router.route_class = TimedAPIRoute # Lets the Server-Timing header separate handler time from serialization
 
 # Configure CORS
 app.add_middleware(
@@ -45,7 +65,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Has-More", "Server-Timing", "X-Profile-Id"], # Let browser clients read the pagination and timing headers
 )
+app.add_middleware(ServerTimingMiddleware)
+app.add_middleware(MetricsMiddleware)
+if PROFILING_ENABLED: # Not installed at all unless configured, so profiling costs nothing when off
+    app.add_middleware(ProfilingMiddleware)
 
 # Configure Gemini AI (remains the same)
 try:
@@ -63,7 +88,7 @@ except Exception as e:
 async def create_user_profile(
     user_create_data: schemas.UserCreate, # client sends basic info
     authorization: Optional[str] = Header(None, description="Firebase ID Token: Bearer <token>"),
-    db: FirestoreClient = Depends(get_firestore_db)
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
 ):
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(
@@ -74,22 +99,19 @@ async def create_user_profile(
     id_token = authorization.split("Bearer ")[1]
 
     try:
-        decoded_token = firebase_auth.verify_id_token(id_token)
+        decoded_token = await verify_firebase_token(id_token)
         firebase_uid = decoded_token.get("uid")
         email_from_token = decoded_token.get("email")
 
         if not firebase_uid:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Firebase token: UID missing.")
 
-        # Check if profile already exists for this Firebase UID
+        # The profile is written with create(), which fails if one already exists for this Firebase UID
         user_doc_ref = db.collection(u'users').document(firebase_uid)
-        existing_user_doc = user_doc_ref.get()
-        if existing_user_doc.exists:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User profile already exists for this Firebase account.")
 
         # Optional: Check for username uniqueness if it's critical for your application
         # username_query = db.collection(u'users').where("username", "==", user_create_data.username).limit(1)
-        # existing_username_snapshot = username_query.get()
+        # existing_username_snapshot = await username_query.get()
         # if existing_username_snapshot: # query.get() returns a list of snapshots
         #     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already registered.")
 
@@ -115,17 +137,16 @@ async def create_user_profile(
         # Firestore document ID is firebase_uid, so the data itself doesn't need it.
         data_to_set = user_in_db_data.model_dump(exclude={'id'}) # Exclude 'id' if it's the doc key
 
-        user_doc_ref.set(data_to_set)
-        
-        # Fetch the created profile to return (ensures it's correctly stored)
-        newly_created_doc = user_doc_ref.get()
-        if not newly_created_doc.exists:
-             raise HTTPException(status_code=500, detail="Failed to create or retrieve user profile after creation.")
+        try:
+            await user_doc_ref.create(data_to_set)
+        except AlreadyExists:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User profile already exists for this Firebase account.")
+        invalidate_user_profile(firebase_uid)
 
-        # Construct the response model
+        # Construct the response model from what was written; no need to read the document back
         # UserResponse expects 'id'
-        response_data = newly_created_doc.to_dict()
-        response_data['id'] = newly_created_doc.id 
+        response_data = dict(data_to_set)
+        response_data['id'] = firebase_uid
         return schemas.UserResponse(**response_data)
 
     except firebase_auth.FirebaseAuthError as e:
@@ -154,37 +175,36 @@ async def read_users_me(current_user: schemas.UserResponse = Depends(get_current
 async def create_patient_case(
     case_create: schemas.PatientCaseCreate,
     current_user: schemas.UserResponse = Depends(get_current_active_user), # Any authenticated user can create a case
-    db: FirestoreClient = Depends(get_firestore_db)
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
 ):
     try:
         patient_id = current_user.id # The user creating the case is the patient
 
-        # Prepare data for Firestore document
-        # Symptoms are List[str] in Pydantic, store as JSON string in Firestore (matching sample data)
-        symptoms_json_str = json.dumps(case_create.symptoms)
-
         # Data for the new patient case document
+        # Symptoms are stored as a native Firestore array so they can be queried with array_contains
         new_case_data = case_create.model_dump(exclude_unset=True) # Get all fields from create schema
-        new_case_data['symptoms'] = symptoms_json_str
         new_case_data['patient_id'] = patient_id
-        new_case_data['timestamp'] = datetime.utcnow()
-        new_case_data['updated_at'] = datetime.utcnow()
+        # Server timestamps resolve to the commit time, which the write result reports as update_time
+        new_case_data['timestamp'] = firestore.SERVER_TIMESTAMP
+        new_case_data['updated_at'] = firestore.SERVER_TIMESTAMP
         if 'status' not in new_case_data: # Default status if not provided
             new_case_data['status'] = "pending"
         # ai_recommendation, doctor_id, doctor_notes, doctor_recommendation are typically not set on creation by patient
+        if not new_case_data.get('ai_recommendation'):
+            new_case_data['ai_recommendation'] = None # Stored explicitly: the triage sweep queries for null
 
         # Create a new document with an auto-generated ID
         doc_ref = db.collection(u'patientCases').document()
-        doc_ref.set(new_case_data)
-
-        # Fetch the newly created document to include its ID and confirm creation
-        created_doc_snapshot = doc_ref.get()
-        if not created_doc_snapshot.exists:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to create patient case.")
+        write_result = await doc_ref.set(new_case_data)
+        _remember_case_access(doc_ref.id, new_case_data)
+        if new_case_data['ai_recommendation'] is None:
+            triage_worker.enqueue(doc_ref.id) # Filled in by the background AI triage worker
 
-        response_data = created_doc_snapshot.to_dict()
-        response_data['id'] = created_doc_snapshot.id
-        response_data['symptoms'] = json.loads(response_data['symptoms']) # Convert back to list for response
+        # Build the response from the written data instead of reading the document back
+        response_data = dict(new_case_data)
+        response_data['id'] = doc_ref.id
+        response_data['timestamp'] = write_result.update_time
+        response_data['updated_at'] = write_result.update_time
 
         return schemas.PatientCaseResponse(**response_data)
     except Exception as e:
@@ -192,11 +212,63 @@ async def create_patient_case(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An unexpected error occurred while creating patient case.")
 
 
-@app.get("/patient-cases", response_model=List[schemas.PatientCaseResponse])
+def _json_list_response(adapter: TypeAdapter, items: list, headers: Optional[dict] = None) -> Response:
+    """
+    Validates a list payload in one pass and serializes it directly, bypassing response_model (which would dump,
+    re-validate and re-serialize every item). by_alias matches FastAPI's output, e.g. '_id' on cases and messages.
+    Headers set on an injected Response are dropped when returning a Response, so pass them here.
+    Validation and encoding are reported as the serialize phase of Server-Timing, as response_model work would be.
+    """
+    mark_endpoint_done()
+    return Response(content=adapter.dump_json(adapter.validate_python(items), by_alias=True), media_type="application/json", headers=headers)
+
+
+# Page size for /patient-cases; the cursor for the next page is returned in the X-Next-Cursor header
+PATIENT_CASES_DEFAULT_LIMIT = 50
+PATIENT_CASES_MAX_LIMIT = 200
+PATIENT_CASES_MAX_SYMPTOM_FILTERS = 30 # Firestore limit for array_contains_any
+
+def _encode_case_cursor(timestamp: datetime, doc_id: str) -> str:
+    """Opaque cursor pointing just after the given case in (timestamp desc, id desc) order."""
+    raw = json.dumps({"ts": timestamp.isoformat(), "id": doc_id})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def _case_timestamp(doc) -> Optional[datetime]:
+    """The case's timestamp, or None if the document has no usable one."""
+    try:
+        timestamp = doc.get("timestamp")
+    except KeyError:
+        return None
+    return timestamp if isinstance(timestamp, datetime) else None
+
+def _decode_case_cursor(cursor: str) -> dict:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return {"timestamp": datetime.fromisoformat(raw["ts"]), "__name__": raw["id"]}
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+
+
+@app.get("/patient-cases", response_model=Union[List[schemas.PatientCaseResponse], List[schemas.PatientCaseSummary]])
 async def get_all_patient_cases(
+    view: Literal["full", "summary"] = Query("full", description="'summary' returns only the fields shown in case lists"),
+    limit: int = Query(PATIENT_CASES_DEFAULT_LIMIT, ge=1, le=PATIENT_CASES_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page"),
+    status_filter: Optional[str] = Query(None, alias="status"),
+    severity: Optional[str] = None,
+    doctor_id: Optional[str] = None,
+    symptom: Optional[List[str]] = Query(None, description="Cases having any of these symptoms"),
     current_user: schemas.UserResponse = Depends(get_current_active_user),
-    db: FirestoreClient = Depends(get_firestore_db)
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
 ):
+    """
+    Returns one page of patient cases, newest first.
+    If more cases are available, the X-Next-Cursor response header holds the cursor for the next page.
+    With view=summary only the listing fields are read from Firestore (field projection) and returned.
+    Symptom filters only match cases stored with a native symptoms array (see migrate_symptoms.py).
+    Note: combining the status/severity/doctor_id/symptom filters with the timestamp ordering needs matching
+    composite indexes in Firestore.
+    """
     # Authorization: Only doctors can see all patient cases for now.
     # You might want different logic, e.g., patients see their own cases, doctors see assigned/all cases.
     if current_user.role != "doctor":
@@ -207,49 +279,120 @@ async def get_all_patient_cases(
         # Doctors see all cases
         query = db.collection(u'patientCases')
 
+    if status_filter is not None:
+        query = query.where(filter=firestore.FieldFilter("status", "==", status_filter))
+    if severity is not None:
+        query = query.where(filter=firestore.FieldFilter("severity", "==", severity))
+    if doctor_id is not None:
+        query = query.where(filter=firestore.FieldFilter("doctor_id", "==", doctor_id))
+    if symptom:
+        if len(symptom) > PATIENT_CASES_MAX_SYMPTOM_FILTERS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {PATIENT_CASES_MAX_SYMPTOM_FILTERS} symptom filters are allowed.")
+        if len(symptom) == 1:
+            query = query.where(filter=firestore.FieldFilter("symptoms", "array_contains", symptom[0]))
+        else:
+            query = query.where(filter=firestore.FieldFilter("symptoms", "array_contains_any", symptom))
+
+    # Order by document id as a tie-breaker so the cursor is stable for cases sharing a timestamp
+    query = query.order_by("timestamp", direction=firestore.Query.DESCENDING) \
+                 .order_by("__name__", direction=firestore.Query.DESCENDING)
+    if cursor:
+        query = query.start_after(_decode_case_cursor(cursor))
+    if view == "summary":
+        query = query.select(schemas.PATIENT_CASE_SUMMARY_FIELDS)
+
     try:
-        cases_snapshot = query.order_by("timestamp", direction=firestore.Query.DESCENDING).get()
-        
-        response_cases: List[schemas.PatientCaseResponse] = []
+        # Fetch one extra document to know whether another page exists
+        cases_snapshot = await query.limit(limit + 1).get()
+        has_more = len(cases_snapshot) > limit
+        # Every case is written with a timestamp, and Firestore leaves documents without the ordered-by field out of
+        # the results; skip cases whose timestamp is still unusable (e.g. null) instead of failing the page
+        cases_snapshot = [doc for doc in cases_snapshot[:limit] if _case_timestamp(doc) is not None]
+
+        headers = {}
+        if has_more and cases_snapshot:
+            last_doc = cases_snapshot[-1]
+            headers["X-Next-Cursor"] = _encode_case_cursor(_case_timestamp(last_doc), last_doc.id)
+
+        if view == "summary":
+            return _json_list_response(schemas.PATIENT_CASE_SUMMARY_LIST, [{**doc.to_dict(), 'id': doc.id} for doc in cases_snapshot], headers)
+
+        response_cases = []
         for doc in cases_snapshot:
             case_data = doc.to_dict()
             case_data['id'] = doc.id
-            # Symptoms are stored as JSON string, convert to list for response
-            if 'symptoms' in case_data and isinstance(case_data['symptoms'], str):
-                case_data['symptoms'] = json.loads(case_data['symptoms'])
-            else:
-                case_data['symptoms'] = [] # Default to empty list if missing or not a string
-            response_cases.append(schemas.PatientCaseResponse(**case_data))
-        return response_cases
+            # Symptoms may still be a legacy JSON string on documents that haven't been migrated
+            case_data['symptoms'] = symptoms_from_firestore(case_data.get('symptoms'))
+            response_cases.append(case_data)
+        return _json_list_response(schemas.PATIENT_CASE_LIST, response_cases, headers)
     except Exception as e:
         print(f"Error getting patient cases: {type(e).__name__} - {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while fetching patient cases.")
 
 
+# Existence and ownership (patient_id) of patient cases, shared by the case and chat endpoints so a chat post
+# doesn't need to read the case document. Endpoints writing a case must call invalidate_case_access(case_id).
+case_access_cache = TTLCache(
+    maxsize=int(os.getenv("CASE_ACCESS_CACHE_MAX_ENTRIES", "10000")),
+    ttl=float(os.getenv("CASE_ACCESS_CACHE_TTL_SECONDS", "300")),
+    name="case_access",
+)
+
+def _is_valid_document_id(document_id: str) -> bool:
+    """Whether a client-supplied id can name a document (Firestore raises on ids with '/' and rejects some others)."""
+    return (
+        bool(document_id) and "/" not in document_id and document_id not in (".", "..")
+        and not (document_id.startswith("__") and document_id.endswith("__"))
+        and len(document_id.encode("utf-8")) <= 1500
+    )
+
+def _remember_case_access(case_id: str, case_data: dict) -> dict:
+    case_access = {"patient_id": case_data.get("patient_id")}
+    case_access_cache.set(case_id, case_access)
+    return case_access
+
+def invalidate_case_access(case_id: str) -> None:
+    case_access_cache.invalidate(case_id)
+
+async def _get_case_access(db: AsyncFirestoreClient, case_id: str, not_found_detail: str = "Patient case not found") -> dict:
+    """Returns {"patient_id": ...} for an existing case, from case_access_cache or one Firestore read; 404 otherwise."""
+    case_access = case_access_cache.get(case_id)
+    if case_access is None:
+        case_snapshot = await db.collection(u'patientCases').document(case_id).get()
+        if not case_snapshot.exists: # Missing cases aren't cached, so a case created later is found right away
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=not_found_detail)
+        case_access = _remember_case_access(case_id, case_snapshot.to_dict())
+    return case_access
+
+
 @app.get("/patient-cases/{case_id}", response_model=schemas.PatientCaseResponse)
 async def get_single_patient_case(
     case_id: str,
     current_user: schemas.UserResponse = Depends(get_current_active_user),
-    db: FirestoreClient = Depends(get_firestore_db)
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
 ):
     try:
+        # Reject patients asking for someone else's case without reading it, if its owner is already known
+        cached_access = case_access_cache.get(case_id)
+        if cached_access and current_user.role == "patient" and cached_access["patient_id"] != current_user.id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view this patient case")
+
         doc_ref = db.collection(u'patientCases').document(case_id)
-        doc_snapshot = doc_ref.get()
+        doc_snapshot = await doc_ref.get()
 
         if not doc_snapshot.exists:
+            invalidate_case_access(case_id)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Patient case not found")
 
         case_data = doc_snapshot.to_dict()
         case_data['id'] = doc_snapshot.id
+        _remember_case_access(case_id, case_data)
 
         # Authorization: Doctor can see any case. Patient can only see their own case.
         if current_user.role == "patient" and case_data.get("patient_id") != current_user.id:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view this patient case")
         
-        if 'symptoms' in case_data and isinstance(case_data['symptoms'], str):
-            case_data['symptoms'] = json.loads(case_data['symptoms'])
-        else:
-            case_data['symptoms'] = []
+        case_data['symptoms'] = symptoms_from_firestore(case_data.get('symptoms'))
 
         return schemas.PatientCaseResponse(**case_data)
     except HTTPException: # Re-raise known HTTP exceptions
@@ -259,56 +402,77 @@ async def get_single_patient_case(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while fetching the patient case.")
 
 
+def _build_case_update_payload(case_update: schemas.PatientCaseUpdate, current_user: schemas.UserResponse) -> dict:
+    """Checks that current_user may apply case_update and returns the Firestore update payload."""
+    # Authorization: Only a doctor can update a case, 
+    # or a patient can update certain fields of their own case if logic allows (not implemented here for simplicity).
+    # Current logic: only doctors can assign themselves or add notes.
+    if current_user.role != "doctor":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to update patient case. Only doctors can update.")
+    
+    # If the case is being assigned to the current doctor
+    if case_update.doctor_id and case_update.doctor_id == current_user.id:
+        pass # This is fine
+    elif case_update.doctor_id: # Trying to assign to a *different* doctor ID
+         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Doctors can only assign cases to themselves.")
+
+    update_payload = case_update.model_dump(exclude_unset=True)
+    update_payload['updated_at'] = datetime.utcnow()
+    return update_payload
+
+
+# Substantive changes (as opposed to viewing/minor edits by patient if that was allowed) that assign an
+# unassigned case to the doctor making them
+CASE_CLAIMING_FIELDS = ('doctor_notes', 'doctor_recommendation', 'status', 'severity')
+
+def _resolve_case_claim(existing_case_data: dict, update_payload: dict, current_user: schemas.UserResponse) -> dict:
+    """
+    Returns update_payload with the case's assignment (doctor_id) settled against the stored case.
+    Substantive changes to an unassigned case assign it to the current doctor. An explicit doctor_id that would
+    take over a case assigned to another doctor is rejected with 409; other edits leave the assignment alone.
+    """
+    claimed_by = existing_case_data.get('doctor_id')
+    if 'doctor_id' in update_payload:
+        if claimed_by not in (None, current_user.id):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Patient case is already assigned to another doctor.")
+    elif claimed_by is None and any(field in update_payload for field in CASE_CLAIMING_FIELDS):
+        update_payload = {**update_payload, 'doctor_id': current_user.id} # Assign the current doctor
+    return update_payload
+
+
+@async_transactional
+async def _update_case_in_transaction(transaction, doc_ref, update_payload: dict, current_user: schemas.UserResponse) -> dict:
+    """
+    Reads, validates and updates a case atomically; Firestore retries the function if the case changes concurrently.
+    Returns the merged case data, which is what a fresh read after the commit would return.
+    """
+    doc_snapshot = await doc_ref.get(transaction=transaction)
+    if not doc_snapshot.exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Patient case not found to update")
+
+    existing_case_data = doc_snapshot.to_dict()
+    update_payload = _resolve_case_claim(existing_case_data, update_payload, current_user)
+
+    transaction.update(doc_ref, update_payload)
+    return {**existing_case_data, **update_payload}
+
+
 @app.put("/patient-cases/{case_id}", response_model=schemas.PatientCaseResponse)
 async def update_existing_patient_case(
     case_id: str,
     case_update: schemas.PatientCaseUpdate,
     current_user: schemas.UserResponse = Depends(get_current_active_user),
-    db: FirestoreClient = Depends(get_firestore_db)
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
 ):
+    update_payload = _build_case_update_payload(case_update, current_user)
     doc_ref = db.collection(u'patientCases').document(case_id)
     
     try:
-        doc_snapshot = doc_ref.get()
-        if not doc_snapshot.exists:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Patient case not found to update")
-
-        existing_case_data = doc_snapshot.to_dict()
-
-        # Authorization: Only a doctor can update a case, 
-        # or a patient can update certain fields of their own case if logic allows (not implemented here for simplicity).
-        # Current logic: only doctors can assign themselves or add notes.
-        if current_user.role != "doctor":
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to update patient case. Only doctors can update.")
-        
-        # If the case is being assigned to the current doctor
-        if case_update.doctor_id and case_update.doctor_id == current_user.id:
-            pass # This is fine
-        elif case_update.doctor_id: # Trying to assign to a *different* doctor ID
-             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Doctors can only assign cases to themselves.")
-
-        update_payload = case_update.model_dump(exclude_unset=True)
-
-        # Handle symptoms: if provided in update, convert list to JSON string
-        if 'symptoms' in update_payload and isinstance(update_payload['symptoms'], list):
-            update_payload['symptoms'] = json.dumps(update_payload['symptoms'])
-        
-        # Ensure doctor_id is set to the current doctor if they are making substantive changes
-        # like adding notes or changing status (and not just viewing/minor edits by patient if that was allowed)
-        if any(k in update_payload for k in ['doctor_notes', 'doctor_recommendation', 'status', 'severity']):
-             update_payload['doctor_id'] = current_user.id # Assign/confirm current doctor
-
-        update_payload['updated_at'] = datetime.utcnow()
-
-        doc_ref.update(update_payload)
-
-        updated_doc_snapshot = doc_ref.get()
-        response_data = updated_doc_snapshot.to_dict()
-        response_data['id'] = updated_doc_snapshot.id
-        if 'symptoms' in response_data and isinstance(response_data['symptoms'], str):
-            response_data['symptoms'] = json.loads(response_data['symptoms'])
-        else:
-            response_data['symptoms'] = []
+        # One transaction replaces get + update + get, and makes claiming a case (doctor_id) atomic
+        response_data = await _update_case_in_transaction(db.transaction(), doc_ref, update_payload, current_user)
+        invalidate_case_access(case_id)
+        response_data['id'] = case_id
+        response_data['symptoms'] = symptoms_from_firestore(response_data.get('symptoms'))
 
         return schemas.PatientCaseResponse(**response_data)
     except HTTPException: # Re-raise known HTTP exceptions
@@ -317,42 +481,238 @@ async def update_existing_patient_case(
         print(f"Error updating patient case: {type(e).__name__} - {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while updating the patient case.")
 
+# Firestore commits at most 500 writes at once; bulk creates are written in batches of at most this many cases
+BULK_CREATE_BATCH_SIZE = 500
+# Cases per bulk update transaction. A smaller transaction locks fewer documents, so it contends less with
+# single-case updates, and a transaction that gives up fails only the items of its chunk.
+BULK_UPDATE_TRANSACTION_SIZE = 50
+
+@app.post("/patient-cases/bulk", response_model=List[schemas.PatientCaseBulkResult])
+async def bulk_create_patient_cases(
+    bulk_create: schemas.PatientCaseBulkCreate,
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
+):
+    """
+    Creates many patient cases and returns a result per item. The cases are written with one write batch commit
+    per BULK_CREATE_BATCH_SIZE cases; new documents get fresh ids, so the creates can't conflict, and a failed
+    commit fails only the items of its batch.
+    """
+    written = []
+    for case_create in bulk_create.items:
+        # Same document shape as create_patient_case
+        new_case_data = case_create.model_dump(exclude_unset=True)
+        new_case_data['patient_id'] = current_user.id
+        new_case_data['timestamp'] = firestore.SERVER_TIMESTAMP
+        new_case_data['updated_at'] = firestore.SERVER_TIMESTAMP
+        if 'status' not in new_case_data:
+            new_case_data['status'] = "pending"
+        if not new_case_data.get('ai_recommendation'):
+            new_case_data['ai_recommendation'] = None
+        written.append((db.collection(u'patientCases').document(), new_case_data))
+
+    results: List[schemas.PatientCaseBulkResult] = []
+    for start in range(0, len(written), BULK_CREATE_BATCH_SIZE):
+        chunk = written[start:start + BULK_CREATE_BATCH_SIZE]
+        batch = db.batch()
+        for doc_ref, new_case_data in chunk:
+            batch.create(doc_ref, new_case_data)
+        try:
+            write_results = await batch.commit()
+        except Exception as e:
+            print(f"Error bulk creating patient cases: {type(e).__name__} - {e}")
+            results.extend(
+                schemas.PatientCaseBulkResult(
+                    index=index, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="An unexpected error occurred while creating the patient case."
+                )
+                for index in range(start, start + len(chunk))
+            )
+            continue
+
+        for index, ((doc_ref, new_case_data), write_result) in enumerate(zip(chunk, write_results), start):
+            _remember_case_access(doc_ref.id, new_case_data)
+            if new_case_data['ai_recommendation'] is None:
+                triage_worker.enqueue(doc_ref.id)
+            response_data = dict(new_case_data)
+            response_data['id'] = doc_ref.id
+            response_data['timestamp'] = write_result.update_time
+            response_data['updated_at'] = write_result.update_time
+            results.append(schemas.PatientCaseBulkResult(
+                index=index, case_id=doc_ref.id, status_code=status.HTTP_201_CREATED,
+                case=schemas.PatientCaseResponse(**response_data)
+            ))
+    return results
+
+
+@async_transactional
+async def _bulk_update_cases_in_transaction(transaction, db: AsyncFirestoreClient, items: dict, current_user: schemas.UserResponse) -> dict:
+    """
+    Reads the cases of items (index -> (case_id, update payload)) in one get_all, checks each item against its
+    case and updates the valid ones atomically; Firestore retries the function if any of the cases changes
+    concurrently. Returns index -> merged case data, or the HTTPException rejecting that item.
+    """
+    doc_refs = {case_id: db.collection(u'patientCases').document(case_id) for case_id, _ in items.values()}
+    snapshots = {snapshot.id: snapshot async for snapshot in db.get_all(list(doc_refs.values()), transaction=transaction)}
+
+    outcomes = {}
+    for index, (case_id, update_payload) in items.items():
+        snapshot = snapshots.get(case_id)
+        try:
+            if snapshot is None or not snapshot.exists:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Patient case not found to update")
+            existing_case_data = snapshot.to_dict()
+            update_payload = _resolve_case_claim(existing_case_data, update_payload, current_user)
+        except HTTPException as e:
+            outcomes[index] = e
+            continue
+        transaction.update(doc_refs[case_id], update_payload)
+        outcomes[index] = {**existing_case_data, **update_payload}
+    return outcomes
+
+
+@app.patch("/patient-cases/bulk", response_model=List[schemas.PatientCaseBulkResult])
+async def bulk_update_patient_cases(
+    bulk_update: schemas.PatientCaseBulkUpdate,
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
+):
+    """
+    Applies status/assignment (or any PatientCaseUpdate) changes to many cases and returns a result per item.
+    Items are authorized like PUT /patient-cases/{case_id}. The cases are read and the valid updates written in one
+    transaction per BULK_UPDATE_TRANSACTION_SIZE cases, so a case changing concurrently makes Firestore retry that
+    transaction instead of overwriting a fresh claim. If a transaction still can't commit after its retries (e.g.
+    under heavy contention), the items of its chunk fail with 500 and the other chunks are unaffected.
+    """
+    results: List[Optional[schemas.PatientCaseBulkResult]] = [None] * len(bulk_update.items)
+    items = {} # index -> (case_id, update payload)
+    seen_case_ids = set()
+    for index, item in enumerate(bulk_update.items):
+        if item.case_id in seen_case_ids: # A transaction may write each document only once
+            results[index] = schemas.PatientCaseBulkResult(index=index, case_id=item.case_id, status_code=status.HTTP_400_BAD_REQUEST, detail="Duplicate case_id in request.")
+            continue
+        seen_case_ids.add(item.case_id)
+        if not _is_valid_document_id(item.case_id):
+            results[index] = schemas.PatientCaseBulkResult(index=index, case_id=item.case_id, status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid case_id.")
+            continue
+        case_update = schemas.PatientCaseUpdate(**item.model_dump(exclude={'case_id'}, exclude_unset=True))
+        try:
+            items[index] = (item.case_id, _build_case_update_payload(case_update, current_user))
+        except HTTPException as e:
+            results[index] = schemas.PatientCaseBulkResult(index=index, case_id=item.case_id, status_code=e.status_code, detail=e.detail)
+
+    if not items: # Every item was rejected already; nothing to read
+        return results
+
+    outcomes = {}
+    indexes = list(items)
+    for start in range(0, len(indexes), BULK_UPDATE_TRANSACTION_SIZE):
+        chunk = {index: items[index] for index in indexes[start:start + BULK_UPDATE_TRANSACTION_SIZE]}
+        try:
+            outcomes.update(await _bulk_update_cases_in_transaction(db.transaction(), db, chunk, current_user))
+        except Exception as e:
+            print(f"Error bulk updating patient cases: {type(e).__name__} - {e}")
+            failure = HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while updating the patient case.")
+            outcomes.update((index, failure) for index in chunk)
+
+    for index, outcome in outcomes.items():
+        case_id = items[index][0]
+        if isinstance(outcome, HTTPException):
+            results[index] = schemas.PatientCaseBulkResult(index=index, case_id=case_id, status_code=outcome.status_code, detail=outcome.detail)
+            continue
+        invalidate_case_access(case_id)
+        outcome['id'] = case_id
+        outcome['symptoms'] = symptoms_from_firestore(outcome.get('symptoms'))
+        results[index] = schemas.PatientCaseBulkResult(
+            index=index, case_id=case_id, status_code=status.HTTP_200_OK,
+            case=schemas.PatientCaseResponse(**outcome)
+        )
+    return results
+
 # --- CHAT ENDPOINTS ---
 
+# Characters of the latest message kept on the case document as last_message_preview
+CHAT_PREVIEW_LENGTH = 140
+
+# Page size for /chats/{patient_case_id}
+CHAT_MESSAGES_DEFAULT_LIMIT = 100
+CHAT_MESSAGES_MAX_LIMIT = 500
+
+async def _chat_cursor_position(db: AsyncFirestoreClient, patient_case_id: str, cursor: str):
+    """
+    Resolves a chat paging cursor, either an ISO timestamp or the id of a chat message of the case, to a query
+    cursor. A message id costs one document read.
+    """
+    try:
+        return {"timestamp": datetime.fromisoformat(cursor)}
+    except ValueError:
+        pass
+    if not _is_valid_document_id(cursor):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor must be an ISO timestamp or an existing chat message id.")
+    message_snapshot = await db.collection(u'chats').document(cursor).get()
+    # A message of another case would position the page by that case's timestamps
+    if not message_snapshot.exists or message_snapshot.to_dict().get("patient_case_id") != patient_case_id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor must be an ISO timestamp or an existing chat message id.")
+    return message_snapshot
+
+
+async def _load_chat_messages(db: AsyncFirestoreClient, patient_case_id: str, newer: bool, cursor_position, limit: int):
+    """
+    Up to `limit` chat messages of a case, oldest first, and whether more exist in the requested direction:
+    those after cursor_position if `newer`, otherwise the newest ones (before cursor_position, if given).
+    """
+    # Query chats for this patient_case_id from the top-level 'chats' collection.
+    # The document id is a tie-breaker so messages sharing a timestamp are neither skipped nor repeated.
+    direction = firestore.Query.ASCENDING if newer else firestore.Query.DESCENDING
+    chats_query = db.collection(u'chats') \
+                    .where(filter=firestore.FieldFilter("patient_case_id", "==", patient_case_id)) \
+                    .order_by("timestamp", direction=direction) \
+                    .order_by("__name__", direction=direction)
+    if cursor_position is not None:
+        chats_query = chats_query.start_after(cursor_position)
+
+    # Fetch one extra message to know whether more exist
+    chats_snapshot = await chats_query.limit(limit + 1).get()
+    has_more = len(chats_snapshot) > limit
+    chats_snapshot = chats_snapshot[:limit]
+    if not newer:
+        chats_snapshot.reverse() # Show oldest first
+    return chats_snapshot, has_more
+
+
 @app.get("/chats/{patient_case_id}", response_model=List[schemas.ChatMessageResponse])
 async def get_chat_messages_for_case(
     patient_case_id: str,
+    since: Optional[str] = Query(None, description="Only messages after this ISO timestamp or message id (oldest first)"),
+    before: Optional[str] = Query(None, description="Only messages before this ISO timestamp or message id, for loading older history"),
+    limit: int = Query(CHAT_MESSAGES_DEFAULT_LIMIT, ge=1, le=CHAT_MESSAGES_MAX_LIMIT),
     current_user: schemas.UserResponse = Depends(get_current_active_user),
-    db: FirestoreClient = Depends(get_firestore_db)
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
 ):
+    """
+    Returns chat messages for a case in ascending time order.
+    - With `since`, returns up to `limit` messages newer than the cursor, so a poll only costs the new messages.
+    - Otherwise returns the newest `limit` messages, or those older than `before` when paging back through history.
+    X-Has-More is "true" when further messages exist in the requested direction.
+    """
+    if since and before:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Use either 'since' or 'before', not both.")
     try:
         # Verify patient case exists
-        case_doc_ref = db.collection(u'patientCases').document(patient_case_id)
-        case_snapshot = case_doc_ref.get()
-        if not case_snapshot.exists:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Patient case not found")
+        case_access = await _get_case_access(db, patient_case_id)
         
         # Authorization: User must be the patient of the case or a doctor.
         # If current user is a patient, they must be the patient_id on the case.
         # Doctors are assumed to have broader access, but could be restricted to assigned cases.
-        patient_case_data = case_snapshot.to_dict()
-        if current_user.role == "patient" and patient_case_data.get("patient_id") != current_user.id:
+        if current_user.role == "patient" and case_access["patient_id"] != current_user.id:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view these chat messages.")
 
-        # Query chats for this patient_case_id from the top-level 'chats' collection
-        chats_query = db.collection(u'chats') \
-                        .where(filter=firestore.FieldFilter("patient_case_id", "==", patient_case_id)) \
-                        .order_by("timestamp", direction=firestore.Query.ASCENDING) # Show oldest first
-        
-        chats_snapshot = chats_query.get()
+        cursor = since or before
+        cursor_position = await _chat_cursor_position(db, patient_case_id, cursor) if cursor else None
+        chats_snapshot, has_more = await _load_chat_messages(db, patient_case_id, newer=bool(since), cursor_position=cursor_position, limit=limit)
         
-        response_chats: List[schemas.ChatMessageResponse] = []
-        for doc in chats_snapshot:
-            chat_data = doc.to_dict()
-            chat_data['id'] = doc.id # Ensure ID is in the response data
-            response_chats.append(schemas.ChatMessageResponse(**chat_data))
-            
-        return response_chats
+        response_chats = [{**doc.to_dict(), 'id': doc.id} for doc in chats_snapshot] # Ensure ID is in the response data
+        return _json_list_response(schemas.CHAT_MESSAGE_LIST, response_chats, {"X-Has-More": "true" if has_more else "false"})
 
     except HTTPException: # Re-raise known HTTP exceptions
         raise
@@ -365,17 +725,13 @@ async def get_chat_messages_for_case(
 async def create_new_chat_message(
     message_create: schemas.ChatMessageCreate, 
     current_user: schemas.UserResponse = Depends(get_current_active_user),
-    db: FirestoreClient = Depends(get_firestore_db)
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
 ):
     try:
-        # Verify patient case exists
-        case_doc_ref = db.collection(u'patientCases').document(message_create.patient_case_id)
-        case_snapshot = case_doc_ref.get()
-        if not case_snapshot.exists:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Patient case {message_create.patient_case_id} not found.")
+        # Verify patient case exists (usually answered from case_access_cache, making the post a single write)
+        case_access = await _get_case_access(db, message_create.patient_case_id, f"Patient case {message_create.patient_case_id} not found.")
 
-        patient_case_data = case_snapshot.to_dict()
-        is_patient_of_case = current_user.role == "patient" and patient_case_data.get("patient_id") == current_user.id
+        is_patient_of_case = current_user.role == "patient" and case_access["patient_id"] == current_user.id
         is_doctor = current_user.role == "doctor"
         
         if not (is_patient_of_case or is_doctor):
@@ -403,7 +759,24 @@ async def create_new_chat_message(
         # if UserInDB uses Field(alias='_id'), then model_dump(by_alias=True) is needed and then exclude '_id'
 
         chat_doc_ref = db.collection(u'chats').document(chat_message_id)
-        chat_doc_ref.set(data_to_firestore)
+        case_doc_ref = db.collection(u'patientCases').document(message_create.patient_case_id)
+
+        # Write the message and the case's chat summary atomically, so case listings can show
+        # "last message / unread" without reading every thread
+        unread_field = "unread_by_doctor" if message_create.sender_type == "patient" else "unread_by_patient"
+        batch = db.batch()
+        batch.set(chat_doc_ref, data_to_firestore)
+        batch.update(case_doc_ref, {
+            "last_message_at": new_chat_data_model.timestamp,
+            "last_message_preview": message_create.content[:CHAT_PREVIEW_LENGTH],
+            "message_count": firestore.Increment(1),
+            unread_field: firestore.Increment(1),
+        })
+        try:
+            await batch.commit()
+        except NotFound: # The case was deleted since it was cached as existing; nothing was written
+            invalidate_case_access(message_create.patient_case_id)
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Patient case {message_create.patient_case_id} not found.")
         
         # For the response, we use the data from the model which includes the ID.
         return schemas.ChatMessageResponse(**new_chat_data_model.model_dump()) # Pass all fields from model to response
@@ -414,39 +787,182 @@ async def create_new_chat_message(
         print(f"Error creating chat message: {type(e).__name__} - {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while creating the chat message.")
 
-# --- AI ASSISTANT ENDPOINT ---
+@app.post("/chats/{patient_case_id}/read", status_code=status.HTTP_204_NO_CONTENT)
+async def mark_chat_messages_read(
+    patient_case_id: str,
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
+):
+    """Resets the unread counter of the caller's side (doctor or patient) on the case's chat summary."""
+    try:
+        case_access = await _get_case_access(db, patient_case_id)
+        if current_user.role == "patient" and case_access["patient_id"] != current_user.id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view these chat messages.")
 
-@app.post("/ai-assistant")
-async def doctor_ai_assistant(
-    request: schemas.AIAssistantRequest,
-    current_user: schemas.UserResponse = Depends(get_current_active_user)
+        unread_field = "unread_by_doctor" if current_user.role == "doctor" else "unread_by_patient"
+        try:
+            await db.collection(u'patientCases').document(patient_case_id).update({unread_field: 0})
+        except NotFound: # Deleted since it was cached as existing
+            invalidate_case_access(patient_case_id)
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Patient case not found")
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error marking chat messages read: {type(e).__name__} - {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while updating the chat summary.")
+
+async def _wait_for_disconnect(websocket: WebSocket) -> None:
+    """Consumes (and ignores) client frames, text or binary, until the socket closes."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+@app.websocket("/ws/chats/{patient_case_id}")
+async def stream_chat_messages_for_case(
+    websocket: WebSocket,
+    patient_case_id: str,
+    token: str = Query(..., description="Firebase ID token (browsers cannot set headers on WebSockets)"),
+    since: Optional[str] = Query(None, description="Also push the messages after this ISO timestamp or message id, e.g. the last one from GET /chats")
 ):
+    """
+    Pushes each new chat message of a case as a ChatMessageResponse JSON object, replacing polling of
+    GET /chats/{patient_case_id}. Pass `since` (the last message the client has) to also receive the messages
+    posted between that GET and the connection, which are otherwise missed. The socket is closed with code 1013
+    if the client falls too far behind (or more than CHAT_MESSAGES_MAX_LIMIT messages are newer than `since`);
+    it should then resync with GET /chats/{patient_case_id}?since=<last message id> and reconnect.
+    """
+    try:
+        db = get_firestore_db()
+        current_user = await get_current_active_user(await get_current_firebase_user(token=token, db=db))
+        case_access = await _get_case_access(db, patient_case_id)
+        if current_user.role == "patient" and case_access["patient_id"] != current_user.id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view these chat messages.")
+        since_position = await _chat_cursor_position(db, patient_case_id, since) if since else None
+    except HTTPException as e: # A 5xx here (e.g. the profile read failing) isn't the client's fault either
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR if e.status_code >= 500 else status.WS_1008_POLICY_VIOLATION)
+        return
+    except Exception as e: # e.g. Firestore failing to read the case or the cursor message
+        print(f"Error opening chat stream: {type(e).__name__} - {e}")
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        return
+
+    await websocket.accept()
+    try:
+        queue = await chat_hub.subscribe(patient_case_id)
+    except Exception as e:
+        print(f"Error starting chat listener: {type(e).__name__} - {e}")
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        return
+    disconnect_task = asyncio.create_task(_wait_for_disconnect(websocket))
+    try:
+        # Catch up after subscribing, so every message is either in the catch-up page or pushed by the hub
+        # (or both; those are only sent once)
+        caught_up_ids = set()
+        if since_position is not None:
+            missed_chats, has_more = await _load_chat_messages(db, patient_case_id, newer=True, cursor_position=since_position, limit=CHAT_MESSAGES_MAX_LIMIT)
+            if has_more:
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return
+            for doc in missed_chats:
+                caught_up_ids.add(doc.id)
+                await websocket.send_json(schemas.ChatMessageResponse(**{**doc.to_dict(), 'id': doc.id}).model_dump(mode="json", by_alias=True))
+
+        while True:
+            message_task = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({message_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect_task in done:
+                message_task.cancel()
+                break
+            message = message_task.result()
+            if message is SUBSCRIBER_OVERFLOW:
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                break
+            if message["_id"] in caught_up_ids:
+                continue
+            await websocket.send_json(message)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Error in chat stream: {type(e).__name__} - {e}")
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+    finally:
+        disconnect_task.cancel()
+        await chat_hub.unsubscribe(patient_case_id, queue)
+
+# --- AI ASSISTANT ENDPOINT ---
+
+# Coalesce identical in-flight AI requests (keyed like the response cache) into one upstream generation
+ai_single_flight = SingleFlight(name="ai_assistant")
+ai_stream_flights = StreamFlights()
+
+
+def _check_ai_assistant_access(current_user: schemas.UserResponse) -> None:
     if current_user.role != "doctor":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to use AI assistant"
         )
-    try:
-        if not GEMINI_API_KEY:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Gemini API key not configured"
-            )
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-        context_prompt = f"""
-You are a medical AI assistant helping a doctor review a patient case. Please provide concise, 
-professional medical information based on your medical knowledge.
+    if not get_llm_provider().is_configured():
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Gemini API key not configured"
+        )
+
+
+async def _assemble_ai_prompt(request: schemas.AIAssistantRequest, db: AsyncFirestoreClient) -> str:
+    """Builds the token-budgeted prompt, from the stored case and its recent chat if request.case_id is set."""
+    if not request.case_id:
+        return build_assistant_prompt(request.prompt, request.patient_symptoms, history=request.patient_history)
+
+    if not _is_valid_document_id(request.case_id): # Would make the Firestore client raise instead of a 404
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid case_id.")
+    case_context = await load_case_context(db, request.case_id)
+    if case_context is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Patient case not found")
+    return build_assistant_prompt(request.prompt, **case_context)
 
-PATIENT INFORMATION:
-- Symptoms: {', '.join(request.patient_symptoms)}
-{f"- Medical History: {request.patient_history}" if request.patient_history else ''}
 
-DOCTOR'S QUESTION: {request.prompt}
+def _ai_busy_exception(e: LLMBusyError) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f"AI assistant is busy, please retry shortly: {e}",
+        headers={"Retry-After": "5"},
+    )
 
-Please provide a medically accurate response. If you're uncertain, indicate the limitations of your knowledge.
-"""
-        response = model.generate_content(context_prompt)
-        return {"response": response.text}
+
+@app.post("/ai-assistant")
+async def doctor_ai_assistant(
+    request: schemas.AIAssistantRequest,
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
+):
+    _check_ai_assistant_access(current_user)
+    try:
+        context_prompt = await _assemble_ai_prompt(request, db)
+        cache_key = ai_request_cache_key(request, get_llm_provider().model_id, context=context_prompt)
+        if not request.bypass_cache:
+            cached_text = await ai_response_cache.get(cache_key)
+            if cached_text is not None:
+                return {"response": cached_text, "cached": True}
+
+        async def generate_and_cache() -> str:
+            started_at = time.perf_counter()
+            response_text = await generate_text(context_prompt)
+            await ai_response_cache.set(cache_key, response_text, time.perf_counter() - started_at)
+            return response_text
+
+        # Identical requests arriving while this one is generating share its Gemini call
+        response_text = await ai_single_flight.do(cache_key, generate_and_cache)
+        return {"response": response_text, "cached": False}
+    except HTTPException:
+        raise
+    except LLMBusyError as e:
+        raise _ai_busy_exception(e)
+    except LLMTimeoutError as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
     except Exception as e:
         print(f"Error in AI assistant: {type(e).__name__} - {e}")
         # Consider returning a more structured error response if clients expect it
@@ -455,16 +971,112 @@ Please provide a medically accurate response. If you're uncertain, indicate the
             detail=f"Failed to generate AI response: {str(e)}"
         )
 
+
+def _sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+@app.post("/ai-assistant/stream")
+async def doctor_ai_assistant_stream(
+    request: schemas.AIAssistantRequest,
+    http_request: Request,
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
+):
+    """
+    Streams the AI assistant's answer as Server-Sent Events while Gemini generates it:
+    `data: {"delta": "..."}` for each text chunk, then `data: {"done": true}`, or an `event: error` on failure.
+    When the client disconnects the upstream generation is cancelled.
+    """
+    _check_ai_assistant_access(current_user)
+    try:
+        context_prompt = await _assemble_ai_prompt(request, db)
+        cache_key = ai_request_cache_key(request, get_llm_provider().model_id, context=context_prompt)
+        if not request.bypass_cache:
+            cached_text = await ai_response_cache.get(cache_key)
+            if cached_text is not None:
+                async def cached_event_stream():
+                    yield _sse_event({"delta": cached_text, "cached": True})
+                    yield _sse_event({"done": True})
+                return StreamingResponse(cached_event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+        started_at = time.perf_counter()
+
+        async def cache_complete_answer(response_text: str) -> None:
+            await ai_response_cache.set(cache_key, response_text, time.perf_counter() - started_at)
+
+        # Identical requests arriving while this one is streaming join the same generation
+        broadcast = await ai_stream_flights.join(cache_key, lambda: open_text_stream(context_prompt), on_complete=cache_complete_answer)
+    except HTTPException:
+        raise
+    except LLMBusyError as e:
+        raise _ai_busy_exception(e)
+    except LLMTimeoutError as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+    except Exception as e:
+        print(f"Error in AI assistant stream: {type(e).__name__} - {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to generate AI response: {str(e)}"
+        )
+
+    # Registered as a reader before the response starts, so another coalesced request leaving in the meantime
+    # can't cancel the generation. Releasing this reader (break, cancellation on disconnect, or the background
+    # task if the body is never iterated) cancels the upstream generation once no other request is reading it.
+    chunks = broadcast.read()
+
+    async def event_stream():
+        try:
+            async for text in chunks:
+                if await http_request.is_disconnected():
+                    break
+                yield _sse_event({"delta": text})
+            else:
+                yield _sse_event({"done": True})
+        except LLMTimeoutError as e:
+            yield _sse_event({"detail": str(e)}, event="error")
+        except Exception as e:
+            print(f"Error in AI assistant stream: {type(e).__name__} - {e}")
+            yield _sse_event({"detail": f"Failed to generate AI response: {str(e)}"}, event="error")
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, # Don't let proxies buffer the stream
+        background=BackgroundTask(chunks.aclose),
+    )
+
+
+@app.get("/ai-assistant/cache-stats")
+async def get_ai_assistant_cache_stats(current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    """Hit rate and generation time saved by the AI assistant response cache (this worker only)."""
+    if current_user.role != "doctor":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to use AI assistant")
+    stats = ai_response_cache.stats()
+    stats["coalesced_requests"] = ai_single_flight.coalesced
+    stats["coalesced_streams"] = ai_stream_flights.coalesced
+    return stats
+
+@app.get("/ai-triage/status")
+async def get_ai_triage_status(current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    """Queue depth and throughput of the background AI triage worker (this worker process only)."""
+    if current_user.role != "doctor":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to use AI assistant")
+    return triage_worker.stats()
+
 # --- DOCTOR PROFILE ENDPOINTS ---
 
 @app.get("/doctor-profiles/{user_id}", response_model=schemas.DoctorProfile)
 async def get_doctor_profile_by_user_id(
     user_id: str,
-    db: FirestoreClient = Depends(get_firestore_db)
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
 ):
     try:
         profile_doc_ref = db.collection(u'doctor_profiles').document(user_id)
-        profile_snapshot = profile_doc_ref.get()
+        profile_snapshot = await profile_doc_ref.get()
 
         if not profile_snapshot.exists:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Doctor profile not found")
@@ -493,17 +1105,13 @@ async def get_doctor_profile_by_user_id(
 async def create_doctor_profile_for_current_user(
     profile_create: schemas.DoctorProfileCreate,
     current_user: schemas.UserResponse = Depends(get_current_active_user),
-    db: FirestoreClient = Depends(get_firestore_db)
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
 ):
     if current_user.role != "doctor":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only doctors can create profiles.")
 
     profile_doc_ref = db.collection(u'doctor_profiles').document(current_user.id)
     try:
-        existing_profile_snapshot = profile_doc_ref.get()
-        if existing_profile_snapshot.exists:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Profile already exists for this user.")
-
         profile_data_to_store = profile_create.model_dump(exclude_unset=True)
         profile_data_to_store['user_id'] = current_user.id
         profile_data_to_store['created_at'] = datetime.utcnow()
@@ -515,7 +1123,11 @@ async def create_doctor_profile_for_current_user(
             default_prefs = schemas.NotificationPreferences()
             profile_data_to_store['notification_preferences'] = json.dumps(default_prefs.model_dump())
 
-        profile_doc_ref.set(profile_data_to_store)
+        # create() fails if a profile already exists, so no existence check read is needed
+        try:
+            await profile_doc_ref.create(profile_data_to_store)
+        except AlreadyExists:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Profile already exists for this user.")
 
         # For response, convert notification_preferences back to model
         response_data = profile_data_to_store.copy()
@@ -536,18 +1148,19 @@ async def update_doctor_profile_by_id(
     profile_doc_id: str,
     profile_update: schemas.DoctorProfileUpdate,
     current_user: schemas.UserResponse = Depends(get_current_active_user),
-    db: FirestoreClient = Depends(get_firestore_db)
+    db: AsyncFirestoreClient = Depends(get_firestore_db)
 ):
     if current_user.id != profile_doc_id or current_user.role != "doctor":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to update this profile.")
 
     profile_doc_ref = db.collection(u'doctor_profiles').document(profile_doc_id)
     try:
-        if not (profile_doc_ref.get()).exists:
+        existing_snapshot = await profile_doc_ref.get()
+        if not existing_snapshot.exists:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Doctor profile not found to update.")
 
         update_data = profile_update.model_dump(exclude_unset=True)
-        update_data['updated_at'] = datetime.utcnow()
+        update_data['updated_at'] = firestore.SERVER_TIMESTAMP
 
         if 'notification_preferences' in update_data:
             if update_data['notification_preferences'] is not None:
@@ -563,12 +1176,14 @@ async def update_doctor_profile_by_id(
                 default_prefs = schemas.NotificationPreferences()
                 update_data['notification_preferences'] = json.dumps(default_prefs.model_dump())
 
-        profile_doc_ref.update(update_data)
+        write_result = await profile_doc_ref.update(update_data)
+        invalidate_user_profile(current_user.id) # Keep the cached profile of this doctor in step with their edits
 
-        updated_snapshot = profile_doc_ref.get()
-        response_data = updated_snapshot.to_dict()
-        response_data['id'] = updated_snapshot.id
-        response_data['user_id'] = updated_snapshot.id 
+        # The existence check above already read the profile; merge the update into it instead of reading again
+        response_data = {**existing_snapshot.to_dict(), **update_data}
+        response_data['updated_at'] = write_result.update_time
+        response_data['id'] = profile_doc_id
+        response_data['user_id'] = profile_doc_id
 
         notification_prefs_raw = response_data.get('notification_preferences')
         if isinstance(notification_prefs_raw, str):
@@ -591,14 +1206,75 @@ async def update_doctor_profile_by_id(
 async def health_check():
     return {"status": "healthy"}
 
+
+def _collect_service_metrics():
+    """Scrape-time metrics read from the caches, the AI single-flight and the triage worker of this process."""
+    families = cache_samples([token_cache, user_profile_cache, case_access_cache, ai_response_cache])
+    families += stats_samples("ai_single_flight", ai_single_flight.stats(), {"calls": "counter", "coalesced": "counter", "in_flight": "gauge"})
+    families += stats_samples("ai_triage", triage_worker.stats(), {
+        "queue_depth": "gauge", "in_progress": "gauge", "completed": "counter",
+        "failed": "counter", "dropped": "counter", "swept": "counter", "retries": "counter",
+    })
+    return families
+
+register_collector(_collect_service_metrics)
+
+
+# --- DEBUG ENDPOINTS ---
+
+def _check_profiling_admin(current_user: schemas.UserResponse) -> None:
+    if not is_profiling_admin(current_user.id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access request profiles")
+
+@app.get("/debug/profiles")
+async def get_request_profiles(current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    """Request profiles saved by this host (see profiling.py), newest first."""
+    _check_profiling_admin(current_user)
+    return list_profiles()
+
+@app.get("/debug/profiles/{profile_id}")
+async def get_request_profile(
+    profile_id: str,
+    format: Literal["text", "raw"] = Query("text", description="'raw' downloads the .prof file for pstats/snakeviz"),
+    sort: Literal["cumulative", "tottime", "ncalls"] = "cumulative",
+    limit: int = Query(50, ge=1, le=500),
+    current_user: schemas.UserResponse = Depends(get_current_active_user)
+):
+    _check_profiling_admin(current_user)
+    report = describe_profile(profile_id, sort_by=sort, limit=limit)
+    if report is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    if format == "raw":
+        return FileResponse(profile_path(profile_id), media_type="application/octet-stream", filename=f"{profile_id}.prof")
+    return PlainTextResponse(report)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus metrics of this worker process; restrict access at the ingress, it isn't authenticated."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return Response(content=render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 # Add initial data for development
 
+@app.on_event("startup")
+async def start_ai_triage_worker():
+    if AI_TRIAGE_ENABLED and get_llm_provider().is_configured():
+        triage_worker.start()
+    else:
+        print("AI triage worker disabled (AI_TRIAGE_ENABLED is false or the LLM provider is not configured).")
+
+@app.on_event("shutdown")
+async def stop_ai_triage_worker():
+    await triage_worker.stop()
+
 @app.on_event("startup")
 async def startup_db_client():
-    db: FirestoreClient = get_firestore_db()
+    db: AsyncFirestoreClient = get_firestore_db()
     
     users_collection_ref = db.collection(u'users')
-    users_query_snapshot = users_collection_ref.limit(1).get()
+    users_query_snapshot = await users_collection_ref.limit(1).get()
     if not users_query_snapshot: 
         print("Initializing sample data in Firestore...")
         
@@ -618,7 +1294,7 @@ async def startup_db_client():
                 contact_email="gregory.house@example.com"
             )
         ).model_dump(exclude={'id'})
-        users_collection_ref.document(doctor_firebase_uid).set(doctor_user_data_dict)
+        await users_collection_ref.document(doctor_firebase_uid).set(doctor_user_data_dict)
 
         doctor_profile_for_db = schemas.DoctorProfile(
             id=doctor_firebase_uid,
@@ -632,7 +1308,7 @@ async def startup_db_client():
             updated_at=datetime.utcnow()
         ).model_dump()
         doctor_profile_for_db['notification_preferences'] = json.dumps(doctor_profile_for_db['notification_preferences'])
-        db.collection(u'doctor_profiles').document(doctor_profile_for_db.pop('id')).set(doctor_profile_for_db)
+        await db.collection(u'doctor_profiles').document(doctor_profile_for_db.pop('id')).set(doctor_profile_for_db)
 
         patient_firebase_uid = "sample-patient-" + uuid.uuid4().hex[:6]
         patient_user_data_dict = schemas.UserInDB(
@@ -644,7 +1320,7 @@ async def startup_db_client():
             disabled=False,
             hashed_password=None
         ).model_dump(exclude={'id'})
-        users_collection_ref.document(patient_firebase_uid).set(patient_user_data_dict)
+        await users_collection_ref.document(patient_firebase_uid).set(patient_user_data_dict)
 
         patient_cases_collection_ref = db.collection(u'patientCases')
         sample_cases_data = [
@@ -654,7 +1330,7 @@ async def startup_db_client():
                 "age": 42, 
                 "gender": "Male", 
                 "severity": "low", 
-                "symptoms": json.dumps(["General fatigue", "Occasional headache"]),
+                "symptoms": ["General fatigue", "Occasional headache"],
                 "ai_recommendation": "Standard blood work recommended. Monitor symptoms.", 
                 "status": "pending",
                 "timestamp": datetime.utcnow(), "updated_at": datetime.utcnow(), "doctor_id": None
@@ -665,14 +1341,14 @@ async def startup_db_client():
                 "age": 42, 
                 "gender": "Male", 
                 "severity": "medium", 
-                "symptoms": json.dumps(["Fever", "Cough", "Body aches"]),
+                "symptoms": ["Fever", "Cough", "Body aches"],
                 "ai_recommendation": "Advise rest, hydration, and over-the-counter medication. Consider testing for influenza if symptoms persist or worsen.", 
                 "status": "pending",
                 "timestamp": datetime.utcnow(), "updated_at": datetime.utcnow(), "doctor_id": None
             }
         ]
         for case_data in sample_cases_data:
-            patient_cases_collection_ref.add(case_data)
+            await patient_cases_collection_ref.add(case_data)
         print("Sample data initialization complete.")
     else:
         print("Existing data found. Skipping sample data initialization.")
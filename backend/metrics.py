@@ -0,0 +1,228 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Minimal Prometheus-compatible metrics served at GET /metrics (text exposition format 0.0.4).
+# Counters, gauges and histograms are kept in memory per uvicorn worker process; with several workers each
+# scrape sees one worker, so run one worker per container (as the Dockerfile does) or scrape workers separately.
+# Values that already live elsewhere (cache hit counters, queue depths) are read at scrape time through
+# register_collector() instead of being duplicated here.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; from a cached auth lookup up to a long LLM generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names: Iterable[str], label_values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values: dict = {} # label values tuple -> value
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    series["buckets"][index] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = sorted(((key, dict(series, buckets=list(series["buckets"]))) for key, series in self._values.items()), key=lambda item: item[0])
+        for label_values, series in items:
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets, series["buckets"]):
+                cumulative += count
+                le = _format_labels(self.label_names, label_values, f'le="{_format_value(upper_bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series['count']}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+_registry: List[_Metric] = []
+# Each collector returns (name, type, help, [(labels dict, value), ...]) tuples, read on every scrape
+_collectors: List[Callable[[], Iterable[tuple]]] = []
+
+
+def register_collector(collector: Callable[[], Iterable[tuple]]) -> None:
+    _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        try:
+            families = list(collector())
+        except Exception as e: # A broken collector shouldn't take the whole endpoint down
+            print(f"Error collecting metrics: {type(e).__name__} - {e}")
+            continue
+        for name, metric_type, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Metrics shared across modules ---
+
+process_start_time = Gauge("process_start_time_seconds", "Start time of the worker process since the Unix epoch.")
+process_start_time.set(time.time())
+
+http_request_seconds = Histogram(
+    "http_request_duration_seconds", "HTTP request latency, until the response body is complete.",
+    ("method", "route", "status"),
+)
+http_requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being handled by this worker.")
+
+firestore_rpc_seconds = Histogram(
+    "firestore_rpc_duration_seconds", "Firestore RPC latency (streaming RPCs until the caller stops reading them).",
+    ("rpc",), buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+firestore_rpc_errors = Counter("firestore_rpc_errors_total", "Firestore RPCs that raised an error.", ("rpc",))
+
+llm_request_seconds = Histogram(
+    "llm_request_duration_seconds", "LLM generation latency, including streamed output.", ("provider", "mode", "outcome"),
+)
+llm_tokens = Counter(
+    "llm_tokens_total", "LLM tokens sent and received (estimated at 4 characters per token).", ("provider", "direction"),
+)
+llm_slots_in_use = Gauge("llm_slots_in_use", "LLM call slots currently taken (saturated at LLM_MAX_CONCURRENT_CALLS).")
+llm_busy_rejections = Counter("llm_busy_rejections_total", "LLM calls rejected because no slot freed up in time.")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency per route template and status, and the number of requests in flight."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        response_status = {"code": 500} # If the app fails before starting a response, the server answers 500
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                response_status["code"] = message["status"]
+            await send(message)
+
+        started_at = time.perf_counter()
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            # The route template (not the raw path) keeps the number of label values bounded
+            route = scope.get("route")
+            http_request_seconds.observe(
+                time.perf_counter() - started_at,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=response_status["code"],
+            )
+
+
+def cache_samples(caches: Iterable) -> List[tuple]:
+    """Metric families for objects with a TTLCache-style stats() (name, size, hits, misses)."""
+    stats = [cache.stats() for cache in caches]
+    return [
+        ("cache_hits_total", "counter", "Cache lookups served from the cache.", [({"cache": s["name"]}, s["hits"]) for s in stats]),
+        ("cache_misses_total", "counter", "Cache lookups that missed.", [({"cache": s["name"]}, s["misses"]) for s in stats]),
+        ("cache_entries", "gauge", "Entries currently cached.", [({"cache": s["name"]}, s["size"]) for s in stats]),
+    ]
+
+
+def stats_samples(prefix: str, stats: Dict[str, object], kinds: Dict[str, str]) -> List[tuple]:
+    """Metric families for selected numeric fields of a stats() dict; kinds maps field -> counter/gauge."""
+    families = []
+    for field, metric_type in kinds.items():
+        value = stats.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            name = f"{prefix}_{field}_total" if metric_type == "counter" else f"{prefix}_{field}"
+            families.append((name, metric_type, f"{prefix} {field.replace('_', ' ')}.", [({}, value)]))
+    return families
@@ -0,0 +1,85 @@
+"""
+One-off migration: rewrites patientCases documents whose 'symptoms' field is still a JSON-encoded
+string into a native Firestore array (the shape of schemas.PatientCaseBase.symptoms).
+
+The migration walks the collection in document-id order and commits in batches. After every batch the
+last processed document id is written to a checkpoint file, so an interrupted run resumes where it stopped.
+
+Usage (from the backend directory, with GOOGLE_APPLICATION_CREDENTIALS set as for the API):
+    python migrate_symptoms.py [--batch-size 200] [--checkpoint .migrate_symptoms.checkpoint] [--dry-run]
+"""
+import argparse
+import os
+
+from firebase_admin import firestore
+from google.api_core.exceptions import FailedPrecondition
+
+import database # Initializes the Firebase Admin SDK
+from models import symptoms_from_firestore
+
+MAX_BATCH_SIZE = 500 # Firestore limit on writes per batch
+
+
+def read_checkpoint(path: str):
+    if os.path.exists(path):
+        with open(path) as f:
+            return f.read().strip() or None
+    return None
+
+
+def write_checkpoint(path: str, last_doc_id: str) -> None:
+    with open(path, "w") as f:
+        f.write(last_doc_id)
+
+
+def migrate(batch_size: int, checkpoint_path: str, dry_run: bool = False) -> None:
+    db = firestore.client() # The synchronous client is fine for a command-line tool
+    cases_ref = db.collection(u'patientCases')
+    last_doc_id = read_checkpoint(checkpoint_path)
+    if last_doc_id:
+        print(f"Resuming after document {last_doc_id}")
+
+    scanned = migrated = 0
+    while True:
+        query = cases_ref.order_by("__name__").limit(batch_size)
+        if last_doc_id:
+            query = query.start_after({"__name__": last_doc_id})
+        docs = query.get()
+        if not docs:
+            break
+
+        batch = db.batch()
+        pending_writes = 0
+        for doc in docs:
+            symptoms = doc.to_dict().get('symptoms')
+            if isinstance(symptoms, str):
+                # Only if the case is unchanged since it was read, so a concurrent edit isn't overwritten
+                batch.update(doc.reference, {'symptoms': symptoms_from_firestore(symptoms)},
+                             option=db.write_option(last_update_time=doc.update_time))
+                pending_writes += 1
+        if pending_writes and not dry_run:
+            try:
+                batch.commit()
+            except FailedPrecondition: # A case of this page changed; nothing was written, so read the page again
+                print(f"Cases changed while migrating the page after {last_doc_id or 'the start'}; retrying it")
+                continue
+
+        scanned += len(docs)
+        migrated += pending_writes
+        last_doc_id = docs[-1].id
+        if not dry_run:
+            write_checkpoint(checkpoint_path, last_doc_id)
+        print(f"Scanned {scanned} cases, {'would migrate' if dry_run else 'migrated'} {migrated} (last id: {last_doc_id})")
+
+    print("Symptoms migration complete.")
+    if not dry_run and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path) # A finished run starts from the beginning next time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert JSON-string symptoms on patient cases to native arrays.")
+    parser.add_argument("--batch-size", type=int, default=200, help=f"Documents per batch (max {MAX_BATCH_SIZE})")
+    parser.add_argument("--checkpoint", default=".migrate_symptoms.checkpoint", help="File recording the last migrated document id")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+    migrate(min(max(args.batch_size, 1), MAX_BATCH_SIZE), args.checkpoint, args.dry_run)
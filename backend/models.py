@@ -5,3 +5,23 @@
 # You can keep this file for utility functions related to data transformation
 # for Firestore if needed, or delete it if all data structure definitions
 # move to schemas.py.
+
+import json
+from typing import Any, List
+
+
+def symptoms_from_firestore(value: Any) -> List[str]:
+    """
+    Normalizes the stored 'symptoms' field of a patient case to a list.
+    New documents store a native Firestore array; older ones hold a JSON-encoded string
+    until migrate_symptoms.py has rewritten them, so both formats are accepted.
+    """
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str):
+        try:
+            decoded = json.loads(value)
+        except ValueError:
+            return [value] # Plain string that was never JSON encoded
+        return decoded if isinstance(decoded, list) else []
+    return [] # Missing or unexpected type
@@ -0,0 +1,127 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from typing import List, Optional
+
+from starlette.datastructures import MutableHeaders
+
+from auth import verify_firebase_token
+
+# On-demand cProfile profiles of single requests, to see where a slow route spends its time (validation,
+# symptom decoding, Firestore calls, auth...). A request is profiled when
+#   - it carries "X-Profile: 1" and a Firebase ID token of a user listed in PROFILING_ADMIN_UIDS, or
+#   - it is picked by PROFILING_SAMPLE_RATE (fraction of all requests, default 0).
+# Profiles are written to PROFILING_DIR and retrieved through GET /debug/profiles (admins only); the profiled
+# response carries their id in X-Profile-Id. When neither option is configured the middleware isn't installed
+# at all, so there is no overhead.
+# cProfile records everything running on the event loop while the request is in progress, so with other
+# requests in flight their coroutines show up too. Only one request per worker is profiled at a time.
+
+PROFILING_ADMIN_UIDS = {uid.strip() for uid in os.getenv("PROFILING_ADMIN_UIDS", "").split(",") if uid.strip()}
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", "./profiles")
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "100")) # Oldest profiles are deleted beyond this
+PROFILING_ENABLED = bool(PROFILING_ADMIN_UIDS) or PROFILING_SAMPLE_RATE > 0
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$")
+
+
+def is_profiling_admin(user_id: str) -> bool:
+    return user_id in PROFILING_ADMIN_UIDS
+
+
+async def _requested_by_admin(scope) -> bool:
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+    if headers.get("x-profile") != "1" or not PROFILING_ADMIN_UIDS:
+        return False
+    authorization = headers.get("authorization", "")
+    if not authorization.startswith("Bearer "):
+        return False
+    try:
+        decoded_token = await verify_firebase_token(authorization[len("Bearer "):]) # Usually a token cache hit
+    except Exception: # Invalid tokens are rejected by the endpoint itself; just don't profile
+        return False
+    return is_profiling_admin(decoded_token.get("uid"))
+
+
+def profile_path(profile_id: str) -> str:
+    return os.path.join(PROFILING_DIR, f"{profile_id}.prof")
+
+
+def _save_profile(profiler: cProfile.Profile, profile_id: str) -> None:
+    os.makedirs(PROFILING_DIR, exist_ok=True)
+    profiler.dump_stats(profile_path(profile_id))
+    profile_files = sorted(name for name in os.listdir(PROFILING_DIR) if name.endswith(".prof"))
+    for name in profile_files[:max(len(profile_files) - PROFILING_MAX_FILES, 0)]:
+        os.remove(os.path.join(PROFILING_DIR, name))
+
+
+def list_profiles() -> List[dict]:
+    """Saved profiles, newest first."""
+    if not os.path.isdir(PROFILING_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILING_DIR), reverse=True):
+        profile_id = name[:-len(".prof")]
+        if name.endswith(".prof") and PROFILE_ID_PATTERN.match(profile_id):
+            stat = os.stat(os.path.join(PROFILING_DIR, name))
+            profiles.append({"id": profile_id, "created_at": stat.st_mtime, "size_bytes": stat.st_size})
+    return profiles
+
+
+def describe_profile(profile_id: str, sort_by: str = "cumulative", limit: int = 50) -> Optional[str]:
+    """pstats text report of a saved profile, or None if there is no such profile."""
+    if not PROFILE_ID_PATTERN.match(profile_id) or not os.path.exists(profile_path(profile_id)):
+        return None
+    report = io.StringIO()
+    stats = pstats.Stats(profile_path(profile_id), stream=report)
+    stats.strip_dirs().sort_stats(sort_by).print_stats(limit)
+    return report.getvalue()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling admin-requested and sampled requests; see the module comment."""
+
+    def __init__(self, app):
+        self.app = app
+        self._busy = False # cProfile can't run two profiles at once
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._busy:
+            await self.app(scope, receive, send)
+            return
+        sampled = PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE
+        if not sampled and not await _requested_by_admin(scope) or self._busy: # Busy again after the token check
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("X-Profile-Id", profile_id)
+            await send(message)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e: # Another profiler (e.g. a debugger) is active
+            print(f"Error starting request profile: {e}")
+            await self.app(scope, receive, send)
+            return
+        self._busy = True
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.disable()
+            self._busy = False
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, _save_profile, profiler, profile_id)
+            except OSError as e:
+                print(f"Error saving request profile: {type(e).__name__} - {e}")
@@ -0,0 +1,239 @@
+import asyncio
+import contextvars
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+
+from metrics import firestore_rpc_errors, firestore_rpc_seconds
+
+# Per-request cost accounting, reported in a Server-Timing response header so slow requests can be broken down
+# from the browser's devtools (Network tab > Timing):
+#   auth       token verification and profile lookup
+#   firestore  time spent in Firestore RPCs, with read/write/query counts in its description
+#   gemini     time spent waiting for the LLM (before the response starts; not the streamed part of SSE answers)
+#   serialize  from the endpoint returning to the response starting: response_model validation and JSON encoding
+#              (endpoints serializing their own payload call mark_endpoint_done() before doing so)
+#   total      from the request arriving to the response starting
+# Phases are summed per request, so RPCs running concurrently can add up to more than the wall-clock total.
+
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+
+# Firestore RPCs by category. Reads and writes count documents (a get_all of 10 documents is 10 reads in one
+# RPC, as Firestore bills it); queries count run_query calls, whose returned documents aren't counted.
+_READ_RPCS = {"batch_get_documents": "documents", "get_document": None, "list_documents": None}
+_WRITE_RPCS = {"commit": "writes", "batch_write": "writes", "create_document": None, "update_document": None, "delete_document": None}
+_QUERY_RPCS = {"run_query", "run_aggregation_query", "partition_query", "list_collection_ids"}
+_OTHER_RPCS = {"begin_transaction", "rollback"}
+_STREAMING_RPCS = {"batch_get_documents", "run_query", "run_aggregation_query"}
+
+_current_stats: contextvars.ContextVar = contextvars.ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.endpoint_done_at: Optional[float] = None
+        self.phases: dict = {} # phase name -> seconds
+        self.firestore_rpcs = 0
+        self.firestore_reads = 0
+        self.firestore_writes = 0
+        self.firestore_queries = 0
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def server_timing(self, response_started_at: float) -> str:
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items() if name != "firestore"]
+        if self.firestore_rpcs:
+            entries.append(
+                f'firestore;dur={self.phases.get("firestore", 0.0) * 1000:.1f};desc="rpcs={self.firestore_rpcs} '
+                f'reads={self.firestore_reads} writes={self.firestore_writes} queries={self.firestore_queries}"'
+            )
+        if self.endpoint_done_at is not None:
+            entries.append(f"serialize;dur={(response_started_at - self.endpoint_done_at) * 1000:.1f}")
+        entries.append(f"total;dur={(response_started_at - self.started_at) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    """Stats of the HTTP request being handled, or None outside a request (e.g. in the triage worker)."""
+    return _current_stats.get()
+
+
+def mark_endpoint_done() -> None:
+    """
+    Marks the end of the endpoint's own work for the current request, so what follows counts as serialize.
+    Only the first call counts; TimedAPIRoute calls it when the endpoint returns.
+    """
+    stats = _current_stats.get()
+    if stats is not None and stats.endpoint_done_at is None:
+        stats.endpoint_done_at = time.perf_counter()
+
+
+@contextmanager
+def timed_phase(name: str):
+    """Adds the time spent in the block to the current request's phase `name`."""
+    stats = _current_stats.get()
+    if stats is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_phase(name, time.perf_counter() - started_at)
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware that collects RequestStats for each HTTP request and adds the Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not SERVER_TIMING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+
+        async def send_with_server_timing(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", stats.server_timing(time.perf_counter()))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_server_timing)
+        finally:
+            _current_stats.reset(token)
+
+
+class TimedAPIRoute(APIRoute):
+    """Route class recording when the endpoint function returns, which splits endpoint time from serialization."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _mark_endpoint_done(endpoint), **kwargs)
+
+
+def _mark_endpoint_done(endpoint):
+    if not asyncio.iscoroutinefunction(endpoint):
+        return endpoint
+
+    @functools.wraps(endpoint) # FastAPI reads the parameters through __wrapped__
+    async def timed_endpoint(*args, **kwargs):
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            mark_endpoint_done()
+    return timed_endpoint
+
+
+def instrument_firestore_client(client) -> None:
+    """
+    Wraps the RPC methods of an async Firestore client so every call is timed and counted against the current
+    request, and recorded in the firestore_rpc_duration_seconds metric. The client from firestore_async.client() is shared, so this only needs to happen once.
+    Prints a warning if the client has none of the expected RPC methods.
+    """
+    if getattr(client, "_request_stats_instrumented", False):
+        return
+    api = client._firestore_api
+    instrumented = []
+    for rpc_name in [*_READ_RPCS, *_WRITE_RPCS, *_QUERY_RPCS, *_OTHER_RPCS]:
+        method = getattr(api, rpc_name, None)
+        if method is not None:
+            setattr(api, rpc_name, _timed_rpc(rpc_name, method))
+            instrumented.append(rpc_name)
+    if not instrumented:
+        # The RPC names come from the client library's internal API; after an incompatible upgrade every count
+        # would silently read zero
+        print(f"Warning: none of the expected Firestore RPCs found on {type(api).__name__}; "
+              f"Server-Timing and firestore_rpc metrics won't include Firestore calls")
+    client._request_stats_instrumented = True
+
+
+def _request_item_count(kwargs: dict, field: Optional[str]) -> int:
+    request = kwargs.get("request")
+    if field is None or request is None:
+        return 1
+    items = request.get(field) if isinstance(request, dict) else getattr(request, field, None)
+    return len(items) if items else 0
+
+
+def _timed_rpc(rpc_name: str, method):
+    async def timed(*args, **kwargs):
+        stats = _current_stats.get()
+        started_at = time.perf_counter()
+        try:
+            response = await method(*args, **kwargs)
+        except Exception:
+            firestore_rpc_errors.inc(rpc=rpc_name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started_at
+            if stats is not None:
+                _count_rpc(stats, rpc_name, kwargs)
+                stats.add_phase("firestore", elapsed)
+        if rpc_name in _STREAMING_RPCS:
+            return _TimedStream(response, rpc_name, stats, elapsed)
+        firestore_rpc_seconds.observe(elapsed, rpc=rpc_name)
+        return response
+    return timed
+
+
+def _count_rpc(stats: RequestStats, rpc_name: str, kwargs: dict) -> None:
+    stats.firestore_rpcs += 1
+    if rpc_name in _READ_RPCS:
+        stats.firestore_reads += _request_item_count(kwargs, _READ_RPCS[rpc_name])
+    elif rpc_name in _WRITE_RPCS:
+        stats.firestore_writes += _request_item_count(kwargs, _WRITE_RPCS[rpc_name])
+    elif rpc_name in _QUERY_RPCS:
+        stats.firestore_queries += 1
+
+
+class _TimedStream:
+    """Server-streaming RPC response; time spent waiting for its messages counts towards the RPC's latency."""
+
+    def __init__(self, stream, rpc_name: str, stats: Optional[RequestStats], open_seconds: float):
+        self._stream = stream
+        self._rpc_name = rpc_name
+        self._stats = stats
+        self._wait_seconds = open_seconds
+        self._observed = False
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        iterator = self._stream.__aiter__()
+        try:
+            while True:
+                started_at = time.perf_counter()
+                try:
+                    message = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                except Exception:
+                    firestore_rpc_errors.inc(rpc=self._rpc_name)
+                    raise
+                finally:
+                    elapsed = time.perf_counter() - started_at
+                    self._wait_seconds += elapsed
+                    if self._stats is not None:
+                        self._stats.add_phase("firestore", elapsed)
+                yield message
+        finally:
+            # Also runs when the caller stops reading early and the generator is closed, e.g. a document get()
+            # returns after the first batch_get_documents message without draining the stream
+            if not self._observed:
+                self._observed = True
+                firestore_rpc_seconds.observe(self._wait_seconds, rpc=self._rpc_name)
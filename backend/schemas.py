@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 from typing import List, Optional, Dict
 from datetime import datetime
 # import uuid # No longer using UUID directly in models for IDs, Firestore uses strings
@@ -116,6 +116,12 @@ class PatientCaseInDB(PatientCaseBase): # Represents a PatientCase document in F
     timestamp: datetime = Field(default_factory=datetime.utcnow) # Creation timestamp
     updated_at: Optional[datetime] = None # Last update timestamp
     # patient_id: str # Ensure this is present
+    # Chat summary, maintained by POST /chats in the same batch as the message
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
+    message_count: int = 0
+    unread_by_doctor: int = 0 # Messages from the patient not yet marked read by a doctor
+    unread_by_patient: int = 0 # Messages from doctors/AI not yet marked read by the patient
 
     class Config:
         populate_by_name = True
@@ -124,6 +130,33 @@ class PatientCaseInDB(PatientCaseBase): # Represents a PatientCase document in F
 class PatientCaseResponse(PatientCaseInDB): # For API responses
     pass
 
+class PatientCaseSummary(BaseModel): # Slim listing row for GET /patient-cases?view=summary
+    id: str = Field(..., alias="_id") # Firestore document ID, serialized as "_id" like the full view
+    name: str
+    severity: str
+    status: str = "pending"
+    timestamp: datetime
+    doctor_id: Optional[str] = None
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
+    message_count: int = 0
+    unread_by_doctor: int = 0
+    unread_by_patient: int = 0
+
+    class Config:
+        populate_by_name = True
+
+# Precompiled validators/serializers for the list endpoints: one validate_python call checks the whole page and
+# dump_json writes it straight to JSON bytes, instead of a model per document plus FastAPI's response_model pass.
+PATIENT_CASE_LIST = TypeAdapter(List[PatientCaseResponse])
+PATIENT_CASE_SUMMARY_LIST = TypeAdapter(List[PatientCaseSummary])
+
+# Firestore fields read for the summary view (the document id comes with every snapshot)
+PATIENT_CASE_SUMMARY_FIELDS = [
+    "name", "severity", "status", "timestamp", "doctor_id",
+    "last_message_at", "last_message_preview", "message_count", "unread_by_doctor", "unread_by_patient",
+]
+
 
 class PatientCaseUpdate(BaseModel):
     name: Optional[str] = None
@@ -138,6 +171,26 @@ class PatientCaseUpdate(BaseModel):
     medical_history: Optional[str] = None
 
 
+# Bulk case operations (POST/PATCH /patient-cases/bulk); one Firestore write batch holds at most 500 writes
+BULK_MAX_ITEMS = 500
+
+class PatientCaseBulkCreate(BaseModel):
+    items: List[PatientCaseCreate] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class PatientCaseBulkUpdateItem(PatientCaseUpdate):
+    case_id: str
+
+class PatientCaseBulkUpdate(BaseModel):
+    items: List[PatientCaseBulkUpdateItem] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class PatientCaseBulkResult(BaseModel): # Outcome for one item, in request order
+    index: int
+    case_id: Optional[str] = None
+    status_code: int
+    detail: Optional[str] = None
+    case: Optional[PatientCaseResponse] = None
+
+
 # --- ChatMessage Schemas (for subcollection patientCases/{caseId}/chats) ---
 
 class ChatMessageBase(BaseModel):
@@ -146,8 +199,10 @@ class ChatMessageBase(BaseModel):
     sender_type: str  # "doctor", "patient", or "ai"
     content: str
 
-class ChatMessageCreate(ChatMessageBase):
-    pass
+class ChatMessageCreate(BaseModel): # sender_id is taken from the authenticated user
+    patient_case_id: str
+    sender_type: str
+    content: str
 
 class ChatMessageInDB(ChatMessageBase): # Represents a ChatMessage document in Firestore subcollection
     id: str = Field(..., alias="_id") # Firestore document ID
@@ -161,12 +216,16 @@ class ChatMessageInDB(ChatMessageBase): # Represents a ChatMessage document in F
 class ChatMessageResponse(ChatMessageInDB): # For API responses
     pass
 
+CHAT_MESSAGE_LIST = TypeAdapter(List[ChatMessageResponse])
+
 
 # --- AI Assistant ---
 class AIAssistantRequest(BaseModel):
     prompt: Optional[str] = None # Make prompt optional if structured data is preferred
-    patient_symptoms: List[str]
+    case_id: Optional[str] = None # If set, symptoms, history and recent chat are loaded server-side and the fields below are ignored
+    patient_symptoms: List[str] = []
     patient_history: Optional[str] = None
+    bypass_cache: bool = False # Always ask the model instead of reusing a cached answer (the fresh answer is still cached)
     # Could add more structured fields here if the prompt is always similar
     # e.g., current_medications: Optional[List[str]] = None
     #       allergies: Optional[List[str]] = None
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import sys
+
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+from google.api_core.exceptions import Aborted, AlreadyExists, NotFound
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.firestore_v1 import _helpers
+from google.cloud.firestore_v1.async_client import AsyncClient
+from google.cloud.firestore_v1.async_query import AsyncQuery
+from google.cloud.firestore_v1.types import BatchGetDocumentsResponse, BeginTransactionResponse, CommitResponse, Document, WriteResult
+
+# The tests import the backend modules the same way uvicorn does (run from the backend directory)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main # noqa: E402
+import schemas # noqa: E402
+from auth import get_current_active_user # noqa: E402
+from database import get_firestore_db # noqa: E402
+
+
+@pytest.fixture
+def firestore_db():
+    # A real async client builds and validates queries locally; nothing is sent until a query is run
+    return AsyncClient(project="medicalai-test", credentials=AnonymousCredentials())
+
+
+class FakeFirestoreAPI:
+    """
+    In-memory stand-in for the Firestore RPCs behind document reads, transactions and write batches (queries are
+    not supported). `documents` maps paths such as "patientCases/case-1" to their data; commits apply their writes
+    to it atomically, including Increment and server timestamp transforms, and fail like Firestore on a missing
+    (update) or existing (create) document. The next `abort_commits` transaction commits fail with Aborted, which
+    makes the client retry the transaction, after calling `before_abort` (e.g. to simulate a concurrent write).
+    """
+
+    def __init__(self, client: AsyncClient):
+        self._client = client
+        self._prefix = f"{client._database_string}/documents/"
+        self.documents = {}
+        self.reads = [] # Paths of the documents read, in order
+        self.commits = [] # Writes of each successful commit
+        self.abort_commits = 0
+        self.before_abort = None
+
+    async def begin_transaction(self, request, **kwargs):
+        return BeginTransactionResponse(transaction=b"transaction")
+
+    async def rollback(self, request, **kwargs):
+        return None
+
+    async def batch_get_documents(self, request, **kwargs):
+        now = datetime.now(timezone.utc)
+        responses = []
+        for name in request["documents"]:
+            path = name[len(self._prefix):]
+            self.reads.append(path)
+            data = self.documents.get(path)
+            if data is None:
+                responses.append(BatchGetDocumentsResponse(missing=name, read_time=now))
+            else:
+                document = Document(name=name, fields=_helpers.encode_dict(data), create_time=now, update_time=now)
+                responses.append(BatchGetDocumentsResponse(found=document, read_time=now))
+
+        async def stream():
+            for response in responses:
+                yield response
+        return stream()
+
+    async def commit(self, request, **kwargs):
+        if request.get("transaction") and self.abort_commits:
+            self.abort_commits -= 1
+            if self.before_abort is not None:
+                self.before_abort()
+            raise Aborted("Transaction was aborted by a concurrent write")
+        now = datetime.now(timezone.utc)
+        documents = dict(self.documents)
+        for write in request["writes"]:
+            self._apply(documents, write, now)
+        self.documents = documents
+        self.commits.append(list(request["writes"]))
+        return CommitResponse(write_results=[WriteResult(update_time=now) for _ in request["writes"]], commit_time=now)
+
+    def _apply(self, documents: dict, write, now: datetime) -> None:
+        path = write.update.name[len(self._prefix):]
+        if "current_document" in write and "exists" in write.current_document:
+            if write.current_document.exists and path not in documents:
+                raise NotFound(f"No document to update: {path}")
+            if not write.current_document.exists and path in documents:
+                raise AlreadyExists(f"Document already exists: {path}")
+        fields = _helpers.decode_dict(write.update.fields, self._client)
+        if "update_mask" in write:
+            data = {**documents.get(path, {}), **fields}
+            for field_path in write.update_mask.field_paths:
+                if field_path not in fields:
+                    data.pop(field_path, None)
+        else:
+            data = fields
+        for transform in write.update_transforms:
+            if "increment" in transform:
+                data[transform.field_path] = data.get(transform.field_path, 0) + _helpers.decode_value(transform.increment, self._client)
+            else: # set_to_server_value: the request time
+                data[transform.field_path] = now
+        documents[path] = data
+
+
+@pytest.fixture
+def firestore_api(firestore_db):
+    """Serves the firestore_db client's document reads and writes from a FakeFirestoreAPI."""
+    api = FakeFirestoreAPI(firestore_db)
+    firestore_db._firestore_api_internal = api
+    return api
+
+
+@pytest.fixture
+def executed_queries(monkeypatch):
+    """Queries the endpoints run, answered with no documents instead of calling Firestore."""
+    queries = []
+
+    async def fake_get(self, *args, **kwargs):
+        self._to_protobuf() # Builds the request that would be sent, so invalid cursors or orderings still fail
+        queries.append(self)
+        return []
+
+    monkeypatch.setattr(AsyncQuery, "get", fake_get)
+    return queries
+
+
+@pytest.fixture
+def current_user():
+    """The signed-in user; a doctor unless a test overrides this fixture."""
+    return schemas.UserResponse(id="doctor-1", username="doctor1", email="doctor1@example.com", role="doctor")
+
+
+class ASGIClient:
+    """Sends each request straight to the app (no server, no startup events), one event loop per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        async def send():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app), base_url="http://testserver") as http_client:
+                return await http_client.request(method, url, **kwargs)
+        return asyncio.run(send())
+
+    def get(self, url: str, **kwargs) -> httpx.Response:
+        return self.request("GET", url, **kwargs)
+
+
+@pytest.fixture
+def client(firestore_db, current_user):
+    main.app.dependency_overrides[get_firestore_db] = lambda: firestore_db
+    main.app.dependency_overrides[get_current_active_user] = lambda: current_user
+    try:
+        yield ASGIClient(main.app)
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+def order_fields(query) -> list:
+    """(field path, direction name) of each order_by on a query."""
+    return [(order.field.field_path, order.direction.name) for order in query._orders]
@@ -0,0 +1,48 @@
+import pytest
+
+import llm
+import main
+from llm import FakeLLMProvider
+
+
+@pytest.fixture
+def fake_llm():
+    previous = llm.get_llm_provider()
+    llm.set_llm_provider(FakeLLMProvider(latency_distribution="fixed", latency_mean_ms=0, response_tokens=3, tokens_per_second=1000))
+    yield
+    llm.set_llm_provider(previous)
+
+
+@pytest.mark.parametrize("path", ["/ai-assistant", "/ai-assistant/stream"])
+def test_case_context_read_errors_are_handled(client, fake_llm, monkeypatch, path):
+    async def failing_load_case_context(db, case_id):
+        raise RuntimeError("Firestore unavailable")
+
+    monkeypatch.setattr(main, "load_case_context", failing_load_case_context)
+    response = client.request("POST", path, json={"case_id": "case-1", "prompt": "Next steps?"})
+
+    assert response.status_code == 500
+    assert response.json() == {"detail": "Failed to generate AI response: Firestore unavailable"}
+
+
+def test_missing_case_is_a_404_on_the_stream(client, fake_llm, monkeypatch):
+    async def no_case(db, case_id):
+        return None
+
+    monkeypatch.setattr(main, "load_case_context", no_case)
+    response = client.request("POST", "/ai-assistant/stream", json={"case_id": "case-1", "prompt": "Next steps?"})
+
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/ai-assistant", "/ai-assistant/stream"])
+@pytest.mark.parametrize("case_id", ["cases/case-1", "__case__", ".."])
+def test_invalid_case_ids_are_a_400(client, fake_llm, monkeypatch, path, case_id):
+    async def unexpected_load_case_context(db, case_id):
+        raise AssertionError("The case should not be read")
+
+    monkeypatch.setattr(main, "load_case_context", unexpected_load_case_context)
+    response = client.request("POST", path, json={"case_id": case_id, "prompt": "Next steps?"})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid case_id."}
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+from ai_cache import AIResponseCache, _DiskTier
+
+
+def _keys(disk: _DiskTier) -> list:
+    return [row[0] for row in disk._conn.execute("SELECT key FROM ai_responses ORDER BY key")]
+
+
+def test_expired_disk_entries_are_purged_at_startup(tmp_path):
+    path = str(tmp_path / "ai_cache.sqlite3")
+    disk = _DiskTier(path)
+    disk.set("expired", "Old answer", 1.0, time.time() - 1)
+    disk.set("fresh", "New answer", 1.0, time.time() + 60)
+    disk._conn.close()
+
+    assert _keys(_DiskTier(path)) == ["fresh"]
+
+
+def test_writes_purge_at_most_once_per_interval(tmp_path, monkeypatch):
+    disk = _DiskTier(str(tmp_path / "ai_cache.sqlite3"), purge_interval=60)
+    now = time.time()
+    disk.set("a", "Answer A", 1.0, now + 1)
+
+    monkeypatch.setattr(time, "time", lambda: now + 2) # "a" has expired, but the last purge was just now
+    disk.set("b", "Answer B", 1.0, now + 120)
+    assert _keys(disk) == ["a", "b"]
+    assert disk.get("a") is None # Expired entries are never served
+
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    disk.set("c", "Answer C", 1.0, now + 120)
+    assert _keys(disk) == ["b", "c"]
+
+
+def test_disk_entries_survive_restarts(tmp_path):
+    path = str(tmp_path / "ai_cache.sqlite3")
+    asyncio.run(AIResponseCache(maxsize=10, ttl=60, db_path=path).set("key", "Cached answer", 2.5))
+
+    restarted = AIResponseCache(maxsize=10, ttl=60, db_path=path)
+    assert asyncio.run(restarted.get("key")) == "Cached answer"
+    assert restarted.stats()["disk_hits"] == 1
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from firebase_admin import firestore
+
+import auth
+from cache import TTLCache
+
+
+@pytest.fixture
+def token_cache(monkeypatch):
+    cache = TTLCache(maxsize=10, ttl=3600.0, name="firebase_tokens")
+    monkeypatch.setattr(auth, "token_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def verified_tokens(monkeypatch):
+    """(token, check_revoked) of each firebase_auth.verify_id_token call, which accepts every token."""
+    verified = []
+
+    def fake_verify_id_token(token, check_revoked=False):
+        verified.append((token, check_revoked))
+        lifetime = 30 if token == "short-lived" else 3600
+        return {"uid": "user-1", "exp": time.time() + lifetime}
+
+    monkeypatch.setattr(auth.firebase_auth, "verify_id_token", fake_verify_id_token)
+    return verified
+
+
+def test_repeat_tokens_are_verified_once(token_cache, verified_tokens):
+    first = asyncio.run(auth.verify_firebase_token("token-1"))
+    second = asyncio.run(auth.verify_firebase_token("token-1"))
+
+    assert first == second
+    assert verified_tokens == [("token-1", False)]
+    assert (token_cache.hits, token_cache.misses) == (1, 1)
+
+
+def test_cache_is_keyed_by_the_token_hash(token_cache, verified_tokens):
+    asyncio.run(auth.verify_firebase_token("token-1"))
+
+    assert token_cache.get(hashlib.sha256(b"token-1").hexdigest()) is not None
+    assert token_cache.get("token-1") is None
+
+
+def test_entries_expire_with_the_token(token_cache, verified_tokens, monkeypatch):
+    asyncio.run(auth.verify_firebase_token("short-lived"))
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 31)
+    asyncio.run(auth.verify_firebase_token("short-lived"))
+
+    assert [token for token, _ in verified_tokens] == ["short-lived", "short-lived"]
+
+
+def test_revocation_checks_cap_the_cache_lifetime(token_cache, verified_tokens, monkeypatch):
+    monkeypatch.setattr(auth, "FIREBASE_CHECK_REVOKED", True)
+    monkeypatch.setattr(auth, "TOKEN_CACHE_REVOCATION_TTL_SECONDS", 60.0)
+    asyncio.run(auth.verify_firebase_token("token-1")) # Valid for another hour
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 59)
+    asyncio.run(auth.verify_firebase_token("token-1"))
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    asyncio.run(auth.verify_firebase_token("token-1"))
+
+    assert verified_tokens == [("token-1", True), ("token-1", True)]
+
+
+class _FakeUsersDb:
+    """Stands in for the Firestore client; counts reads of 'users/{uid}' documents."""
+
+    def __init__(self, users: dict):
+        self.users = users
+        self.reads = 0
+
+    def collection(self, name: str):
+        return SimpleNamespace(document=lambda user_id: SimpleNamespace(get=lambda: self._get(user_id)))
+
+    async def _get(self, user_id: str):
+        self.reads += 1
+        data = self.users.get(user_id)
+        return SimpleNamespace(exists=data is not None, id=user_id, to_dict=lambda: dict(data))
+
+
+@pytest.fixture
+def user_profile_cache(monkeypatch):
+    cache = TTLCache(maxsize=10, ttl=300.0, name="user_profiles")
+    monkeypatch.setattr(auth, "user_profile_cache", cache)
+    return cache
+
+
+def test_profiles_are_read_once_until_invalidated(user_profile_cache):
+    db = _FakeUsersDb({"user-1": {"username": "doctor1", "role": "doctor", "hashed_password": None}})
+
+    async def run():
+        first = await auth.get_user_profile(db, "user-1")
+        second = await auth.get_user_profile(db, "user-1")
+        reads_before_invalidation = db.reads
+        db.users["user-1"]["role"] = "patient"
+        auth.invalidate_user_profile("user-1")
+        return first, second, reads_before_invalidation, await auth.get_user_profile(db, "user-1")
+
+    first, second, reads_before_invalidation, refreshed = asyncio.run(run())
+    assert first is second and first.role == "doctor"
+    assert reads_before_invalidation == 1
+    assert refreshed.role == "patient" and db.reads == 2
+
+
+def test_missing_profiles_are_not_cached(user_profile_cache):
+    db = _FakeUsersDb({})
+
+    async def run():
+        missing = await auth.get_user_profile(db, "user-1")
+        db.users["user-1"] = {"username": "patient1", "role": "patient"} # e.g. created right after signup
+        return missing, await auth.get_user_profile(db, "user-1")
+
+    missing, created = asyncio.run(run())
+    assert missing is None
+    assert created.username == "patient1" and db.reads == 2
+
+
+class _FakeProfilesDb:
+    """Stands in for the Firestore client with stored documents keyed by (collection, id)."""
+
+    def __init__(self, documents: dict):
+        self.documents = documents
+
+    def collection(self, name: str):
+        return SimpleNamespace(document=lambda doc_id: _FakeDocRef(self.documents, (name, doc_id)))
+
+
+class _FakeDocRef:
+    def __init__(self, documents: dict, key: tuple):
+        self.documents = documents
+        self.key = key
+
+    async def get(self):
+        data = self.documents.get(self.key)
+        return SimpleNamespace(exists=data is not None, id=self.key[1], to_dict=lambda: dict(data))
+
+    async def update(self, data: dict):
+        now = datetime.now(timezone.utc)
+        self.documents[self.key].update({field: now if value is firestore.SERVER_TIMESTAMP else value for field, value in data.items()})
+        return SimpleNamespace(update_time=now)
+
+
+@pytest.fixture
+def firestore_db():
+    return _FakeProfilesDb({("doctor_profiles", "doctor-1"): {"user_id": "doctor-1", "bio": "", "created_at": datetime.now(timezone.utc)}})
+
+
+def test_updating_a_doctor_profile_invalidates_the_cached_user(client, user_profile_cache, current_user):
+    user_profile_cache.set("doctor-1", current_user)
+
+    response = client.request("PUT", "/doctor-profiles/doctor-1", json={"bio": "Cardiologist"})
+
+    assert response.status_code == 200
+    assert response.json()["bio"] == "Cardiologist"
+    assert user_profile_cache.get("doctor-1") is None
@@ -0,0 +1,107 @@
+import pytest
+
+import main
+import schemas
+
+CASE_FIELDS = {"name": "Headache", "age": 30, "gender": "female", "severity": "low", "symptoms": ["Headache"], "patient_id": "patient-1", "status": "pending"}
+
+
+def test_invalid_case_ids_are_rejected_per_item(client, firestore_api):
+    response = client.request("PATCH", "/patient-cases/bulk", json={"items": [
+        {"case_id": "cases/case-1", "status": "in_review"},
+        {"case_id": "case-2", "status": "in_review"},
+        {"case_id": "__case__", "status": "in_review"},
+    ]})
+
+    assert response.status_code == 200
+    assert [(item["case_id"], item["status_code"]) for item in response.json()] == [("cases/case-1", 400), ("case-2", 404), ("__case__", 400)]
+    assert firestore_api.reads == ["patientCases/case-2"]
+
+
+@pytest.mark.parametrize("current_user", [schemas.UserResponse(id="patient-1", username="patient1", role="patient")])
+def test_nothing_is_read_when_every_item_is_rejected(client, firestore_api, current_user):
+    response = client.request("PATCH", "/patient-cases/bulk", json={"items": [{"case_id": f"case-{i}", "status": "closed"} for i in range(3)]})
+
+    assert response.status_code == 200
+    assert [item["status_code"] for item in response.json()] == [403, 403, 403]
+    assert firestore_api.reads == []
+
+
+def test_claim_conflicts_only_fail_their_own_item(client, firestore_api):
+    firestore_api.documents["patientCases/case-1"] = dict(CASE_FIELDS)
+    firestore_api.documents["patientCases/case-2"] = {**CASE_FIELDS, "doctor_id": "doctor-2"}
+
+    response = client.request("PATCH", "/patient-cases/bulk", json={"items": [
+        {"case_id": "case-1", "doctor_id": "doctor-1"},
+        {"case_id": "case-2", "doctor_id": "doctor-1"},
+    ]})
+
+    assert [item["status_code"] for item in response.json()] == [200, 409]
+    assert firestore_api.documents["patientCases/case-1"]["doctor_id"] == "doctor-1"
+    assert firestore_api.documents["patientCases/case-2"]["doctor_id"] == "doctor-2"
+
+
+def test_concurrent_writes_to_the_cases_are_retried(client, firestore_api):
+    firestore_api.documents["patientCases/case-1"] = dict(CASE_FIELDS)
+    firestore_api.documents["patientCases/case-2"] = dict(CASE_FIELDS)
+
+    def doctor_raises_the_severity():
+        firestore_api.documents["patientCases/case-2"] = {**CASE_FIELDS, "severity": "high"}
+
+    firestore_api.abort_commits = 1
+    firestore_api.before_abort = doctor_raises_the_severity
+    response = client.request("PATCH", "/patient-cases/bulk", json={"items": [
+        {"case_id": "case-1", "status": "in_review"},
+        {"case_id": "case-2", "status": "in_review"},
+    ]})
+
+    assert [item["status_code"] for item in response.json()] == [200, 200]
+    assert response.json()[1]["case"]["severity"] == "high"
+    assert firestore_api.documents["patientCases/case-2"]["severity"] == "high"
+    assert firestore_api.documents["patientCases/case-2"]["status"] == "in_review"
+
+
+def test_a_transaction_that_gives_up_fails_only_its_chunk(client, firestore_api, monkeypatch):
+    monkeypatch.setattr(main, "BULK_UPDATE_TRANSACTION_SIZE", 1)
+    firestore_api.documents["patientCases/case-1"] = dict(CASE_FIELDS)
+    firestore_api.documents["patientCases/case-2"] = dict(CASE_FIELDS)
+    firestore_api.abort_commits = 5 # Every attempt of the first chunk's transaction
+    response = client.request("PATCH", "/patient-cases/bulk", json={"items": [
+        {"case_id": "case-1", "status": "in_review"},
+        {"case_id": "case-2", "status": "in_review"},
+    ]})
+
+    assert response.status_code == 200
+    assert [item["status_code"] for item in response.json()] == [500, 200]
+    assert firestore_api.documents["patientCases/case-1"]["status"] == "pending"
+    assert firestore_api.documents["patientCases/case-2"]["status"] == "in_review"
+
+
+def test_bulk_create_commits_one_write_batch(client, firestore_api):
+    items = [{k: v for k, v in CASE_FIELDS.items() if k != "patient_id"} for _ in range(5)]
+    response = client.request("POST", "/patient-cases/bulk", json={"items": items})
+
+    assert response.status_code == 200
+    assert [item["status_code"] for item in response.json()] == [201] * 5
+    assert len(firestore_api.commits) == 1 and len(firestore_api.commits[0]) == 5
+    assert {item["case_id"] for item in response.json()} == {path.split("/")[1] for path in firestore_api.documents}
+
+
+def test_bulk_create_reports_failed_batches_on_their_own(client, firestore_api, monkeypatch):
+    monkeypatch.setattr(main, "BULK_CREATE_BATCH_SIZE", 2)
+    real_commit = firestore_api.commit
+    commits = []
+
+    async def commit(request, **kwargs):
+        commits.append(request)
+        if len(commits) == 1:
+            raise RuntimeError("Deadline exceeded")
+        return await real_commit(request, **kwargs)
+
+    monkeypatch.setattr(firestore_api, "commit", commit)
+    items = [{k: v for k, v in CASE_FIELDS.items() if k != "patient_id"} for _ in range(3)]
+    response = client.request("POST", "/patient-cases/bulk", json={"items": items})
+
+    assert response.status_code == 200
+    assert [item["status_code"] for item in response.json()] == [500, 500, 201]
+    assert len(firestore_api.documents) == 1
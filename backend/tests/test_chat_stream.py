@@ -0,0 +1,185 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import status
+
+import chat_stream
+import main
+from chat_stream import SUBSCRIBER_OVERFLOW, ChatStreamHub, _CaseListener
+
+
+def _added(message_id: str, timestamp: datetime):
+    document = SimpleNamespace(id=message_id, to_dict=lambda: {
+        "patient_case_id": "case-1", "sender_id": "patient-1", "sender_type": "patient", "content": message_id, "timestamp": timestamp,
+    })
+    return SimpleNamespace(type=SimpleNamespace(name="ADDED"), document=document)
+
+
+def _pushed_ids(snapshots) -> list:
+    async def run():
+        hub = ChatStreamHub()
+        hub._loop = asyncio.get_running_loop()
+        listener = _CaseListener("case-1")
+        queue = asyncio.Queue()
+        listener.subscribers.add(queue)
+        for changes in snapshots(listener.started_at):
+            hub._on_snapshot(listener, changes)
+        await asyncio.sleep(0) # Let the call_soon_threadsafe fan-outs run
+        messages = [queue.get_nowait() for _ in range(queue.qsize())]
+        # Same shape as GET /chats, so clients can dedupe pushed and fetched messages on "_id"
+        assert all("_id" in message and "id" not in message for message in messages)
+        return [message["_id"] for message in messages]
+    return asyncio.run(run())
+
+
+def test_initial_snapshot_only_pushes_messages_posted_since_the_listener_started():
+    pushed = _pushed_ids(lambda started_at: [[
+        _added("history", started_at - timedelta(minutes=5)),
+        _added("while-starting", started_at + timedelta(milliseconds=50)),
+    ]])
+
+    assert pushed == ["while-starting"]
+
+
+def test_malformed_messages_are_skipped_without_stopping_the_listener():
+    def snapshots(started_at):
+        malformed = _added("malformed", started_at)
+        malformed.document.to_dict = lambda: {"patient_case_id": "case-1", "content": None, "timestamp": started_at}
+        return [[], [malformed, _added("new", datetime.now(timezone.utc))]]
+
+    assert _pushed_ids(snapshots) == ["new"]
+
+
+def test_later_snapshots_push_every_added_message():
+    pushed = _pushed_ids(lambda started_at: [
+        [],
+        [_added("late-write", started_at - timedelta(seconds=1)), _added("new", datetime.now(timezone.utc))],
+    ])
+
+    assert pushed == ["late-write", "new"]
+
+
+class _FailingListenerDb:
+    """Listener client whose on_snapshot fails once `release` is set."""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def collection(self, name: str):
+        return self
+
+    def where(self, filter):
+        return self
+
+    def on_snapshot(self, callback):
+        self.release.wait(timeout=5)
+        raise RuntimeError("Listen stream failed")
+
+
+def test_subscribers_joining_a_listener_that_fails_to_start_are_told_to_resync(monkeypatch):
+    listener_db = _FailingListenerDb()
+    monkeypatch.setattr(chat_stream, "get_firestore_listener_db", lambda: listener_db)
+
+    async def run():
+        hub = ChatStreamHub()
+        first = asyncio.create_task(hub.subscribe("case-1"))
+        while "case-1" not in hub._listeners:
+            await asyncio.sleep(0)
+        second = await hub.subscribe("case-1") # Joins the listener that is still starting
+        listener_db.release.set()
+        with pytest.raises(RuntimeError):
+            await first
+        return hub, second.get_nowait()
+
+    hub, message = asyncio.run(run())
+    assert message is SUBSCRIBER_OVERFLOW
+    assert hub.stats() == {"active_cases": 0, "subscribers": 0}
+
+
+def _websocket_session(app, path: str, client_frames=()) -> list:
+    """
+    Connects to a WebSocket route of the app (no server) and returns the messages the app sent. client_frames are
+    received after the connect; a callable is awaited with the sent messages and returns the frame.
+    """
+    incoming = [{"type": "websocket.connect"}, *client_frames]
+    sent = []
+
+    async def receive():
+        if not incoming:
+            return {"type": "websocket.disconnect", "code": 1000}
+        frame = incoming.pop(0)
+        return await frame(sent) if callable(frame) else frame
+
+    async def send(message):
+        sent.append(message)
+
+    path, _, query_string = path.partition("?")
+    scope = {
+        "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "server": ("testserver", 80), "client": ("testclient", 50000),
+        "root_path": "", "path": path, "raw_path": path.encode(), "query_string": query_string.encode(), "headers": [], "subprotocols": [],
+    }
+    asyncio.run(app(scope, receive, send))
+    return sent
+
+
+@pytest.fixture
+def authenticated_websocket(monkeypatch, firestore_db, current_user):
+    async def fake_get_current_firebase_user(token, db):
+        return current_user
+
+    monkeypatch.setattr(main, "get_firestore_db", lambda: firestore_db)
+    monkeypatch.setattr(main, "get_current_firebase_user", fake_get_current_firebase_user)
+
+
+def test_setup_errors_close_the_socket_as_internal_errors(authenticated_websocket, monkeypatch):
+    async def failing_get_case_access(db, case_id):
+        raise RuntimeError("Firestore unavailable")
+
+    monkeypatch.setattr(main, "_get_case_access", failing_get_case_access)
+    sent = _websocket_session(main.app, "/ws/chats/case-1?token=t")
+
+    assert [(message["type"], message.get("code")) for message in sent] == [("websocket.close", status.WS_1011_INTERNAL_ERROR)]
+
+
+def test_listener_start_failure_closes_the_accepted_socket(authenticated_websocket, monkeypatch):
+    async def cached_case_access(db, case_id):
+        return {"patient_id": "patient-1"}
+
+    async def failing_subscribe(case_id):
+        raise RuntimeError("Listen stream failed")
+
+    monkeypatch.setattr(main, "_get_case_access", cached_case_access)
+    monkeypatch.setattr(main.chat_hub, "subscribe", failing_subscribe)
+    sent = _websocket_session(main.app, "/ws/chats/case-1?token=t")
+
+    assert [message["type"] for message in sent] == ["websocket.accept", "websocket.close"]
+    assert sent[-1]["code"] == status.WS_1011_INTERNAL_ERROR
+
+
+def test_binary_frames_dont_end_the_stream(authenticated_websocket, monkeypatch):
+    queue = asyncio.Queue()
+
+    async def cached_case_access(db, case_id):
+        return {"patient_id": "patient-1"}
+
+    async def subscribe(case_id):
+        return queue
+
+    async def unsubscribe(case_id, subscriber_queue):
+        pass
+
+    async def push_then_disconnect(sent):
+        queue.put_nowait({"_id": "msg-1", "content": "Hello"})
+        while not any(message["type"] == "websocket.send" for message in sent):
+            await asyncio.sleep(0)
+        return {"type": "websocket.disconnect", "code": 1000}
+
+    monkeypatch.setattr(main, "_get_case_access", cached_case_access)
+    monkeypatch.setattr(main.chat_hub, "subscribe", subscribe)
+    monkeypatch.setattr(main.chat_hub, "unsubscribe", unsubscribe)
+    sent = _websocket_session(main.app, "/ws/chats/case-1?token=t", [{"type": "websocket.receive", "bytes": b"ping"}, push_then_disconnect])
+
+    assert [message["type"] for message in sent] == ["websocket.accept", "websocket.send"]
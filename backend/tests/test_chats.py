@@ -0,0 +1,142 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import main
+import schemas
+from conftest import order_fields
+
+
+@pytest.fixture
+def patient_case():
+    # Answered from the access cache, so the endpoint doesn't read the case document
+    main._remember_case_access("case-1", {"patient_id": "patient-1"})
+    yield "case-1"
+    main.invalidate_case_access("case-1")
+
+
+def test_latest_messages_order_by_timestamp_then_document_id(client, executed_queries, patient_case):
+    response = client.get(f"/chats/{patient_case}", params={"limit": 20})
+
+    assert response.status_code == 200
+    assert response.json() == []
+    assert response.headers["X-Has-More"] == "false"
+    (query,) = executed_queries
+    assert order_fields(query) == [("timestamp", "DESCENDING"), ("__name__", "DESCENDING")]
+    assert query._limit == 21
+
+
+def test_since_reads_newer_messages_oldest_first(client, executed_queries, patient_case):
+    response = client.get(f"/chats/{patient_case}", params={"since": "2024-05-01T10:00:00+00:00"})
+
+    assert response.status_code == 200
+    (query,) = executed_queries
+    assert order_fields(query) == [("timestamp", "ASCENDING"), ("__name__", "ASCENDING")]
+    assert query._start_at is not None
+
+
+def test_since_and_before_are_exclusive(client, executed_queries, patient_case):
+    response = client.get(f"/chats/{patient_case}", params={"since": "2024-05-01T10:00:00", "before": "2024-05-02T10:00:00"})
+
+    assert response.status_code == 400
+    assert executed_queries == []
+
+
+@pytest.mark.parametrize("current_user", [schemas.UserResponse(id="patient-2", username="patient2", role="patient")])
+def test_other_patients_cannot_read_the_chat(client, executed_queries, patient_case, current_user):
+    response = client.get(f"/chats/{patient_case}")
+
+    assert response.status_code == 403
+    assert executed_queries == []
+
+
+@pytest.mark.parametrize("cursor_param", ["since", "before"])
+def test_malformed_message_id_cursor_is_a_bad_request(client, executed_queries, patient_case, cursor_param):
+    response = client.get(f"/chats/{patient_case}", params={cursor_param: "chats/msg-1"})
+
+    assert response.status_code == 400
+    assert executed_queries == []
+
+
+
+def test_message_id_cursors_must_belong_to_the_case(client, firestore_api, executed_queries, patient_case):
+    firestore_api.documents["chats/msg-1"] = {"patient_case_id": "case-2", "content": "Hello"}
+    firestore_api.documents["chats/msg-2"] = {"patient_case_id": patient_case, "content": "Hello", "timestamp": datetime(2024, 5, 1, tzinfo=timezone.utc)}
+
+    assert client.get(f"/chats/{patient_case}", params={"before": "msg-1"}).status_code == 400
+    assert executed_queries == []
+    assert client.get(f"/chats/{patient_case}", params={"before": "msg-2"}).status_code == 200
+    assert len(executed_queries) == 1
+
+@pytest.fixture
+def case_access_cache():
+    main.case_access_cache.clear()
+    yield main.case_access_cache
+    main.case_access_cache.clear()
+
+
+CASE_FIELDS = {"name": "Headache", "age": 30, "gender": "female", "severity": "low", "symptoms": ["Headache"], "patient_id": "patient-1"}
+
+
+def test_chat_posts_reuse_the_case_read_by_the_case_endpoints(client, firestore_api, case_access_cache):
+    firestore_api.documents["patientCases/case-1"] = dict(CASE_FIELDS)
+
+    assert client.get("/patient-cases/case-1").status_code == 200
+    for content in ("First", "Second"):
+        response = client.request("POST", "/chats", json={"patient_case_id": "case-1", "sender_type": "doctor", "content": content})
+        assert response.status_code == 201
+
+    assert firestore_api.reads == ["patientCases/case-1"]
+    assert len(firestore_api.commits) == 2
+
+
+def test_missing_cases_are_not_cached(client, firestore_api, case_access_cache):
+    message = {"patient_case_id": "case-1", "sender_type": "doctor", "content": "Hello"}
+
+    assert client.request("POST", "/chats", json=message).status_code == 404
+    firestore_api.documents["patientCases/case-1"] = dict(CASE_FIELDS) # e.g. created by another worker
+    assert client.request("POST", "/chats", json=message).status_code == 201
+
+
+def test_case_updates_invalidate_the_cached_case(client, firestore_api, case_access_cache):
+    firestore_api.documents["patientCases/case-1"] = dict(CASE_FIELDS)
+    main._remember_case_access("case-1", CASE_FIELDS)
+
+    assert client.request("PUT", "/patient-cases/case-1", json={"status": "in_review"}).status_code == 200
+    assert case_access_cache.get("case-1") is None
+
+
+def test_chat_posts_update_the_case_chat_summary(client, firestore_api, case_access_cache):
+    firestore_api.documents["patientCases/case-1"] = dict(CASE_FIELDS)
+    long_message = "x" * (main.CHAT_PREVIEW_LENGTH + 10)
+
+    client.request("POST", "/chats", json={"patient_case_id": "case-1", "sender_type": "doctor", "content": "Hello"})
+    client.request("POST", "/chats", json={"patient_case_id": "case-1", "sender_type": "ai", "content": long_message})
+
+    case = firestore_api.documents["patientCases/case-1"]
+    assert case["message_count"] == 2
+    assert case["unread_by_patient"] == 2
+    assert "unread_by_doctor" not in case
+    assert case["last_message_preview"] == long_message[:main.CHAT_PREVIEW_LENGTH]
+    assert len([path for path in firestore_api.documents if path.startswith("chats/")]) == 2
+
+
+@pytest.mark.parametrize("current_user", [schemas.UserResponse(id="patient-1", username="patient1", role="patient")])
+def test_reading_a_chat_resets_only_the_readers_unread_count(client, firestore_api, case_access_cache, current_user):
+    firestore_api.documents["patientCases/case-1"] = {**CASE_FIELDS, "message_count": 3, "unread_by_doctor": 1, "unread_by_patient": 2}
+
+    assert client.request("POST", "/chats", json={"patient_case_id": "case-1", "sender_type": "patient", "content": "Thanks"}).status_code == 201
+    assert client.request("POST", "/chats/case-1/read").status_code == 204
+
+    case = firestore_api.documents["patientCases/case-1"]
+    assert (case["message_count"], case["unread_by_doctor"], case["unread_by_patient"]) == (4, 2, 0)
+
+
+def test_posting_to_a_deleted_cached_case_is_a_404(client, firestore_api, case_access_cache):
+    main._remember_case_access("case-1", CASE_FIELDS) # Cached before the case was deleted
+
+    response = client.request("POST", "/chats", json={"patient_case_id": "case-1", "sender_type": "doctor", "content": "Hello"})
+
+    assert response.status_code == 404
+    assert case_access_cache.get("case-1") is None
+    assert firestore_api.documents == {} # The message was not written either
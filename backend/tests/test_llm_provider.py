@@ -0,0 +1,53 @@
+import pytest
+
+from llm import FakeLLMProvider, LLMProvider, create_llm_provider
+
+
+def test_unknown_provider_names_the_valid_ones():
+    with pytest.raises(ValueError, match="Unknown LLM_PROVIDER 'gemnii'; valid providers are: fake, gemini"):
+        create_llm_provider("gemnii")
+
+
+def test_fake_provider_is_built_from_the_environment(monkeypatch):
+    monkeypatch.setenv("LLM_FAKE_LATENCY_DISTRIBUTION", "fixed")
+
+    provider = create_llm_provider("fake")
+
+    assert isinstance(provider, FakeLLMProvider)
+    assert provider.latency_distribution == "fixed"
+
+
+@pytest.mark.parametrize("settings, message", [
+    ({"latency_distribution": "normal"}, "Unknown fake LLM latency distribution 'normal'; valid distributions are: fixed, uniform, lognormal"),
+    ({"latency_mean_ms": -1}, "must not be negative"),
+    ({"latency_distribution": "uniform", "latency_stddev_ms": -1}, "must not be negative"),
+    ({"latency_mean_ms": 0}, "lognormal latency needs a positive mean"),
+    ({"tokens_per_second": 0}, "tokens_per_second must be positive"),
+    ({"response_tokens": -1}, "response_tokens must not be negative"),
+    ({"error_rate": 1.5}, "between 0 and 1"),
+    ({"error_rate": 0.6, "hang_rate": 0.6}, "add up to at most 1"),
+])
+def test_invalid_fake_provider_settings_fail_at_construction(settings, message):
+    with pytest.raises(ValueError, match=message):
+        FakeLLMProvider(**settings)
+
+
+def test_invalid_fake_provider_environment_fails_at_startup(monkeypatch):
+    monkeypatch.setenv("LLM_FAKE_TOKENS_PER_SECOND", "0")
+
+    with pytest.raises(ValueError, match="tokens_per_second must be positive"):
+        create_llm_provider("fake")
+
+
+def test_zero_latency_is_valid_for_every_distribution():
+    for distribution in FakeLLMProvider.latency_distributions:
+        assert FakeLLMProvider(latency_distribution=distribution, latency_mean_ms=0, latency_stddev_ms=0)._first_token_seconds() == 0
+
+
+def test_provider_must_implement_the_interface():
+    class IncompleteProvider(LLMProvider):
+        async def generate(self, prompt: str) -> str:
+            return ""
+
+    with pytest.raises(TypeError):
+        IncompleteProvider()
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+from google.api_core.exceptions import FailedPrecondition
+
+import migrate_symptoms
+
+
+class _FakeCasesDb:
+    """Synchronous client stand-in; the first commit fails as if a case had been edited after the page was read."""
+
+    def __init__(self, cases: dict):
+        self.cases = cases # case id -> symptoms
+        self.page_reads = 0
+        self.commits = []
+        self.conflicts = 1
+
+    def collection(self, name: str):
+        return self
+
+    def order_by(self, field_path: str):
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        self._after = None
+        return self
+
+    def start_after(self, position: dict):
+        self._after = position["__name__"]
+        return self
+
+    def get(self):
+        self.page_reads += 1
+        case_ids = sorted(case_id for case_id in self.cases if self._after is None or case_id > self._after)[:self._limit]
+        return [
+            SimpleNamespace(id=case_id, reference=case_id, update_time=f"v-{self.page_reads}",
+                            to_dict=lambda case_id=case_id: {"symptoms": self.cases[case_id]})
+            for case_id in case_ids
+        ]
+
+    def write_option(self, last_update_time):
+        return last_update_time
+
+    def batch(self):
+        updates = []
+        db = self
+
+        class Batch:
+            def update(self, reference, data, option=None):
+                updates.append((reference, data["symptoms"], option))
+
+            def commit(self):
+                if db.conflicts:
+                    db.conflicts -= 1
+                    db.cases["case-2"] = ["Edited"]
+                    raise FailedPrecondition("The document was updated after it was read")
+                db.commits.append(list(updates))
+                for reference, symptoms, _ in updates:
+                    db.cases[reference] = symptoms
+        return Batch()
+
+
+def test_changed_page_is_read_again_instead_of_overwritten(monkeypatch, tmp_path):
+    db = _FakeCasesDb({"case-1": '["Cough"]', "case-2": '["Fever"]', "case-3": ["Rash"]})
+    monkeypatch.setattr(migrate_symptoms.firestore, "client", lambda: db)
+
+    migrate_symptoms.migrate(batch_size=10, checkpoint_path=str(tmp_path / "checkpoint"))
+
+    assert db.cases == {"case-1": ["Cough"], "case-2": ["Edited"], "case-3": ["Rash"]}
+    assert db.commits == [[("case-1", ["Cough"], "v-2")]] # Guarded by the update time of the re-read
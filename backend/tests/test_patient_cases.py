@@ -0,0 +1,166 @@
+import base64
+import json
+from datetime import datetime, timezone
+
+import pytest
+from google.cloud.firestore_v1.async_query import AsyncQuery
+from fastapi.responses import ORJSONResponse
+from google.cloud.firestore_v1.document import DocumentSnapshot
+
+import main
+import schemas
+from conftest import order_fields
+from request_timing import current_request_stats
+
+CASE_FIELDS = {"name": "Headache", "age": 30, "gender": "female", "severity": "low", "symptoms": [], "patient_id": "patient-1"}
+
+
+def test_list_orders_by_timestamp_then_document_id(client, executed_queries):
+    response = client.get("/patient-cases", params={"limit": 5})
+
+    assert response.status_code == 200
+    assert response.json() == []
+    assert "X-Next-Cursor" not in response.headers
+    (query,) = executed_queries
+    assert order_fields(query) == [("timestamp", "DESCENDING"), ("__name__", "DESCENDING")]
+    assert query._limit == 6 # One extra document to detect the next page
+
+
+def test_cases_without_a_timestamp_are_skipped(client, monkeypatch, firestore_db):
+    cases = firestore_db.collection(u'patientCases')
+    stored = [
+        ("case-3", {"timestamp": datetime(2024, 5, 3, tzinfo=timezone.utc)}),
+        ("case-2", {"timestamp": datetime(2024, 5, 2, tzinfo=timezone.utc)}),
+        ("case-1", {"timestamp": None}),
+    ]
+
+    async def fake_get(self, *args, **kwargs):
+        return [DocumentSnapshot(cases.document(case_id), {**CASE_FIELDS, **data}, True, None, None, None) for case_id, data in stored]
+
+    monkeypatch.setattr(AsyncQuery, "get", fake_get)
+    response = client.get("/patient-cases", params={"limit": 2})
+
+    assert response.status_code == 200
+    assert [case["_id"] for case in response.json()] == ["case-3", "case-2"]
+    assert json.loads(base64.urlsafe_b64decode(response.headers["X-Next-Cursor"]))["id"] == "case-2"
+
+    stored[1][1]["timestamp"] = None
+    response = client.get("/patient-cases", params={"limit": 2})
+
+    assert response.status_code == 200
+    assert [case["_id"] for case in response.json()] == ["case-3"]
+    assert json.loads(base64.urlsafe_b64decode(response.headers["X-Next-Cursor"]))["id"] == "case-3"
+
+
+def test_summary_view_projects_listing_fields(client, executed_queries):
+    response = client.get("/patient-cases", params={"view": "summary"})
+
+    assert response.status_code == 200
+    (query,) = executed_queries
+    assert sorted(field.field_path for field in query._projection.fields) == sorted(schemas.PATIENT_CASE_SUMMARY_FIELDS)
+
+
+@pytest.mark.parametrize("current_user", [schemas.UserResponse(id="patient-1", username="patient1", role="patient")])
+def test_patients_only_list_their_own_cases(client, executed_queries, current_user):
+    response = client.get("/patient-cases")
+
+    assert response.status_code == 200
+    (query,) = executed_queries
+    (field_filter,) = query._field_filters
+    assert (field_filter.field.field_path, field_filter.value.string_value) == ("patient_id", "patient-1")
+
+
+def test_summary_and_full_views_name_the_id_alike():
+    case = {"id": "case-1", "name": "Headache", "severity": "low", "timestamp": "2024-05-01T10:00:00Z",
+            "patient_id": "patient-1", "age": 30, "gender": "female", "symptoms": []}
+
+    summary = schemas.PatientCaseSummary(**case).model_dump(by_alias=True)
+    full = schemas.PatientCaseResponse(**case).model_dump(by_alias=True)
+
+    assert summary["_id"] == full["_id"] == "case-1"
+    assert "id" not in summary
+
+
+def test_list_adapters_serialize_a_page_like_the_models_in_one_pass():
+    cases = [
+        {"id": f"case-{i}", "name": "Headache", "severity": "low", "timestamp": "2024-05-01T10:00:00Z",
+         "patient_id": "patient-1", "age": 30, "gender": "female", "symptoms": [], "status": "open"}
+        for i in range(3)
+    ]
+
+    for adapter, model in ((schemas.PATIENT_CASE_LIST, schemas.PatientCaseResponse),
+                           (schemas.PATIENT_CASE_SUMMARY_LIST, schemas.PatientCaseSummary)):
+        one_pass = json.loads(adapter.dump_json(adapter.validate_python(cases), by_alias=True))
+        per_model = [model(**case).model_dump(mode="json", by_alias=True) for case in cases]
+        assert one_pass == per_model
+
+
+def test_other_endpoints_default_to_orjson_responses():
+    assert main.app.router.default_response_class is ORJSONResponse
+    single_case_routes = [route for route in main.app.routes if getattr(route, "path", None) == "/patient-cases/{case_id}"]
+    assert single_case_routes and all(route.response_class is ORJSONResponse for route in single_case_routes)
+
+
+def test_list_serialization_is_reported_as_the_serialize_phase(client, executed_queries, monkeypatch):
+    endpoint_done_before_dump = []
+    real_dump_json = schemas.PATIENT_CASE_LIST.dump_json
+
+    def dump_json(*args, **kwargs):
+        endpoint_done_before_dump.append(current_request_stats().endpoint_done_at is not None)
+        return real_dump_json(*args, **kwargs)
+
+    monkeypatch.setattr(schemas.PATIENT_CASE_LIST, "dump_json", dump_json)
+    response = client.get("/patient-cases")
+
+    assert response.status_code == 200
+    assert endpoint_done_before_dump == [True]
+    assert "serialize;dur=" in response.headers["Server-Timing"]
+
+
+def test_update_claims_an_unassigned_case(client, firestore_api):
+    firestore_api.documents["patientCases/case-1"] = dict(CASE_FIELDS)
+
+    response = client.request("PUT", "/patient-cases/case-1", json={"status": "in_review"})
+
+    assert response.status_code == 200
+    assert response.json()["doctor_id"] == "doctor-1"
+    assert firestore_api.documents["patientCases/case-1"]["doctor_id"] == "doctor-1"
+    assert len(firestore_api.commits) == 1
+
+
+def test_another_doctor_can_edit_without_taking_over(client, firestore_api):
+    firestore_api.documents["patientCases/case-1"] = {**CASE_FIELDS, "doctor_id": "doctor-2"}
+
+    response = client.request("PUT", "/patient-cases/case-1", json={"doctor_notes": "Second opinion: likely migraine.", "severity": "medium"})
+
+    assert response.status_code == 200
+    assert response.json()["doctor_id"] == "doctor-2"
+    assert firestore_api.documents["patientCases/case-1"]["doctor_id"] == "doctor-2"
+    assert firestore_api.documents["patientCases/case-1"]["doctor_notes"] == "Second opinion: likely migraine."
+
+
+def test_claim_taken_while_the_transaction_ran_is_a_conflict(client, firestore_api):
+    firestore_api.documents["patientCases/case-1"] = dict(CASE_FIELDS)
+
+    def other_doctor_claims_first():
+        firestore_api.documents["patientCases/case-1"] = {**CASE_FIELDS, "doctor_id": "doctor-2"}
+
+    firestore_api.abort_commits = 1
+    firestore_api.before_abort = other_doctor_claims_first
+    response = client.request("PUT", "/patient-cases/case-1", json={"doctor_id": "doctor-1"})
+
+    assert response.status_code == 409
+    assert firestore_api.reads == ["patientCases/case-1", "patientCases/case-1"] # Read again by the retried transaction
+    assert firestore_api.documents["patientCases/case-1"]["doctor_id"] == "doctor-2"
+    assert firestore_api.commits == []
+
+
+@pytest.mark.parametrize("current_user", [schemas.UserResponse(id="patient-1", username="patient1", role="patient")])
+def test_new_cases_store_a_null_ai_recommendation_for_the_triage_sweep(client, firestore_api, current_user):
+    new_case = {field: value for field, value in CASE_FIELDS.items() if field != "patient_id"}
+    created = client.request("POST", "/patient-cases", json={**new_case, "ai_recommendation": ""}).json()
+    bulk_created = client.request("POST", "/patient-cases/bulk", json={"items": [new_case]}).json()[0]["case"]
+
+    for case_id in (created["_id"], bulk_created["_id"]):
+        stored = firestore_api.documents[f"patientCases/{case_id}"]
+        assert "ai_recommendation" in stored and stored["ai_recommendation"] is None
@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+from metrics import firestore_rpc_seconds
+from request_timing import RequestStats, _TimedStream, instrument_firestore_client
+
+
+async def _messages(count: int):
+    for index in range(count):
+        await asyncio.sleep(0)
+        yield index
+
+
+def _observations(rpc_name: str) -> int:
+    series = firestore_rpc_seconds._values.get((rpc_name,))
+    return series["count"] if series else 0
+
+
+def test_drained_stream_is_observed_once():
+    async def drain():
+        return [message async for message in _TimedStream(_messages(3), "test_drained", RequestStats(), 0.0)]
+
+    assert asyncio.run(drain()) == [0, 1, 2]
+    assert _observations("test_drained") == 1
+
+
+def test_stream_closed_after_first_message_is_observed():
+    # Like AsyncDocumentReference.get(), which returns after the first batch_get_documents message
+    stats = RequestStats()
+
+    async def first_message():
+        messages = _TimedStream(_messages(3), "test_first_message", stats, 0.0).__aiter__()
+        message = await messages.__anext__()
+        await messages.aclose()
+        return message
+
+    assert asyncio.run(first_message()) == 0
+    assert _observations("test_first_message") == 1
+    assert stats.phases["firestore"] > 0
+
+
+def test_instrumented_client_reports_firestore_counts(client, firestore_db, firestore_api):
+    firestore_api.documents["patientCases/case-1"] = {
+        "name": "Headache", "age": 30, "gender": "female", "severity": "low", "symptoms": [], "patient_id": "patient-1",
+    }
+    instrument_firestore_client(firestore_db)
+
+    read = client.get("/patient-cases/case-1")
+    update = client.request("PUT", "/patient-cases/case-1", json={"status": "in_review"})
+
+    assert read.status_code == update.status_code == 200
+    assert 'desc="rpcs=1 reads=1 writes=0 queries=0"' in read.headers["Server-Timing"]
+    # begin_transaction, the transactional read and the commit
+    assert 'desc="rpcs=3 reads=1 writes=1 queries=0"' in update.headers["Server-Timing"]
+
+
+def test_client_without_known_rpcs_is_reported(capsys):
+    client = SimpleNamespace(_firestore_api=object())
+
+    instrument_firestore_client(client)
+
+    assert "none of the expected Firestore RPCs" in capsys.readouterr().out
@@ -0,0 +1,79 @@
+import asyncio
+
+from llm import LLMCancelledError, StreamBroadcast, StreamFlights
+
+
+class _ControlledStream:
+    """Text stream yielding the chunks put on `pending`; None ends it."""
+
+    def __init__(self):
+        self.pending = asyncio.Queue()
+        self.closed = False
+
+    async def __aiter__(self):
+        while (text := await self.pending.get()) is not None:
+            yield text
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_reader_counts_before_it_is_iterated():
+    async def run():
+        stream = _ControlledStream()
+        broadcast = StreamBroadcast(stream)
+        first, second = broadcast.read(), broadcast.read() # second: a response whose body hasn't started yet
+
+        stream.pending.put_nowait("Hello")
+        assert await first.__anext__() == "Hello"
+        await first.aclose() # The first client leaves; the second still needs the generation
+        await asyncio.sleep(0)
+        assert not broadcast.done
+
+        stream.pending.put_nowait(" world")
+        stream.pending.put_nowait(None)
+        return [text async for text in second]
+
+    assert asyncio.run(run()) == ["Hello", " world"]
+
+
+def test_closing_the_last_reader_unread_cancels_the_generation():
+    async def run():
+        stream = _ControlledStream()
+        broadcast = StreamBroadcast(stream)
+        reader = broadcast.read()
+        await asyncio.sleep(0) # Pump waiting for the first chunk
+        await reader.aclose() # Never iterated, e.g. the client disconnected before the response started
+        await reader.aclose() # Releasing twice is harmless
+        await asyncio.sleep(0)
+        return broadcast, stream
+
+    broadcast, stream = asyncio.run(run())
+    assert broadcast.done and stream.closed
+    assert isinstance(broadcast.error, LLMCancelledError)
+
+
+def test_requests_after_a_cancellation_start_a_new_generation():
+    async def run():
+        flights = StreamFlights()
+        streams = []
+
+        async def open_stream():
+            streams.append(_ControlledStream())
+            return streams[-1]
+
+        cancelled = await flights.join("key", open_stream)
+        await cancelled.read().aclose() # The only client left; the pump has not stopped yet
+        assert flights.stats()["in_flight"] == 0
+
+        fresh = await flights.join("key", open_stream)
+        reader = fresh.read()
+        await asyncio.sleep(0) # The cancelled pump finishes and must not end the new flight
+        assert fresh is not cancelled and cancelled.done
+        assert flights.stats() == {"calls": 2, "coalesced": 0, "in_flight": 1}
+
+        streams[1].pending.put_nowait("Hello")
+        streams[1].pending.put_nowait(None)
+        return [text async for text in reader]
+
+    assert asyncio.run(run()) == ["Hello"]
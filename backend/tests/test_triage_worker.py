@@ -0,0 +1,170 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from google.api_core.exceptions import FailedPrecondition, NotFound
+
+import triage_worker
+from triage_worker import TriageWorker
+
+
+class _FakeDocRef:
+    def __init__(self, case_id: str, update_error: Exception = None):
+        self.id = case_id
+        self.update_error = update_error
+        self.updates = []
+        self.options = []
+
+    async def update(self, data: dict, option=None):
+        if self.update_error is not None:
+            raise self.update_error
+        self.updates.append(data)
+        self.options.append(option)
+
+
+class _FakeDb:
+    def __init__(self, cases: dict, doc_refs: dict):
+        self.cases = cases # case id -> stored data, None if missing
+        self.doc_refs = doc_refs
+
+    def collection(self, name: str):
+        return SimpleNamespace(document=lambda case_id: self.doc_refs[case_id])
+
+    def write_option(self, last_update_time):
+        return ("last_update_time", last_update_time)
+
+    async def get_all(self, doc_refs):
+        for doc_ref in doc_refs:
+            data = self.cases.get(doc_ref.id)
+            yield SimpleNamespace(
+                exists=data is not None, reference=doc_ref, to_dict=lambda data=data: data,
+                update_time=f"read-{doc_ref.id}",
+            )
+
+
+def test_batch_counts_each_case_once_and_saves_every_recommendation(monkeypatch):
+    doc_refs = {
+        "ok-1": _FakeDocRef("ok-1"),
+        "deleted": _FakeDocRef("deleted", update_error=NotFound("No document to update")),
+        "changed": _FakeDocRef("changed", update_error=FailedPrecondition("Document was updated since it was read")),
+        "write-error": _FakeDocRef("write-error", update_error=RuntimeError("unavailable")),
+        "ok-2": _FakeDocRef("ok-2"),
+        "reviewed": _FakeDocRef("reviewed"),
+        "generation-error": _FakeDocRef("generation-error"),
+    }
+    cases = {case_id: {"age": 40, "symptoms": ["Cough"], "medical_history": case_id} for case_id in doc_refs}
+    cases["reviewed"]["ai_recommendation"] = "Already there"
+
+    async def fake_generate_text(prompt: str, interactive: bool = True) -> str:
+        assert not interactive # Triage has its own concurrency budget
+        if "generation-error" in prompt:
+            raise RuntimeError("LLM down")
+        return " Rest and fluids. "
+
+    monkeypatch.setattr(triage_worker, "get_firestore_db", lambda: _FakeDb(cases, doc_refs))
+    monkeypatch.setattr(triage_worker, "generate_text", fake_generate_text)
+    monkeypatch.setattr(triage_worker, "AI_TRIAGE_MAX_ATTEMPTS", 1)
+
+    worker = TriageWorker()
+    asyncio.run(worker._process_batch(list(doc_refs)))
+
+    assert doc_refs["ok-1"].updates == doc_refs["ok-2"].updates == [{"ai_recommendation": "Rest and fluids."}]
+    assert doc_refs["ok-1"].options == [("last_update_time", "read-ok-1")] # Written only if unchanged since read
+    assert (worker.completed, worker.skipped, worker.failed) == (2, 3, 2)
+
+
+def test_backoff_between_attempts_does_not_hold_a_generation_slot(monkeypatch):
+    calls = []
+
+    async def fake_generate_text(prompt: str, interactive: bool = True) -> str:
+        calls.append(prompt)
+        if "flaky" in prompt and calls.count(prompt) == 1:
+            raise RuntimeError("busy")
+        return "Rest."
+
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(seconds: float):
+        await real_sleep(0)
+        # While the flaky case backs off, the other case takes the only slot
+        assert any("steady" in prompt for prompt in calls)
+
+    async def run():
+        return await asyncio.gather(
+            worker._triage_case({"medical_history": "flaky"}),
+            worker._triage_case({"medical_history": "steady"}),
+        )
+
+    monkeypatch.setattr(triage_worker, "AI_TRIAGE_MAX_PARALLEL", 1)
+    monkeypatch.setattr(triage_worker, "AI_TRIAGE_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(triage_worker, "generate_text", fake_generate_text)
+    monkeypatch.setattr(triage_worker.asyncio, "sleep", fake_sleep)
+
+    worker = TriageWorker()
+    assert asyncio.run(run()) == ["Rest.", "Rest."]
+    assert worker.retries == 1
+
+
+class _FakeSweepQuery:
+    def __init__(self, cases: dict):
+        self.cases = cases
+        self.filters = []
+
+    def where(self, filter):
+        self.filters.append((filter.field_path, getattr(filter.op_string, "name", filter.op_string))) # == None is IS_NULL
+        return self
+
+    def select(self, field_paths):
+        return self
+
+    async def stream(self):
+        for case_id, data in self.cases.items():
+            yield SimpleNamespace(id=case_id, to_dict=lambda data=data: data)
+
+
+def test_sweep_enqueues_recent_cases_without_a_recommendation(monkeypatch):
+    query = _FakeSweepQuery({"new-1": {}, "new-2": {}, "queued": {}}) # What Firestore returns for the filters
+    leases = SimpleNamespace(document=lambda lease_id: lease_id)
+    db = SimpleNamespace(collection=lambda name: leases if name == "workerLeases" else query, transaction=lambda: None)
+    monkeypatch.setattr(triage_worker, "get_firestore_db", lambda: db)
+
+    async def fake_acquire_sweep_lease(transaction, lease_ref, holder, duration):
+        return True
+    monkeypatch.setattr(triage_worker, "_acquire_sweep_lease", fake_acquire_sweep_lease)
+
+    async def run():
+        worker = TriageWorker()
+        worker._queue = asyncio.Queue()
+        worker.enqueue("queued") # e.g. created since the process started
+        queued = await worker.sweep()
+        return worker, queued, [worker._queue.get_nowait() for _ in range(worker._queue.qsize())]
+
+    worker, queued, queue = asyncio.run(run())
+    assert query.filters == [("ai_recommendation", "IS_NULL"), ("timestamp", ">=")]
+    assert queued == worker.swept == 2
+    assert queue == ["queued", "new-1", "new-2"]
+
+
+def test_sweep_is_skipped_while_another_process_holds_the_lease(monkeypatch, firestore_db, firestore_api):
+    monkeypatch.setattr(triage_worker, "get_firestore_db", lambda: firestore_db)
+    monkeypatch.setattr(triage_worker, "AI_TRIAGE_SWEEP_INTERVAL_SECONDS", 60)
+    lease_ref = firestore_db.collection("workerLeases").document("ai_triage_sweep")
+
+    async def run():
+        worker = TriageWorker()
+        worker._queue = asyncio.Queue()
+        other_holds = await triage_worker._acquire_sweep_lease(firestore_db.transaction(), lease_ref, "other-process", 60)
+        queued = await worker.sweep() # Returns before running the query, which the fake API would reject
+        renewed = await triage_worker._acquire_sweep_lease(firestore_db.transaction(), lease_ref, "other-process", 60)
+        return other_holds, queued, renewed
+
+    assert asyncio.run(run()) == (True, 0, True)
+    assert firestore_api.documents["workerLeases/ai_triage_sweep"]["holder"] == "other-process"
+
+
+def test_expired_leases_are_taken_over(firestore_db, firestore_api):
+    lease_ref = firestore_db.collection("workerLeases").document("ai_triage_sweep")
+    firestore_api.documents["workerLeases/ai_triage_sweep"] = {"holder": "stopped-process", "expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}
+
+    assert asyncio.run(triage_worker._acquire_sweep_lease(firestore_db.transaction(), lease_ref, "this-process", 60))
+    assert firestore_api.documents["workerLeases/ai_triage_sweep"]["holder"] == "this-process"
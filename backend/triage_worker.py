@@ -0,0 +1,271 @@
+import asyncio
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from firebase_admin import firestore
+from google.api_core.exceptions import FailedPrecondition, NotFound
+from google.cloud.firestore_v1.async_transaction import async_transactional
+
+from database import get_firestore_db
+from llm import generate_text
+from models import symptoms_from_firestore
+
+# Background worker filling PatientCaseBase.ai_recommendation for newly created cases.
+# create_patient_case only enqueues the case id; the worker collects ids into batches, reads each batch with one
+# get_all call, and generates recommendations with bounded parallelism. Generations go through llm.generate_text
+# with their own budget of AI_TRIAGE_MAX_PARALLEL calls, so a backlog never takes the interactive assistant's
+# slots; a slot is held only for the generation call, not for the backoff sleep between attempts. Busy/timeout/API
+# errors are retried with exponential backoff. Each recommendation is written on its own, so one failed write (e.g. a
+# case deleted meanwhile) doesn't lose the rest of the batch, and only if the case is unchanged since it was read:
+# a case edited meanwhile, or already given a recommendation by another process, is skipped rather than overwritten.
+# Cases can still miss their recommendation: dropped because the queue was full, out of attempts, or still queued
+# when the process stopped. A sweep at startup and then every AI_TRIAGE_SWEEP_INTERVAL_SECONDS re-enqueues the cases
+# created in the last AI_TRIAGE_SWEEP_LOOKBACK_HOURS that still have none (so a case that keeps failing is retried
+# on every sweep until it leaves the lookback window). Cases are created with an explicit null ai_recommendation
+# so the sweep only reads those. With several API processes, only the one holding the sweep lease (a Firestore
+# document taken in a transaction for one sweep interval) sweeps; the others skip until it expires.
+
+AI_TRIAGE_ENABLED = os.getenv("AI_TRIAGE_ENABLED", "true").lower() == "true"
+AI_TRIAGE_QUEUE_SIZE = int(os.getenv("AI_TRIAGE_QUEUE_SIZE", "1000"))
+AI_TRIAGE_BATCH_SIZE = int(os.getenv("AI_TRIAGE_BATCH_SIZE", "10"))
+AI_TRIAGE_BATCH_WAIT_SECONDS = float(os.getenv("AI_TRIAGE_BATCH_WAIT_SECONDS", "2"))
+AI_TRIAGE_MAX_PARALLEL = int(os.getenv("AI_TRIAGE_MAX_PARALLEL", "2"))
+AI_TRIAGE_MAX_ATTEMPTS = int(os.getenv("AI_TRIAGE_MAX_ATTEMPTS", "4"))
+AI_TRIAGE_BACKOFF_SECONDS = float(os.getenv("AI_TRIAGE_BACKOFF_SECONDS", "2"))
+AI_TRIAGE_SWEEP_INTERVAL_SECONDS = float(os.getenv("AI_TRIAGE_SWEEP_INTERVAL_SECONDS", "900")) # 0 disables the sweep
+AI_TRIAGE_SWEEP_LOOKBACK_HOURS = float(os.getenv("AI_TRIAGE_SWEEP_LOOKBACK_HOURS", "72"))
+SWEEP_LEASE_COLLECTION = u'workerLeases'
+SWEEP_LEASE_ID = u'ai_triage_sweep'
+
+TRIAGE_PROMPT_TEMPLATE = """
+You are a medical triage assistant. Based on the patient case below, give a short initial recommendation
+for the reviewing doctor (2-4 sentences): likely next steps, tests to consider and any red flags.
+
+PATIENT CASE:
+- Age: {age}
+- Gender: {gender}
+- Reported severity: {severity}
+- Symptoms: {symptoms}
+{history_line}
+This recommendation will be reviewed by a doctor. If the information is insufficient, say so.
+"""
+
+
+def build_triage_prompt(case_data: dict) -> str:
+    history = case_data.get("medical_history")
+    return TRIAGE_PROMPT_TEMPLATE.format(
+        age=case_data.get("age", "unknown"),
+        gender=case_data.get("gender", "unknown"),
+        severity=case_data.get("severity", "unknown"),
+        symptoms=", ".join(symptoms_from_firestore(case_data.get("symptoms"))) or "none reported",
+        history_line=f"- Medical History: {history}\n" if history else "",
+    )
+
+
+@async_transactional
+async def _acquire_sweep_lease(transaction, lease_ref, holder: str, duration: float) -> bool:
+    """Takes (or renews) the sweep lease for holder unless another process holds an unexpired one."""
+    snapshot = await lease_ref.get(transaction=transaction)
+    lease = snapshot.to_dict() if snapshot.exists else {}
+    now = datetime.now(timezone.utc)
+    if lease.get("holder") not in (None, holder) and lease["expires_at"] > now:
+        return False
+    transaction.set(lease_ref, {"holder": holder, "expires_at": now + timedelta(seconds=duration)})
+    return True
+
+
+class TriageWorker:
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+        self._queued_ids: set = set() # Queued or being processed; the sweep doesn't add them twice
+        self._slots = asyncio.Semaphore(AI_TRIAGE_MAX_PARALLEL)
+        self._lease_holder = uuid.uuid4().hex # This process, in the sweep lease
+        self.started_at: Optional[float] = None
+        self.enqueued = 0
+        self.dropped = 0 # Queue was full; the next sweep enqueues the case again
+        self.swept = 0 # Enqueued by the sweep
+        self.skipped = 0 # Case missing or already had a recommendation
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.in_progress = 0
+        self.generated = 0
+        self._total_generation_seconds = 0.0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=AI_TRIAGE_QUEUE_SIZE)
+            self.started_at = time.monotonic()
+            self._task = asyncio.create_task(self._run())
+            if AI_TRIAGE_SWEEP_INTERVAL_SECONDS > 0:
+                self._sweep_task = asyncio.create_task(self._sweep_periodically())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._sweep_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._sweep_task = None
+
+    def enqueue(self, case_id: str) -> bool:
+        """
+        Queues a case for triage without waiting; returns False if the worker is off, the queue is full or the
+        case is already queued.
+        """
+        if self._queue is None or case_id in self._queued_ids:
+            return False
+        try:
+            self._queue.put_nowait(case_id)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self._queued_ids.add(case_id)
+        self.enqueued += 1
+        return True
+
+    async def sweep(self) -> int:
+        """
+        Enqueues the recent cases that still have no AI recommendation; returns how many were queued (0 when
+        another process holds the sweep lease).
+        """
+        db = get_firestore_db()
+        lease_ref = db.collection(SWEEP_LEASE_COLLECTION).document(SWEEP_LEASE_ID)
+        if not await _acquire_sweep_lease(db.transaction(), lease_ref, self._lease_holder, AI_TRIAGE_SWEEP_INTERVAL_SECONDS):
+            return 0
+        created_after = datetime.now(timezone.utc) - timedelta(hours=AI_TRIAGE_SWEEP_LOOKBACK_HOURS)
+        # Needs the composite index (ai_recommendation, timestamp)
+        query = db.collection(u'patientCases') \
+            .where(filter=firestore.FieldFilter("ai_recommendation", "==", None)) \
+            .where(filter=firestore.FieldFilter("timestamp", ">=", created_after)) \
+            .select(["__name__"]) # Only the ids are needed
+        queued = 0
+        async for snapshot in query.stream():
+            if self._queue.full(): # The rest waits for the next sweep
+                break
+            if self.enqueue(snapshot.id):
+                queued += 1
+        self.swept += queued
+        return queued
+
+    async def _sweep_periodically(self) -> None:
+        while True:
+            try:
+                queued = await self.sweep()
+                if queued:
+                    print(f"AI triage sweep queued {queued} cases without a recommendation.")
+            except Exception as e:
+                print(f"Error in AI triage sweep: {type(e).__name__} - {e}")
+            await asyncio.sleep(AI_TRIAGE_SWEEP_INTERVAL_SECONDS)
+
+    async def _next_batch(self) -> List[str]:
+        case_ids = [await self._queue.get()]
+        deadline = time.monotonic() + AI_TRIAGE_BATCH_WAIT_SECONDS
+        while len(case_ids) < AI_TRIAGE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                case_ids.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return case_ids
+
+    async def _run(self) -> None:
+        while True:
+            case_ids = await self._next_batch()
+            try:
+                await self._process_batch(case_ids) # Counts every case as completed, skipped or failed
+            except Exception as e:
+                print(f"Error in AI triage batch: {type(e).__name__} - {e}")
+            finally:
+                self._queued_ids.difference_update(case_ids)
+
+    async def _process_batch(self, case_ids: List[str]) -> None:
+        db = get_firestore_db()
+        doc_refs = [db.collection(u'patientCases').document(case_id) for case_id in dict.fromkeys(case_ids)]
+        try:
+            snapshots = [snapshot async for snapshot in db.get_all(doc_refs)]
+        except Exception as e:
+            self.failed += len(doc_refs)
+            print(f"Error reading AI triage batch: {type(e).__name__} - {e}")
+            return
+
+        pending = []
+        for snapshot in snapshots:
+            case_data = snapshot.to_dict() if snapshot.exists else None
+            if not case_data or case_data.get("ai_recommendation"):
+                self.skipped += 1
+                continue
+            pending.append((snapshot.reference, snapshot.update_time, case_data))
+
+        self.in_progress += len(pending)
+        results = await asyncio.gather(*(self._triage_case(case_data) for _, _, case_data in pending))
+        self.in_progress -= len(pending)
+
+        writes = []
+        for (doc_ref, update_time, _), recommendation in zip(pending, results):
+            if recommendation is None:
+                self.failed += 1
+                continue
+            option = db.write_option(last_update_time=update_time)
+            writes.append(self._save_recommendation(doc_ref, recommendation, option))
+        await asyncio.gather(*writes)
+
+    async def _save_recommendation(self, doc_ref, recommendation: str, option) -> None:
+        try:
+            await doc_ref.update({"ai_recommendation": recommendation}, option=option)
+        except (NotFound, FailedPrecondition): # Case deleted or changed while its recommendation was generated
+            self.skipped += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"Error saving AI triage recommendation for case {doc_ref.id}: {type(e).__name__} - {e}")
+        else:
+            self.completed += 1
+
+    async def _triage_case(self, case_data: dict) -> Optional[str]:
+        """The generated recommendation, or None once every attempt failed."""
+        prompt = build_triage_prompt(case_data)
+        for attempt in range(1, AI_TRIAGE_MAX_ATTEMPTS + 1):
+            try:
+                async with self._slots:
+                    started_at = time.perf_counter()
+                    recommendation = await generate_text(prompt, interactive=False) # Bounded by self._slots
+                self.generated += 1
+                self._total_generation_seconds += time.perf_counter() - started_at
+                return recommendation.strip()
+            except Exception as e:
+                if attempt == AI_TRIAGE_MAX_ATTEMPTS:
+                    print(f"AI triage gave up after {attempt} attempts: {type(e).__name__} - {e}")
+                    return None
+                self.retries += 1
+                backoff = AI_TRIAGE_BACKOFF_SECONDS * (2 ** (attempt - 1))
+                await asyncio.sleep(backoff + random.uniform(0, backoff / 2)) # Jitter spreads retries out
+
+    def stats(self) -> dict:
+        uptime = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "in_progress": self.in_progress,
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "dropped": self.dropped,
+            "swept": self.swept,
+            "retries": self.retries,
+            "avg_generation_seconds": round(self._total_generation_seconds / self.generated, 3) if self.generated else None,
+            "throughput_per_minute": round(self.completed / uptime * 60, 2) if uptime else 0.0,
+        }
+
+
+triage_worker = TriageWorker()